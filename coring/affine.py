@@ -9,9 +9,13 @@ import os
 import unittest
 
 import numpy
+import pandas
 
-from tabular.csvio import createWithCSV
+from tabular.csvio import createWithCSV, validData
+import tabular.csvio as csvio
 from tabular.columns import TabularDatatype, TabularFormat, ColumnIdentity
+import tabular.pandasutils as PU
+import tabular.validation as TV
 from .columns import namesToIds, CoreIdentityCols
 
 
@@ -28,7 +32,8 @@ ShiftedTieCSF = ColumnIdentity("ShiftedTieCSF", ["Shifted Tie CSF-A", "Shift tie
 FormatSpecificCols = [DepthCSF, DepthCCSF, Offset, DifferentialOffset, GrowthRate, ShiftType, FixedCore, FixedTieCSF, ShiftedTieCSF]
 
 AffineColumns = CoreIdentityCols + FormatSpecificCols + namesToIds(["DataUsed", "Comment"])
-AffineFormat = TabularFormat("Affine Table", AffineColumns)
+AffineRules = [TV.uniqueKeys(['Site', 'Hole', 'Core', 'Tool'])]
+AffineFormat = TabularFormat("Affine Table", AffineColumns, AffineRules)
 
 
 class AffineTable:
@@ -38,7 +43,7 @@ class AffineTable:
         
     @classmethod
     def createWithFile(cls, filepath):
-        dataframe = createWithCSV(filepath, AffineFormat)
+        dataframe = createWithCSV(filepath, AffineFormat, passThrough=False, numericDatatype=numpy.float64)
         return cls(os.path.basename(filepath), dataframe)
     
     def getSites(self):
@@ -53,6 +58,27 @@ class AffineTable:
             log.warning("AffineTable: Found multiple matches for core {}{}-{}{}".format(site, hole, core, tool))
         return cores.iloc[0]['Offset']
     
+    # Join rows of dataframe to the affine rows of their cores on Site, Hole and Core.
+    # Returns a tuple of numpy arrays (affine row positions, dataframe row positions) with
+    # an element for each matching pair, ordered by affine row, then dataframe row.
+    # Compact identity columns (see csvio.setCompactIdentity()) are joined on their codes.
+    def joinCores(self, dataframe):
+        keys = ['Site', 'Hole', 'Core']
+        codeKeys = PU.categoryKeys([self.dataframe, dataframe], keys)
+        if codeKeys is not None:
+            affineKeys, rowKeys = pandas.DataFrame({'Key': codeKeys[0]}), pandas.DataFrame({'Key': codeKeys[1]})
+            keys = ['Key']
+        else:
+            affineKeys = pandas.DataFrame({k: self.dataframe[k].to_numpy(dtype=object) for k in keys})
+            rowKeys = pandas.DataFrame({k: dataframe[k].to_numpy(dtype=object) for k in keys})
+        affineKeys['AffinePos'] = numpy.arange(len(affineKeys))
+        rowKeys['RowPos'] = numpy.arange(len(rowKeys))
+        joined = affineKeys.merge(rowKeys, on=keys, how='inner')
+        affinePositions = joined['AffinePos'].to_numpy()
+        rowPositions = joined['RowPos'].to_numpy()
+        order = numpy.lexsort((rowPositions, affinePositions))
+        return affinePositions[order], rowPositions[order]
+
     def allRows(self):
         allrows = []
         for _, row in self.dataframe.iterrows():
@@ -107,6 +133,35 @@ class Tests(unittest.TestCase):
         self.assertTrue(len(aff.dataframe) == 94)
         self.assertTrue(sorted(aff.getSites()) == ['1'])
         self.assertTrue(aff.getOffset('1', 'B', '2', 'H') == 0.298)
+
+    def test_validate(self):
+        aff = AffineTable.createWithFile("../testdata/GLAD9_Site1_Affine.csv")
+        ss = pandas.DataFrame({'Site': ['1', '1'], 'Hole': ['A', 'B'], 'Core': ['1', '2']})
+        report = validData(aff.dataframe, AffineFormat, [TV.keysIn(['Site', 'Hole', 'Core'], ss, "Section Summary")])
+        self.assertTrue(report.isValid()) # missing cores are a warning
+        rule, rows = report.getWarnings()[0]
+        self.assertTrue(len(rows) == 92 and 0 not in rows) # only A1 and B2 found
+        aff.dataframe.loc[5, 'Core'] = aff.dataframe.loc[4, 'Core']
+        self.assertTrue(list(validData(aff.dataframe, AffineFormat).getWarnings()[0][1]) == [4, 5]) # duplicate core
+
+    def test_join_cores(self):
+        aff = AffineTable.createWithFile("../testdata/GLAD9_Site1_Affine.csv")
+        rows = pandas.DataFrame({'Site':['1', '1', '1', '1'], 'Hole':['B', 'Z', 'B', 'A'], 'Core':['2', '2', '2', '1']})
+        affinePositions, rowPositions = aff.joinCores(rows)
+        self.assertTrue(list(rowPositions) == [3, 0, 2])
+        self.assertTrue(list(aff.dataframe.Hole.iloc[affinePositions]) == ['A', 'B', 'B'])
+        self.assertTrue(affinePositions[1] == affinePositions[2])
+
+        csvio.setCompactIdentity(True) # join on category codes
+        try:
+            csvio.clearIdentityCategories()
+            aff = AffineTable.createWithFile("../testdata/GLAD9_Site1_Affine.csv")
+            PU.forceCategoricalDatatype(rows, ['Site', 'Hole', 'Core'], csvio.IdentityCategories)
+            self.assertTrue(PU.categoryKeys([aff.dataframe, rows], ['Site', 'Hole', 'Core']) is not None)
+            compactPositions = aff.joinCores(rows)
+            self.assertTrue(all(list(a) == list(b) for a, b in zip(compactPositions, (affinePositions, rowPositions))))
+        finally:
+            csvio.setCompactIdentity(False)
         
 if __name__ == "__main__":
     unittest.main()    
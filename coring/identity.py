@@ -7,6 +7,9 @@ Parsing of core naming formats e.g. LacCore, IODP
 '''
 
 import re
+import unittest
+
+import pandas
 
 # Only attempting LacCore format for now:
 # ex. GLAD7-MAL05-1B-32E-4-A
@@ -102,8 +105,46 @@ def parseIdentity(idstr):
         ci = CoreIdentity(name, site, hole, core, tool, sec, half)
         return ci
 
+# Vectorized parsing of a whole column of section IDs, in the LacCore and IODP forms described above.
+# LacCore name is Expedition + Lake/Year, IODP name is Expedition alone. IODP site is U + # or, for
+# older (ODP/DSDP) IDs, a bare number.
+LacCorePattern = re.compile(r"^(?P<Name>[^-]+-[^-]+)-(?P<Site>[0-9]+)(?P<Hole>[A-Z]+)-(?P<Core>[0-9]+)(?P<Tool>[A-Z]+)-(?P<Section>[^-]+)(?:-(?P<Half>[^-]+))?$")
+IODPPattern = re.compile(r"^(?P<Name>[^-]+)-(?P<Site>[A-Z]?[0-9]+)(?P<Hole>[A-Z]+)-(?P<Core>[0-9]+)(?P<Tool>[A-Z]+)-(?P<Section>[^-]+)(?:-(?P<Half>[^-]+))?$")
+ValidHalves = ['A', 'W', 'WR'] # archive, working, whole-round
+
+# Parse a Series of section ID strings into a DataFrame with string columns
+# Name, Site, Hole, Core, Tool, Section and Half, indexed like idstrs. LacCore form
+# is tried first, then IODP for rows it didn't match. Components of unparseable IDs,
+# and invalid or absent halves, are NaN.
+def parseIdentities(idstrs):
+    idstrs = idstrs.astype(str).str.strip()
+    ids = idstrs.str.extract(LacCorePattern)
+    unmatched = ids['Site'].isnull().to_numpy()
+    if unmatched.any():
+        ids.loc[unmatched, :] = idstrs[unmatched].str.extract(IODPPattern).to_numpy()
+    ids['Half'] = ids['Half'].where(ids['Half'].isin(ValidHalves))
+    return ids
+
+
+class Tests(unittest.TestCase):
+    def test_parse_identities(self):
+        idstrs = pandas.Series(["GLAD7-MAL05-1B-32E-4-A", "327-U1363B-2H-5-A", "TDP-TOW15-1B-23H-2", "178-1098B-1H-CC",
+                                "FOO-BAR69-6Z-3A-4-J", "FOO-BAR69-6Z-3A", "", float('nan')], index=[5, 4, 3, 2, 1, 0, 0, 0])
+        ids = parseIdentities(idstrs)
+        self.assertTrue(list(ids.columns) == ['Name', 'Site', 'Hole', 'Core', 'Tool', 'Section', 'Half'])
+        self.assertTrue(list(ids.index) == list(idstrs.index))
+        self.assertTrue(list(ids.iloc[0]) == ['GLAD7-MAL05', '1', 'B', '32', 'E', '4', 'A'])
+        self.assertTrue(list(ids.iloc[1]) == ['327', 'U1363', 'B', '2', 'H', '5', 'A'])
+        self.assertTrue(list(ids.iloc[2, :6]) == ['TDP-TOW15', '1', 'B', '23', 'H', '2'])
+        self.assertTrue(list(ids.iloc[3, :6]) == ['178', '1098', 'B', '1', 'H', 'CC'])
+        self.assertTrue(list(ids.iloc[4, :6]) == ['FOO-BAR69', '6', 'Z', '3', 'A', '4'])
+        self.assertTrue(ids['Half'].isnull().tolist() == [False, False, True, True, True, True, True, True]) # J is not a valid half
+        self.assertTrue(ids.iloc[5:].isnull().all().all()) # unparseable
+
+        # same components as parseIdentity() for LacCore IDs
+        for idstr, (_, row) in zip(idstrs.iloc[[0, 2]], ids.iloc[[0, 2]].iterrows()):
+            ci = parseIdentity(idstr)
+            self.assertTrue([ci.name, ci.site, ci.hole, ci.core, ci.tool, ci.section] == list(row[:6]))
+
 if __name__ == "__main__":
-    parseIdentity("TDP-TOW15-1B-23H-2")
-    parseIdentity("GLAD07-MAL05-12A-1X-5")
-    parseIdentity("FOO-BAR69-6Z-3A-4-A")
-    parseIdentity("FOO-BAR69-6Z-3A-4-J")
\ No newline at end of file
+    unittest.main()
\ No newline at end of file
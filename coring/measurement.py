@@ -9,9 +9,15 @@ Routines and classes for the processing of measurement data files
 import os
 import unittest
 
-from tabular.csvio import createWithCSV
+import numpy
+import pandas
+
+from tabular.csvio import createWithCSV, createChunksWithCSV, mapToFormat
+import tabular.csvio as csvio
+from tabular.pandasutils import readFile, categoryKeys, forceCategoricalDatatype
 from tabular.columns import TabularFormat
 from .columns import SectionIdentityCols
+from .utils import splitSectionID
 
         
 MeasurementCols =  SectionIdentityCols # client is responsible for renaming Depth column
@@ -23,10 +29,19 @@ class MeasurementData:
         self.depthColumn = depthColumn
         self.df = dataframe
         
+    # passThrough: see createWithCSV(), e.g. a list of columns to read along with identity columns
     @classmethod
-    def createWithFile(cls, filepath, depthColumn):
-        dataframe = createWithCSV(filepath, MeasurementFormat)
+    def createWithFile(cls, filepath, depthColumn, passThrough=True):
+        dataframe = createWithCSV(filepath, MeasurementFormat, splitSectionID, passThrough)
         return cls(os.path.basename(filepath), depthColumn, dataframe)
+
+    # yield a MeasurementData for each chunksize rows of filepath, for files too large to load at once.
+    # depthColumn and depthColumns are read as float64, all other columns as strings, see createChunksWithCSV()
+    @classmethod
+    def createChunksWithFile(cls, filepath, depthColumn, chunksize, depthColumns=None, encoding='utf-8-sig'):
+        dtypes = {col: numpy.float64 for col in [depthColumn] + (depthColumns or [])}
+        for dataframe in createChunksWithCSV(filepath, MeasurementFormat, chunksize, splitSectionID, dtypes, encoding):
+            yield cls(os.path.basename(filepath), depthColumn, dataframe)
     
     # includes depths == mindepth or maxdepth
     def getByRange(self, mindepth, maxdepth):
@@ -46,6 +61,51 @@ class MeasurementData:
     def getByRangeFullID(self, mindepth, maxdepth, site, hole, core, sections):
         return self.df[(self._depth() >= mindepth) & (self._depth() <= maxdepth) & (self.df.Site == site) & (self.df.Hole == hole) & (self.df.Core == core) & (self.df.Section.isin(sections))]
 
+    # Batch form of getByRangeFullID() for many intervals: sites, holes, cores, mindepths and maxdepths
+    # are aligned sequences with one element per interval, sectionLists a list of lists of section IDs.
+    # Rows are sorted once by core and depth, then each interval's depth range is found by binary search
+    # within its core's rows. If wholeSections is True, depths are ignored as in getByFullID().
+    # Returns a list of numpy arrays of matching row positions, one per interval, in dataframe order.
+    def getIntervalRowPositions(self, sites, holes, cores, mindepths, maxdepths, sectionLists, wholeSections=False):
+        df = self.df
+        coreCodes, intervalCodes = self._coreCodes(sites, holes, cores)
+        sectionCodes, sectionKeys = pandas.factorize(df.Section)
+        depths = self._depth().to_numpy(dtype=numpy.float64)
+
+        order = numpy.lexsort((depths, coreCodes)) # NaN depths sort to the end of their core's rows
+        sortedCodes = coreCodes[order]
+        sortedDepths = depths[order]
+
+        positions = []
+        for code, mindepth, maxdepth, sections in zip(intervalCodes, mindepths, maxdepths, sectionLists):
+            if code == -1 or (not wholeSections and (numpy.isnan(mindepth) or numpy.isnan(maxdepth))):
+                positions.append(numpy.array([], dtype=numpy.int64))
+                continue
+            lo = numpy.searchsorted(sortedCodes, code, side='left')
+            hi = numpy.searchsorted(sortedCodes, code, side='right')
+            if not wholeSections: # includes depths == mindepth or maxdepth
+                coreDepths = sortedDepths[lo:hi]
+                lo, hi = lo + numpy.searchsorted(coreDepths, mindepth, side='left'), lo + numpy.searchsorted(coreDepths, maxdepth, side='right')
+            candidates = order[lo:hi]
+            inSections = numpy.isin(sectionCodes[candidates], sectionKeys.get_indexer(sections))
+            positions.append(numpy.sort(candidates[inSections]))
+        return positions
+
+    # Codes of the cores of rows and of the cores given by aligned sequences sites, holes and cores,
+    # the same code for the same core, -1 for given cores with no rows. Compact identity columns
+    # (see csvio.setCompactIdentity()) are factorized on their category codes rather than values.
+    def _coreCodes(self, sites, holes, cores):
+        keys = ['Site', 'Hole', 'Core']
+        given = pandas.DataFrame({'Site': sites, 'Hole': holes, 'Core': cores}, dtype=object)
+        if all(isinstance(self.df[k].dtype, pandas.CategoricalDtype) for k in keys): # given values not in categories get new codes
+            forceCategoricalDatatype(given, keys, max((self.df[k].cat.categories for k in keys), key=len))
+        codeKeys = categoryKeys([self.df, given], keys)
+        if codeKeys is not None:
+            coreCodes, coreKeys = pandas.factorize(codeKeys[0])
+            return coreCodes, pandas.Index(coreKeys).get_indexer(codeKeys[1])
+        coreCodes, coreKeys = pandas.factorize(pandas.MultiIndex.from_arrays([self.df[k] for k in keys]))
+        return coreCodes, coreKeys.get_indexer(list(zip(sites, holes, cores)))
+
     def getByFullID(self, site, hole, core, sections):
         return self.df[(self.df.Site == site) & (self.df.Hole == hole) & (self.df.Core == core) & (self.df.Section.isin(sections))]
 
@@ -67,5 +127,45 @@ class Tests(unittest.TestCase):
         self.assertTrue(len(md.getByRangeFullID(74.0, 78.0, '1', 'A', '25', ['1', '2', '3'])) == 289)
         self.assertTrue(len(md.getByFullID('1', 'A', '25', ['1', '2', '3'])) == 289)
         self.assertTrue(len(md.getByCore('25')) == 643)
+
+    def test_create_with_section_id(self):
+        md = MeasurementData.createWithFile("../testdata/GLAD9_Site1_XRF.csv", depthColumn="Sediment Depth, scaled (MBS / CSF-B)")
+        df = readFile("../testdata/GLAD9_Site1_XRF.csv", na_values=['?', '??', '???'])
+        df = df.drop(['Site', 'Hole', 'Core', 'CoreType', 'Section'], axis=1) # SectionID only
+        df = mapToFormat(df, MeasurementFormat, splitSectionID)
+        for col in ['Site', 'Hole', 'Core', 'Tool', 'Section']:
+            self.assertTrue(df[col].equals(md.df[col]))
+
+    def test_create_with_key_columns(self): # raw-rows mode reads key columns only
+        depthCol = "Sediment Depth, scaled (MBS / CSF-B)"
+        md = MeasurementData.createWithFile("../testdata/GLAD9_Site1_XRF.csv", depthCol, passThrough=[depthCol, 'SectionID'])
+        self.assertTrue(list(md.df.columns) == ['SectionID', 'Site', 'Hole', 'Core', 'Tool', 'Section', depthCol])
+        self.assertTrue(len(md.df) == 6411)
+
+    def test_interval_row_positions(self):
+        md = MeasurementData.createWithFile("../testdata/GLAD9_Site1_XRF.csv", depthColumn="Sediment Depth, scaled (MBS / CSF-B)")
+        intervals = [(74.0, 76.0, '1', 'A', '25', ['1']), (74.0, 78.0, '1', 'A', '25', ['2', '3']), (74.0, 78.0, '1', 'A', '25', ['1', '2', '3']),
+                     (74.0, 78.0, '1', 'Z', '25', ['1']), (78.0, 74.0, '1', 'A', '25', ['1'])]
+        mins, maxs, sites, holes, cores, sectionLists = zip(*intervals)
+        for wholeSections in [False, True]:
+            positions = md.getIntervalRowPositions(sites, holes, cores, mins, maxs, sectionLists, wholeSections)
+            for (mindepth, maxdepth, site, hole, core, sections), rowPositions in zip(intervals, positions):
+                if wholeSections:
+                    expected = md.getByFullID(site, hole, core, sections)
+                else:
+                    expected = md.getByRangeFullID(mindepth, maxdepth, site, hole, core, sections)
+                self.assertTrue(list(md.df.index[rowPositions]) == list(expected.index))
+
+        csvio.setCompactIdentity(True) # cores found by category codes
+        try:
+            compact = MeasurementData.createWithFile("../testdata/GLAD9_Site1_XRF.csv", depthColumn="Sediment Depth, scaled (MBS / CSF-B)")
+            self.assertTrue(isinstance(compact.df.Core.dtype, pandas.CategoricalDtype))
+            for wholeSections in [False, True]:
+                positions = md.getIntervalRowPositions(sites, holes, cores, mins, maxs, sectionLists, wholeSections)
+                compactPositions = compact.getIntervalRowPositions(sites, holes, cores, mins, maxs, sectionLists, wholeSections)
+                self.assertTrue(all(list(p) == list(c) for p, c in zip(positions, compactPositions)))
+        finally:
+            csvio.setCompactIdentity(False)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
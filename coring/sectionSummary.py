@@ -9,9 +9,13 @@ import math
 import os
 import unittest
 
+import numpy
+import pandas
+
 from tabular.csvio import createWithCSV, FormatError
 from tabular.columns import TabularDatatype, TabularFormat, ColumnIdentity
 import tabular.pandasutils as PU
+import tabular.validation as TV
 from .columns import SectionIdentityCols
 
 # format-specific columns
@@ -23,31 +27,151 @@ CuratedLength = ColumnIdentity("CuratedLength", ["Length"], desc="Length of core
 Gaps = ColumnIdentity("Gaps", desc="Section intervals to be treated as gaps: 0+ pairs of form top1-bot1 top2-bot2...", unit='cm', optional=True)
 
 SectionSummaryColumns = SectionIdentityCols + [TopDepth, BottomDepth, TopDepthScaled, BottomDepthScaled, CuratedLength, Gaps]
-SectionSummaryFormat = TabularFormat("Section Summary", SectionSummaryColumns)
+SectionSummaryRules = [TV.integerOrValues('Section', ['CC']), TV.lessThan('TopDepth', 'BottomDepth'), TV.lessThan('TopDepthScaled', 'BottomDepthScaled'),
+                       TV.nonNegative('CuratedLength'), TV.uniqueKeys(['Site', 'Hole', 'Core', 'Section'])]
+SectionSummaryFormat = TabularFormat("Section Summary", SectionSummaryColumns, SectionSummaryRules)
+
+
+# Gaps column values parsed into flat arrays. The gaps of the section at row position
+# pos are starts[bounds[pos]:bounds[pos+1]] (sorted) and ends[...], and totals[...] holds
+# the cumulative length of that section's gaps, so the total gap above a section depth
+# is a binary search. Each total sums its gaps' lengths in Gaps column order, as
+# getTotalGapAboveSectionDepth() always has, so totals are identical to the last bit.
+class SectionGaps:
+    def __init__(self, gapStrings):
+        bounds = [0]
+        starts = []
+        ends = []
+        totals = []
+        for gapStr in gapStrings: # list of space-delimited gaps, each of form 'top-bottom'
+            if gapStr != "":
+                gapList = [(float(top), float(bot)) for top, bot in [gap.split('-') for gap in gapStr.split(' ')]]
+                sortedGaps = sorted(gapList)
+                for count, (top, bot) in enumerate(sortedGaps, 1):
+                    gapTotal = 0
+                    for gap in gapList: # the first count gaps in sorted order
+                        if gap <= sortedGaps[count - 1]:
+                            gapTotal += gap[1] - gap[0]
+                    starts.append(top)
+                    ends.append(bot)
+                    totals.append(gapTotal)
+            bounds.append(len(starts))
+        self.bounds = numpy.array(bounds, dtype=numpy.int64)
+        self.starts = numpy.array(starts, dtype=numpy.float64)
+        self.ends = numpy.array(ends, dtype=numpy.float64)
+        self.totals = numpy.array(totals, dtype=numpy.float64)
+        self.rows = numpy.repeat(numpy.arange(len(bounds) - 1), numpy.diff(self.bounds)) # row position of each gap
+
+    def getGaps(self, pos):
+        lo, hi = self.bounds[pos], self.bounds[pos + 1]
+        return [(float(top), float(bot)) for top, bot in zip(self.starts[lo:hi], self.ends[lo:hi])]
+
+    # total length of gaps in section at row position pos that start above sectionDepth
+    def totalAbove(self, pos, sectionDepth):
+        lo, hi = self.bounds[pos], self.bounds[pos + 1]
+        count = numpy.searchsorted(self.starts[lo:hi], sectionDepth, side='left')
+        if count == 0 or numpy.isnan(sectionDepth):
+            return 0
+        return float(self.totals[lo + count - 1])
+
+    # totalAbove() for aligned arrays of row positions and section depths
+    def totalsAbove(self, positions, sectionDepths):
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        sectionDepths = numpy.asarray(sectionDepths, dtype=numpy.float64)
+        result = numpy.zeros(len(positions))
+        gapMask = numpy.isin(self.rows, positions)
+        if not gapMask.any():
+            return result
+
+        # Merge queries into the (row, start)-ordered gaps of queried sections, queries sorting
+        # ahead of gaps with an equal start. The gaps preceding a query are then those of earlier
+        # sections plus the query section's gaps that start above the query depth.
+        gapIdx = numpy.flatnonzero(gapMask)
+        rows = numpy.concatenate([self.rows[gapIdx], positions])
+        depths = numpy.concatenate([self.starts[gapIdx], sectionDepths])
+        isGap = numpy.concatenate([numpy.ones(len(gapIdx), dtype=numpy.int64), numpy.zeros(len(positions), dtype=numpy.int64)])
+        order = numpy.lexsort((isGap, depths, rows))
+        isQuery = isGap[order] == 0
+        queryIdx = order[isQuery] - len(gapIdx)
+        sectionStarts = self.bounds[positions[queryIdx]]
+        count = numpy.cumsum(isGap[order])[isQuery] - numpy.searchsorted(gapIdx, sectionStarts)
+
+        hasGaps = (count > 0) & ~numpy.isnan(sectionDepths[queryIdx])
+        result[queryIdx[hasGaps]] = self.totals[(sectionStarts + count - 1)[hasGaps]]
+        return result
+
+
+# Sections of a single hole ordered by top depth, for depth to section lookups.
+# positions are the dataframe row positions of the sections, cores their cores.
+class HoleSections:
+    def __init__(self, positions, tops, bottoms, cores):
+        order = numpy.lexsort((positions, tops)) # top depth, then dataframe order; NaN tops last
+        self.positions = numpy.asarray(positions)[order]
+        self.tops = tops[order]
+        self.bottoms = bottoms[order]
+        self.cores = numpy.asarray(cores, dtype=object)[order]
+        self.count = numpy.count_nonzero(~numpy.isnan(self.tops)) # a NaN top contains no depth
+        self.maxBottoms = numpy.fmax.accumulate(self.bottoms[:self.count]) if self.count > 0 else self.bottoms[:0]
+
+    # return row positions of the first sections (in dataframe order) with top <= depth <= bottom
+    # for each of depths, and if cores is given, in the corresponding core; -1 where none qualifies
+    def find(self, depths, cores=None):
+        # sections from the first whose bottom or a shallower section's bottom is >= depth
+        # to the last with top <= depth: all sections containing depth are in that range
+        lo = numpy.searchsorted(self.maxBottoms, depths, side='left')
+        hi = numpy.searchsorted(self.tops[:self.count], depths, side='right')
+        counts = numpy.maximum(hi - lo, 0)
+        queries = numpy.repeat(numpy.arange(len(depths)), counts)
+        candidates = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts - lo, counts)
+        match = self.bottoms[candidates] >= depths[queries]
+        if cores is not None:
+            match &= self.cores[candidates] == numpy.asarray(cores, dtype=object)[queries]
+
+        result = numpy.full(len(depths), numpy.iinfo(numpy.int64).max, dtype=numpy.int64)
+        numpy.minimum.at(result, queries[match], self.positions[candidates[match]])
+        result[result == numpy.iinfo(numpy.int64).max] = -1
+        return result
 
 
 class SectionSummary:
     def __init__(self, name, dataframe):
         self.name = name
         self.dataframe = dataframe
+
+    # lookup structures derived from the dataframe are built lazily on first
+    # use and discarded whenever the dataframe is replaced
+    @property
+    def dataframe(self):
+        return self._dataframe
+
+    @dataframe.setter
+    def dataframe(self, dataframe):
+        self._dataframe = dataframe
+        self._sectionIndex = None
+        self._gapIndex = None
+        self._holeSections = {}
+        self._coreTable = None
+        self._coreIndex = None
+        self._cores = None
         
     @classmethod
     def createWithFile(cls, filepath):
-        dataframe = createWithCSV(filepath, SectionSummaryFormat)
+        dataframe = createWithCSV(filepath, SectionSummaryFormat, passThrough=False, numericDatatype=numpy.float64)
         return cls(os.path.basename(filepath), dataframe)
     
     def containsCore(self, site, hole, core):
-        cores = self._findCores(site, hole, core)
-        return not cores.empty
+        return self._findCorePosition(site, hole, core) is not None
     
     # return list of unique cores
     def getCores(self):
-        return self.dataframe[(self.dataframe.Section == '1')]
+        if self._cores is None:
+            firstSections = self._getCoreTable()['Section1']
+            self._cores = self.dataframe.iloc[numpy.sort(firstSections[firstSections >= 0].to_numpy())]
+        return self._cores
     
     # return list of unique sites
     def getSites(self):
-        sites = self.dataframe['Site']
-        return list(set(sites))
+        return list(self._getCoreTable().index.unique(level='Site'))
 
     # get total depth of a section offset using SectionSummary data and curated lengths if available
     def getOffsetDepth(self, site, hole, core, section, offset, scaledDepth=False):
@@ -71,16 +195,44 @@ class SectionSummary:
             compressedDepth = secTop + (offset/100.0 * compressionFactor)
             log.warning("   section {}: curated length {}cm exceeds drilled length {}cm, compressing depth {}m to {}m".format(sectionId, curatedLength, drilledLength, depth, compressedDepth))
             depth = compressedDepth
-            
-        return depth        
-    
+
+        return depth
+
+    # Batch form of getOffsetDepth(): sites, holes, cores, sections and offsets are
+    # aligned sequences (lists, arrays or Series). Returns numpy array of depths.
+    def getOffsetDepths(self, sites, holes, cores, sections, offsets, scaledDepth=False):
+        positions = self._findSectionPositions(sites, holes, cores, sections)
+        offsets = numpy.asarray(offsets, dtype=numpy.float64)
+        secTop = self._getSectionValues(positions, 'TopDepthScaled' if scaledDepth else 'TopDepth')
+        secBot = self._getSectionValues(positions, 'BottomDepthScaled' if scaledDepth else 'BottomDepth')
+        curatedLength = self._getSectionValues(positions, 'CuratedLength')
+
+        for idx in numpy.flatnonzero(offsets/100.0 > curatedLength):
+            sectionId = self._sectionIdAt(positions[idx])
+            log.warning("   section {}: offset {}cm is beyond curated length of section {}m".format(sectionId, offsets[idx], curatedLength[idx]))
+
+        gapTotals = self._getGapIndex().totalsAbove(positions, offsets)
+        depths = secTop + (offsets/100.0) - (gapTotals/100.0)
+
+        # if using scaled depths, compress depth to drilled interval
+        if scaledDepth:
+            drilledLength = (secBot - secTop) * 100.0 # cm
+            compress = curatedLength > drilledLength
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                compressedDepths = secTop + (offsets/100.0 * (drilledLength / curatedLength))
+            for idx in numpy.flatnonzero(compress):
+                log.warning("   section {}: curated length {}cm exceeds drilled length {}cm, compressing depth {}m to {}m".format(self._sectionIdAt(positions[idx]), curatedLength[idx], drilledLength[idx], depths[idx], compressedDepths[idx]))
+            depths = numpy.where(compress, compressedDepths, depths)
+
+        return depths
+
     # return depth of top of top section, bottom of bottom section
-    def getCoreRange(self, site, hole, core):
-        cores = self._findCores(site, hole, core)
-        cores = cores[(cores.Section != "CC")] # omit CC section for time being
-        if not cores.empty:
-            coremin = cores['TopDepth'].min()
-            coremax = cores['BottomDepth'].max()
+    def getCoreRange(self, site, hole, core, scaledDepth=False):
+        pos = self._findCorePosition(site, hole, core)
+        table = self._getCoreTable()
+        if pos is not None and table['SectionCount'].iat[pos] > table['CCSectionCount'].iat[pos]: # omit CC section for time being
+            coremin = table['TopDepthScaled' if scaledDepth else 'TopDepth'].iat[pos]
+            coremax = table['BottomDepthScaled' if scaledDepth else 'BottomDepth'].iat[pos]
             return round(coremin, 3), round(coremax, 3)
         return None
     
@@ -98,9 +250,46 @@ class SectionSummary:
                 closestCore = corerow
         log.debug("Closest core top to off-splice {}{}-{} with top MBLF = {}: on-splice {}{}-{} with top MBLF = {}, diff = {}".format(site, hole, core, searchCoreTop, closestCore.Site, closestCore.Hole, closestCore.Core, closestCore.TopDepth, mindiff))
         return closestCore
-        
+
+    # Batch form of getCoreWithClosestTop(): return list of the cores in coreList
+    # closest to each core in searchCores (rows with Site, Hole and Core), found by
+    # searchsorted over coreList's sorted unique tops. As in getCoreWithClosestTop(),
+    # ties go to the core earliest in coreList and a search core never matches itself.
+    def getCoresWithClosestTop(self, searchCores, coreList):
+        if len(coreList) == 0:
+            return [None] * len(searchCores)
+        positions = self._findSectionPositions([c.Site for c in searchCores], [c.Hole for c in searchCores],
+                                               [c.Core for c in searchCores], ['1'] * len(searchCores))
+        searchTops = self._getSectionValues(positions, 'TopDepth')
+        listTops = numpy.array([c.TopDepth for c in coreList], dtype=numpy.float64)
+        tops, firstIdx = numpy.unique(listTops, return_index=True) # index of first core in coreList with each top
+
+        right = numpy.minimum(numpy.searchsorted(tops, searchTops, side='left'), len(tops) - 1)
+        left = numpy.maximum(right - 1, 0)
+        with numpy.errstate(invalid='ignore'):
+            rightDiff = numpy.abs(tops[right] - searchTops)
+            leftDiff = numpy.abs(tops[left] - searchTops)
+            useRight = (rightDiff < leftDiff) | ((rightDiff == leftDiff) & (firstIdx[right] < firstIdx[left]))
+        closestIdx = numpy.where(useRight, firstIdx[right], firstIdx[left])
+
+        # search cores that are also in coreList, or have a NaN top, get the linear search
+        listKeys = set((c.Site, c.Hole, c.Core) for c in coreList)
+        nanListTops = numpy.isnan(listTops).any()
+        closestCores = []
+        for searchCore, idx, searchTop in zip(searchCores, closestIdx, searchTops):
+            if (searchCore.Site, searchCore.Hole, searchCore.Core) in listKeys or numpy.isnan(searchTop) or nanListTops:
+                closestCores.append(self.getCoreWithClosestTop(searchCore.Site, searchCore.Hole, searchCore.Core, coreList))
+            else:
+                closestCores.append(coreList[idx])
+        return closestCores
+
     def getCoreTop(self, site, hole, core):
-        return self.getSectionTop(site, hole, core, '1')
+        pos = self._findCorePosition(site, hole, core)
+        sectionPos = self._getCoreTable()['Section1'].iat[pos] if pos is not None else -1
+        if sectionPos < 0:
+            log.warning("SectionSummary: Could not find {}-{}{}-{}".format(site, hole, core, '1'))
+            raise IndexError("SectionSummary: no section {}-{}{}-{}".format(site, hole, core, '1'))
+        return round(self.dataframe['TopDepth'].iat[sectionPos], 3)
     
     def getSectionTop(self, site, hole, core, section):
         val = self._getSectionValue(site, hole, core, section, 'TopDepth')
@@ -125,29 +314,56 @@ class SectionSummary:
     def getSectionTool(self, site, hole, core, section):
         return self._getSectionValue(site, hole, core, section, 'Tool')
     
-    def getSectionAtDepth(self, site, hole, core, depth):
-        sec = self._findSectionAtDepth(site, hole, core, depth)
+    def getSectionAtDepth(self, site, hole, core, depth, scaledDepth=False):
+        sec = self._findSectionAtDepth(site, hole, core, depth, scaledDepth)
         return sec
+
+    # Bulk depth to section lookup: sites, holes and depths (m) are aligned sequences, as is
+    # cores if given, to find each depth within the given core as getSectionAtDepth() does.
+    # Returns DataFrame with Site, Hole, Core, Section and Offset (cm below section top,
+    # gaps not considered) for each depth. Where no section contains a depth, Core and
+    # Section are empty and Offset is NaN. If more than one section contains a depth, e.g.
+    # a depth on the boundary of two sections, the first in dataframe order is returned,
+    # as getSectionAtDepth() returns it.
+    def getSectionsAtDepths(self, sites, holes, depths, scaledDepth=False, cores=None):
+        depths = numpy.asarray(depths, dtype=numpy.float64)
+        positions = numpy.full(len(depths), -1, dtype=numpy.int64)
+        queries = pandas.DataFrame({'Site': numpy.asarray(sites, dtype=object), 'Hole': numpy.asarray(holes, dtype=object)})
+        cores = numpy.asarray(cores, dtype=object) if cores is not None else None
+        holeSections = self._getHoleSections(scaledDepth)
+        for key, queryIdx in queries.groupby(['Site', 'Hole'], sort=False).indices.items():
+            if key in holeSections:
+                positions[queryIdx] = holeSections[key].find(depths[queryIdx], cores[queryIdx] if cores is not None else None)
+
+        found = positions >= 0
+        df = self.dataframe
+        cores = numpy.full(len(depths), "", dtype=object)
+        sections = numpy.full(len(depths), "", dtype=object)
+        cores[found] = df['Core'].to_numpy()[positions[found]]
+        sections[found] = df['Section'].to_numpy()[positions[found]]
+        offsets = numpy.full(len(depths), numpy.nan)
+        offsets[found] = (depths[found] - self._getSectionValues(positions[found], 'TopDepthScaled' if scaledDepth else 'TopDepth')) * 100.0
+        return pandas.DataFrame({'Site': queries.Site, 'Hole': queries.Hole, 'Core': cores, 'Section': sections, 'Offset': offsets})
     
+    # return list of (top, bottom) gap tuples in cm for the specified section, sorted by top
     def getGaps(self, site, hole, core, section):
-        gapList = []
-        if 'Gaps' in self.dataframe:
-            gapStr = self._getSectionValue(site, hole, core, section, 'Gaps') # list of space-delimited gaps, each of form 'top-bottom'
-            if gapStr != "":
-                for gapInterval in [gap.split('-') for gap in gapStr.split(' ')]:
-                    top, bot = float(gapInterval[0]), float(gapInterval[1])
-                    gapList.append((top, bot))
-        return gapList
+        if 'Gaps' not in self.dataframe:
+            return []
+        pos = self._findSectionPosition(site, hole, core, section)
+        if pos is None:
+            raise IndexError("SectionSummary: no section {}-{}{}-{}".format(site, hole, core, section))
+        return self._getGapIndex().getGaps(pos)
     
     # return total length (in cm) of gaps above sectionDepth if 'Gaps' column
     # is present and specified section has gaps, otherwise 0.
     # - sectionDepth must be in cm
     def getTotalGapAboveSectionDepth(self, site, hole, core, section, sectionDepth):
-        gapTotal = 0
-        for gap in self.getGaps(site, hole, core, section):
-            if sectionDepth > gap[0]:
-                gapTotal += gap[1] - gap[0]
-        return gapTotal
+        if 'Gaps' not in self.dataframe:
+            return 0
+        pos = self._findSectionPosition(site, hole, core, section)
+        if pos is None:
+            raise IndexError("SectionSummary: no section {}-{}{}-{}".format(site, hole, core, section))
+        return self._getGapIndex().totalAbove(pos, sectionDepth)
     
     def sectionDepthToTotal(self, site, hole, core, section, secDepth):
         top = self.getSectionTop(site, hole, core, section)
@@ -155,6 +371,41 @@ class SectionSummary:
         #print "section depth {} in section {} = {} overall".format(secDepth, section, result)        
         return result
 
+    # return position of core in core table, or None if there's no such core
+    def _findCorePosition(self, site, hole, core):
+        pos = self._getCoreIndex().get((site, hole, core))
+        if pos is None:
+            log.warning("SectionSummary: Could not find core {}-{}{}".format(site, hole, core))
+        return pos
+
+    # Per-core summary of dataframe indexed by (Site, Hole, Core), built on first use:
+    # - Tool: tool of core's first section
+    # - TopDepth, BottomDepth, TopDepthScaled, BottomDepthScaled: core range, omitting CC sections
+    # - SectionCount, CCSectionCount: number of sections, number of those that are CC
+    # - Section1: dataframe row position of core's section 1, or -1 if there isn't one
+    def _getCoreTable(self):
+        if self._coreTable is None:
+            df = self.dataframe
+            keys = ['Site', 'Hole', 'Core']
+            cores = df.groupby(keys, sort=False, observed=True)
+            table = pandas.DataFrame({'Tool': cores['Tool'].first(), 'SectionCount': cores.size()})
+            nonCC = df[df.Section != 'CC'].groupby(keys, sort=False, observed=True)
+            for col, agg in [('TopDepth', 'min'), ('BottomDepth', 'max'), ('TopDepthScaled', 'min'), ('BottomDepthScaled', 'max')]:
+                table[col] = nonCC[col].agg(agg)
+            table['CCSectionCount'] = table['SectionCount'] - nonCC.size().reindex(table.index, fill_value=0)
+            isSection1 = (df.Section == '1').to_numpy()
+            section1 = pandas.Series(numpy.flatnonzero(isSection1), index=pandas.MultiIndex.from_frame(df.loc[isSection1, keys]))
+            section1 = section1[~section1.index.duplicated()] # first row wins in case of duplicate sections
+            table['Section1'] = section1.reindex(table.index, fill_value=-1)
+            self._coreTable = table
+            self._coreIndex = {key: pos for pos, key in enumerate(table.index)}
+        return self._coreTable
+
+    # dict of (site, hole, core) : position in core table
+    def _getCoreIndex(self):
+        self._getCoreTable()
+        return self._coreIndex
+
     def _findCores(self, site, hole, core):
         df = self.dataframe
         cores = df[(df.Site == site) & (df.Hole == hole) & (df.Core == core)]
@@ -163,22 +414,84 @@ class SectionSummary:
         return cores
 
     def _findSection(self, site, hole, core, section):
-        df = self.dataframe
-        sectionRow = df[(df.Site == site) & (df.Hole == hole) & (df.Core == core) & (df.Section == section)]
-        if sectionRow.empty:
+        pos = self._findSectionPosition(site, hole, core, section)
+        if pos is None:
+            return self.dataframe.iloc[0:0]
+        return self.dataframe.iloc[[pos]]
+
+    # return position of the first row matching (site, hole, core, section), or None if there's no match
+    def _findSectionPosition(self, site, hole, core, section):
+        pos = self._getSectionIndex().get((site, hole, core, section))
+        if pos is None:
             log.warning("SectionSummary: Could not find {}-{}{}-{}".format(site, hole, core, section))
-        return sectionRow
-    
-    def _findSectionAtDepth(self, site, hole, core, depth):
+        return pos
+
+    # return numpy array of row positions for aligned sequences of section identifiers,
+    # raising IndexError if any section can't be found
+    def _findSectionPositions(self, sites, holes, cores, sections):
+        index = self._getSectionIndex()
+        positions = [index.get(key, -1) for key in zip(sites, holes, cores, sections)]
+        missing = [key for key, pos in zip(zip(sites, holes, cores, sections), positions) if pos == -1]
+        for site, hole, core, section in missing:
+            log.warning("SectionSummary: Could not find {}-{}{}-{}".format(site, hole, core, section))
+        if len(missing) > 0:
+            raise IndexError("SectionSummary: no section {}-{}{}-{}".format(*missing[0]))
+        return numpy.array(positions, dtype=numpy.int64)
+
+    # return numpy array of columnName values at row positions, rounded as in _getSectionValue() callers
+    def _getSectionValues(self, positions, columnName, digits=3):
+        return numpy.round(self.dataframe[columnName].to_numpy(dtype=numpy.float64)[positions], digits)
+
+    def _sectionKeyAt(self, pos):
         df = self.dataframe
-        sectionRow = df[(df.Site == site) & (df.Hole == hole) & (df.Core == core) & (depth >= df.TopDepth) & (depth <= df.BottomDepth)]
-        if not sectionRow.empty:
-            return sectionRow.iloc[0]['Section']
+        return df['Site'].iat[pos], df['Hole'].iat[pos], df['Core'].iat[pos], df['Section'].iat[pos]
+
+    def _sectionIdAt(self, pos):
+        return "{}{}-{}-{}".format(*self._sectionKeyAt(pos))
+
+    # SectionGaps for every row of the dataframe, built on first use
+    def _getGapIndex(self):
+        if self._gapIndex is None:
+            gapStrings = self.dataframe['Gaps'] if 'Gaps' in self.dataframe else [""] * len(self.dataframe)
+            self._gapIndex = SectionGaps(gapStrings)
+        return self._gapIndex
+
+    # dict of (site, hole, core, section) : row position, built on first use
+    def _getSectionIndex(self):
+        if self._sectionIndex is None:
+            df = self.dataframe
+            index = {}
+            for pos, key in enumerate(zip(df.Site, df.Hole, df.Core, df.Section)):
+                index.setdefault(key, pos) # first row wins in case of duplicate sections
+            self._sectionIndex = index
+        return self._sectionIndex
+    
+    def _findSectionAtDepth(self, site, hole, core, depth, scaledDepth=False):
+        holeSections = self._getHoleSections(scaledDepth).get((site, hole))
+        if holeSections is not None:
+            position = holeSections.find(numpy.array([depth], dtype=numpy.float64), [core])[0]
+            if position >= 0:
+                return self.dataframe['Section'].iat[position]
         return None
+
+    # dict of (site, hole) : HoleSections for unscaled or scaled depths, built on first use
+    def _getHoleSections(self, scaledDepth):
+        if scaledDepth not in self._holeSections:
+            df = self.dataframe
+            tops = df['TopDepthScaled' if scaledDepth else 'TopDepth'].to_numpy(dtype=numpy.float64)
+            bots = df['BottomDepthScaled' if scaledDepth else 'BottomDepth'].to_numpy(dtype=numpy.float64)
+            cores = df['Core'].to_numpy(dtype=object)
+            holeSections = {}
+            for key, positions in df.groupby(['Site', 'Hole'], sort=False, observed=True).indices.items():
+                holeSections[key] = HoleSections(positions, tops[positions], bots[positions], cores[positions])
+            self._holeSections[scaledDepth] = holeSections
+        return self._holeSections[scaledDepth]
     
     def _getSectionValue(self, site, hole, core, section, columnName):
-        sectionRow = self._findSection(site, hole, core, section)
-        return sectionRow.iloc[0][columnName]
+        pos = self._findSectionPosition(site, hole, core, section)
+        if pos is None:
+            raise IndexError("SectionSummary: no section {}-{}{}-{}".format(site, hole, core, section))
+        return self.dataframe[columnName].iat[pos]
 
         
 # utility to convert Laccore DB gaps format to SectionSummary format    
@@ -260,6 +573,71 @@ class TestSectionSummary(unittest.TestCase):
         self.assertFalse(ss.containsCore('1', 'A', '34'))
         self.assertTrue(ss.getSectionTop('1', 'A', '33', '9') == 92.73)
         self.assertTrue(ss.getSectionAtDepth('1', 'B', '2', 4.4) == '3')
+
+    def test_sections_at_depths(self):
+        ss = SectionSummary.createWithFile("../testdata/GLAD9_SectionSummary.csv")
+        secs = ss.getSectionsAtDepths(['1', '1', '1'], ['B', 'B', 'Q'], [4.4, 1000.0, 4.4])
+        self.assertTrue(list(secs.Core) == ['2', '', ''])
+        self.assertTrue(list(secs.Section) == ['3', '', ''])
+        self.assertTrue(round(secs.Offset[0], 3) == round((4.4 - ss.getSectionTop('1', 'B', '2', '3')) * 100.0, 3))
+        scaled = ss.getSectionsAtDepths(['1'], ['B'], [4.4], scaledDepth=True)
+        self.assertTrue(scaled.Section[0] == ss.getSectionAtDepth('1', 'B', '2', 4.4, scaledDepth=True))
+
+        # on the boundary of sections 1 and 2, as getSectionAtDepth() finds it: the first row
+        boundary = ss.getSectionBot('1', 'A', '1', '1')
+        self.assertTrue(boundary == ss.getSectionTop('1', 'A', '1', '2'))
+        secs = ss.getSectionsAtDepths(['1', '1'], ['A', 'A'], [boundary, boundary], cores=['1', '2'])
+        self.assertTrue(list(secs.Section) == [ss.getSectionAtDepth('1', 'A', '1', boundary), ''])
+        self.assertTrue(secs.Section[0] == '1')
+        rows = ss.dataframe[ss.dataframe.Site == '1']
+        for depths in [rows.TopDepth, rows.BottomDepth]:
+            secs = ss.getSectionsAtDepths(rows.Site, rows.Hole, depths, cores=rows.Core)
+            self.assertTrue(list(secs.Section) == [ss.getSectionAtDepth(*key) for key in zip(rows.Site, rows.Hole, rows.Core, depths)])
+
+    def test_hole_sections(self): # nested and overlapping sections
+        rng = numpy.random.default_rng(0)
+        tops = numpy.round(rng.uniform(0.0, 20.0, 300), 1)
+        bottoms = tops + numpy.round(rng.choice([0.1, 0.5, 1.5, 8.0], 300), 1)
+        tops[::17] = numpy.nan
+        cores = rng.choice(['1', '2', '3'], 300).astype(object)
+        sections = HoleSections(numpy.arange(300), tops, bottoms, cores)
+        depths = numpy.round(numpy.arange(-1.0, 30.0, 0.05), 2)
+        queryCores = numpy.resize(['1', '2', '3'], len(depths)).astype(object)
+        expected, expectedInCore = [], []
+        for depth, core in zip(depths, queryCores): # first row containing depth
+            matches = numpy.flatnonzero((tops <= depth) & (depth <= bottoms))
+            expected.append(matches[0] if len(matches) > 0 else -1)
+            matches = matches[cores[matches] == core]
+            expectedInCore.append(matches[0] if len(matches) > 0 else -1)
+        self.assertTrue(list(sections.find(depths)) == expected)
+        self.assertTrue(list(sections.find(depths, queryCores)) == expectedInCore)
+
+    def test_closest_tops(self):
+        ss = SectionSummary.createWithFile("../testdata/GLAD9_SectionSummary.csv")
+        cores = [row for _, row in ss.getCores().iterrows()]
+        onSplice = cores[::2]
+        offSplice = cores[1::2] + onSplice[:2] # on-splice cores must not match themselves
+        closest = ss.getCoresWithClosestTop(offSplice, onSplice)
+        for core, closestCore in zip(offSplice, closest):
+            self.assertTrue(closestCore is ss.getCoreWithClosestTop(core.Site, core.Hole, core.Core, onSplice))
+
+    def test_core_table(self):
+        ss = SectionSummary.createWithFile("../testdata/GLAD9_SectionSummary.csv")
+        self.assertTrue(len(ss.getCores()) == len(ss.dataframe[ss.dataframe.Section == '1']))
+        self.assertTrue(ss.getCoreTop('1', 'A', '1') == 0.1)
+        self.assertTrue(ss.getCoreRange('1', 'A', '1') == (0.1, 2.863))
+        self.assertTrue(ss.getCoreRange('1', 'A', '34') is None)
+        ss.dataframe = ss.dataframe[ss.dataframe.Site == '1'] # replacing dataframe rebuilds core table
+        self.assertTrue(ss.getSites() == ['1'])
+
+    def test_section_index(self):
+        ss = SectionSummary.createWithFile("../testdata/GLAD9_SectionSummary.csv")
+        self.assertTrue(ss.getSectionLength('1', 'A', '1', '2') == 1.273)
+        self.assertTrue(ss._findSection('1', 'A', '1', '42').empty)
+        self.assertRaises(IndexError, ss.getSectionTop, '1', 'A', '1', '42')
+        ss.dataframe = ss.dataframe[ss.dataframe.Core != '1'] # replacing dataframe rebuilds index
+        self.assertRaises(IndexError, ss.getSectionTop, '1', 'A', '1', '2')
+        self.assertTrue(ss.getSectionTop('1', 'A', '33', '9') == 92.73)
     
     def test_gaps(self):
         ss = SectionSummary.createWithFile("../testdata/SectionSummaryWithGaps.csv")
@@ -270,7 +648,39 @@ class TestSectionSummary(unittest.TestCase):
         self.assertTrue(ss.getGaps('1', 'A', '18', '1') == [(0.0, 0.5), (94.5, 96.0), (151.0, 152.5)])
         self.assertTrue(ss.getTotalGapAboveSectionDepth('1', 'A', '18', '1', 95.0) == 2.0)
         self.assertTrue(ss.getTotalGapAboveSectionDepth('1', 'A', '18', '1', 152.5) == 3.5)
-        
+
+    def test_section_gaps(self):
+        gaps = SectionGaps(["", "94.5-96.0 0.0-0.5 151.0-152.5", "0.0-2.5"])
+        self.assertTrue(gaps.getGaps(0) == [])
+        self.assertTrue(gaps.getGaps(1) == [(0.0, 0.5), (94.5, 96.0), (151.0, 152.5)])
+        self.assertTrue(gaps.totalAbove(1, 94.5) == 0.5)
+        self.assertTrue(gaps.totalAbove(1, 95.0) == 2.0)
+        totals = gaps.totalsAbove([1, 0, 2, 1, 1, 2], [152.5, 50.0, 0.0, 0.0, 200.0, 1.0])
+        self.assertTrue(list(totals) == [3.5, 0.0, 0.0, 0.0, 3.5, 2.5])
+
+    def test_section_gaps_baseline(self): # totals as getTotalGapAboveSectionDepth() summed them in Gaps order
+        gapStrings = ["6.7-11.6 125.8-129.3 9.3-10.9", "9.3-10.9 6.7-11.6 125.8-129.3", "125.8-129.3 9.3-10.9 6.7-11.6"]
+        gaps = SectionGaps(gapStrings)
+        depths = [0.0, 6.7, 8.0, 10.0, 100.0, 126.0, 200.0]
+        for pos, gapStr in enumerate(gapStrings):
+            for depth in depths:
+                total = 0
+                for top, bot in [(float(top), float(bot)) for top, bot in [gap.split('-') for gap in gapStr.split(' ')]]:
+                    if depth > top:
+                        total += bot - top
+                self.assertTrue(gaps.totalAbove(pos, depth) == total)
+        positions, sectionDepths = zip(*[(pos, depth) for pos in range(len(gapStrings)) for depth in depths])
+        self.assertTrue(list(gaps.totalsAbove(positions, sectionDepths)) == [gaps.totalAbove(*query) for query in zip(positions, sectionDepths)])
+        self.assertTrue(gaps.totalAbove(0, 200.0) != gaps.totalAbove(1, 200.0)) # summed in different orders
+
+    def test_offset_depths(self):
+        ss = SectionSummary.createWithFile("../testdata/SectionSummaryWithGaps.csv")
+        ids = [('1', 'A', '2', '1', 20.0), ('1', 'A', '3', '2', 1.0), ('1', 'A', '18', '1', 95.0)]
+        for scaled in [False, True]:
+            depths = ss.getOffsetDepths(*zip(*ids), scaledDepth=scaled)
+            self.assertTrue(list(depths) == [ss.getOffsetDepth(*sid, scaledDepth=scaled) for sid in ids])
+        self.assertRaises(IndexError, ss.getOffsetDepths, ['1'], ['A'], ['2'], ['42'], [0.0])
+
     # confirm optional Gaps column is added if missing
     def test_gaps_column(self):
         ss = SectionSummary.createWithFile("../testdata/SectionSummaryNoGaps.csv")
@@ -11,13 +11,16 @@ import unittest
 
 from tabular.csvio import createWithCSV
 from tabular.columns import TabularDatatype, TabularFormat, ColumnIdentity
+import tabular.validation as TV
 from .columns import namesToIds, CoreIdentityCols
 
 Gap = ColumnIdentity("Gap", desc="Space added before an APPEND of the next interval", datatype=TabularDatatype.NUMERIC, unit='m', optional=True)
 SpliceType = ColumnIdentity("SpliceType", desc="Type of splice operation: TIE or APPEND")
 
 SparseSpliceColumns = CoreIdentityCols + namesToIds(['TopSection', 'TopOffset', 'BottomSection', "BottomOffset"]) + [SpliceType, Gap] + namesToIds(['DataUsed', 'Comment'])  
-SparseSpliceFormat = TabularFormat("Sparse Splice", SparseSpliceColumns)
+SparseSpliceRules = [TV.integerOrValues('TopSection', ['CC']), TV.integerOrValues('BottomSection', ['CC']),
+                     TV.nonNegative('TopOffset'), TV.nonNegative('BottomOffset')]
+SparseSpliceFormat = TabularFormat("Sparse Splice", SparseSpliceColumns, SparseSpliceRules)
 
 
 class SparseSplice:
@@ -7,8 +7,11 @@ Created on Mar 31, 2016
 import os
 import unittest
 
+import numpy
+
 from tabular.csvio import createWithCSV
 from tabular.columns import TabularDatatype, TabularFormat, ColumnIdentity
+import tabular.validation as TV
 from .columns import namesToIds, CoreIdentityCols
 
 
@@ -23,7 +26,9 @@ Gap = ColumnIdentity("Gap", desc="Space added before an APPEND of the next inter
 SITColumns = CoreIdentityCols + namesToIds(['TopSection', 'TopOffset']) + [TopDepthCSF, TopDepthCCSF] + \
     namesToIds(['BottomSection', "BottomOffset"]) + [BottomDepthCSF, BottomDepthCCSF] + \
     [SpliceType, Gap] + namesToIds(['DataUsed', 'Comment']) 
-SITFormat = TabularFormat("Splice Interval Table", SITColumns)
+SITRules = [TV.nonNegative('TopOffset'), TV.nonNegative('BottomOffset'), TV.lessThan('TopDepthCCSF', 'BottomDepthCCSF'),
+            TV.noOverlaps('TopDepthCCSF', 'BottomDepthCCSF', ['Site'])]
+SITFormat = TabularFormat("Splice Interval Table", SITColumns, SITRules)
 
 
 class SpliceIntervalRow:
@@ -56,7 +61,7 @@ class SpliceIntervalTable:
         
     @classmethod
     def createWithFile(cls, filepath):
-        dataframe = createWithCSV(filepath, SITFormat)
+        dataframe = createWithCSV(filepath, SITFormat, passThrough=False, numericDatatype=numpy.float64)
         return cls(os.path.basename(filepath), dataframe)
     
     def getSites(self):
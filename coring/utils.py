@@ -4,27 +4,65 @@ Created on Feb 2, 2018
 @author: bgrivna
 '''
 
-from identity import parseIdentity
+import logging as log
+import unittest
+
+import pandas
+
+from tabular.columns import find_match, map_columns
 from tabular.pandasutils import insertColumns
+from .columns import SectionIdentityCols
+from .identity import parseIdentities
 
 """
 Parse SectionID column in dataframe, add column for each ID component
+not already in dataframe. Name and Half are added even if no SectionID
+has them, so the added columns don't depend on the data, e.g. in chunks
+of a file. Does nothing if dataframe has no SectionID column, or already
+has all section identity columns. Returns dataframe, so it can be passed
+as createWithCSV()'s splitter.
 """
 def splitSectionID(dataframe, sidcol='SectionID'):
-    coreids = []
-    for _, row in dataframe.iterrows():
-        coreids.append(parseIdentity(row[sidcol]))
-        
-    sidIndex = dataframe.columns.get_loc(sidcol)
-    
+    sidName = find_match(sidcol, list(dataframe.columns))
+    if sidName is None:
+        return dataframe
+    colmap = map_columns(SectionIdentityCols, list(dataframe.columns))
+    if len(colmap) == len(SectionIdentityCols):
+        return dataframe
+
+    ids = parseIdentities(dataframe[sidName])
+    unparsed = ids['Site'].isnull().sum()
+    if unparsed > 0:
+        log.warning("Couldn't parse {} of {} {} values".format(unparsed, len(ids), sidName))
+
     nameValues = [] # elt is tuple (column name, list of column values)
+    for name in ids.columns:
+        if name in colmap or find_match(name, list(dataframe.columns)) is not None:
+            continue
+        nameValues.append((name, ids[name].to_numpy()))
+    insertColumns(dataframe, dataframe.columns.get_loc(sidName) + 1, nameValues)
+    log.info("Split {} column into {}".format(sidName, ', '.join(nv[0] for nv in nameValues)))
+    return dataframe
+
+
+class Tests(unittest.TestCase):
+    def test_split_section_id(self):
+        df = pandas.DataFrame({'SectionID': ["GLAD7-MAL05-1B-32E-4", "327-U1363B-2H-5-A"], 'Depth': [1.0, 2.0]})
+        self.assertTrue(splitSectionID(df) is df)
+        self.assertTrue(list(df.columns) == ['SectionID', 'Name', 'Site', 'Hole', 'Core', 'Tool', 'Section', 'Half', 'Depth'])
+        self.assertTrue(list(df.Site) == ['1', 'U1363'])
+        self.assertTrue(list(df.Core) == ['32', '2'])
+
+        # components already present, under any synonym, are left alone
+        df = pandas.DataFrame({'Section ID': ["GLAD7-MAL05-1B-32E-4"], 'Core Type': ['X'], 'Section': ['9']})
+        splitSectionID(df)
+        self.assertTrue(list(df.columns) == ['Section ID', 'Name', 'Site', 'Hole', 'Core', 'Half', 'Core Type', 'Section'])
+        self.assertTrue(df['Core Type'][0] == 'X' and df.Section[0] == '9')
+        self.assertTrue(df.Half.isnull().all()) # added even if no SectionID has a half
 
-    if coreids[0].name: # assume first CoreIdentity is representative
-        nameValues.append(('Name', [c.name for c in coreids]))
-    nameValues.append(('Site', [c.site for c in coreids]))
-    nameValues.append(('Hole', [c.hole for c in coreids]))
-    nameValues.append(('Core', [c.core for c in coreids]))
-    nameValues.append(('Tool', [c.tool for c in coreids]))
-    nameValues.append(('Section', [c.section for c in coreids]))
-    insertColumns(dataframe, sidIndex + 1, nameValues)
+        df = pandas.DataFrame({'Site': ['1'], 'Hole': ['A'], 'Core': ['1'], 'Tool': ['H'], 'Section': ['1'], 'SectionID': ["GLAD7-MAL05-1B-32E-4"]})
+        self.assertTrue(len(splitSectionID(df).columns) == 6) # no split needed
+        self.assertTrue(len(splitSectionID(pandas.DataFrame({'Depth': [1.0]})).columns) == 1) # nothing to split
 
+if __name__ == "__main__":
+    unittest.main()
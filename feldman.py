@@ -4,9 +4,16 @@ to an affine and splice interval table (SIT), and to export measurement
 data based on an affine and SIT.
 '''
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import date, datetime
+import codecs
 import logging as log
+import multiprocessing
 import os
+import queue
+import shutil
+import tempfile
+import traceback
 import unittest
 
 import numpy
@@ -16,12 +23,15 @@ import coring.identity as ci
 import coring.affine as aff
 import coring.spliceInterval as si
 import coring.measurement as meas
-from coring.sectionSummary import SectionSummary
-from coring.sparseSplice import SparseSplice
+from coring.sectionSummary import SectionSummary, SectionSummaryFormat
+from coring.sparseSplice import SparseSplice, SparseSpliceFormat
 from coring.manualCorrelation import ManualCorrelationTable, loadManualCorrelation
 
+from tabular.columns import find_match
+import tabular.csvio as csvio
 from tabular.csvio import writeToCSV, FormatError
 import tabular.pandasutils as PU
+from tabular.validation import ValidationReport, keysIn, ERROR
 
 FeldmanVersion = '1.0.5'
 
@@ -73,27 +83,25 @@ def getOffsetDepth(secsumm, site, hole, core, section, offset, scaledDepth=False
         
     return depth
 
-# Check a Section column's values: return True if all values are
-# are either integers or the string 'CC', otherwise False
-def validSectionColumn(df, colname):
-    try:
-        for val in df[colname]:
-            # this works for strings e.g. int("124") = 124 and ints e.g. int(124) == 124
-            # but throws a ValueError for non-integer strings and non-integers
-            if val != 'CC':
-                int(val)
-    except ValueError:
-        return False
-    except:
-        return False
-    return True
+# Validate the dataframe of table name, created with fmt, against fmt's rules and any additional rules.
+# Offending rows of warning rules are logged, FormatError is raised if any error rules are broken.
+def validateTable(dataframe, fmt, name, rules=None):
+    report = csvio.validData(dataframe, fmt, rules)
+    if len(report.getWarnings()) > 0:
+        log.warning("{} {} has suspect rows:\n{}".format(fmt.name, name, ValidationReport.describe(report.getWarnings())))
+    if not report.isValid():
+        raise FormatError("{} {} is invalid:\n{}".format(fmt.name, name, ValidationReport.describe(report.getErrors())))
 
 # - secSummPath: path to Section Summary file
 # - sparsePath: path to Sparse Splice file
 # - affineOutPath: path to write generated Affine File
 # - manualCorrelationPath: path to manual correlation file to use; defaults to None
+# - cache: optional ConversionCache holding the state of a previous conversion. If the
+#   Section Summary, manual correlation and options are unchanged, only the work affected
+#   by edits to the sparse splice is redone.
+# - writeInBackground: if True, write the SIT in a background thread while off-splice affines are computed
 # See sparseSpliceToSIT() for other parameter descriptions.
-def convertSparseSplice(secSummPath, sparsePath, affineOutPath, sitOutPath, useScaledDepths=False, lazyAppend=False, sparseSpliceDepth=None, manualCorrelationPath=None):
+def convertSparseSplice(secSummPath, sparsePath, affineOutPath, sitOutPath, useScaledDepths=False, lazyAppend=False, sparseSpliceDepth=None, manualCorrelationPath=None, cache=None, writeInBackground=False):
     log.info("--- Converting Sparse Splice to Affine and SIT ---")
     log.info("{}".format(datetime.now()))
     log.info("Using Section Summary {}".format(secSummPath))
@@ -101,90 +109,216 @@ def convertSparseSplice(secSummPath, sparsePath, affineOutPath, sitOutPath, useS
     log.info(f"Options:\n  Use Scaled Depths = {useScaledDepths}\n  Lazy Append = {lazyAppend}\n  Sparse Splice Depth = {sparseSpliceDepth}\n  Manual Correlation File = {manualCorrelationPath}")
     log.info("Using {} output vocabulary".format(OutputVocabulary))
     
-    ss = SectionSummary.createWithFile(secSummPath)
+    inputs = ConversionCache.inputsKey(secSummPath, manualCorrelationPath, useScaledDepths, lazyAppend, sparseSpliceDepth)
+    if cache is not None and cache.inputs != inputs:
+        cache.clear()
+    if cache is not None and cache.secsumm is not None:
+        log.info("Section Summary and options unchanged since last conversion, converting incrementally")
+        ss = cache.secsumm
+    else:
+        csvio.clearIdentityCategories() # categories of this conversion's tables, and of the cached section summary's
+        ss = SectionSummary.createWithFile(secSummPath)
+    if cache is not None:
+        cache.inputs = None # cached state is partially updated below, invalid unless this conversion completes
     sp = SparseSplice.createWithFile(sparsePath)
 
-    # validate that all Section columns contain only integers and 'CC'
-    for secCol in ['TopSection', 'BottomSection']:
-        if not validSectionColumn(sp.dataframe, secCol):
-            raise FormatError("{} column in Sparse Splice contains one or more non-integer values.".format(secCol))
-    if not validSectionColumn(ss.dataframe, 'Section'):
-        raise FormatError("Section column in Section Summary contains one or more non-integer values.")
+    # validate e.g. that all Section columns contain only integers and 'CC', and that
+    # the section summary has the sections of each sparse splice core
+    validateTable(sp.dataframe, SparseSpliceFormat, sp.name, [keysIn(['Site', 'Hole', 'Core'], ss.dataframe, "Section Summary {}".format(ss.name), severity=ERROR)])
+    validateTable(ss.dataframe, SectionSummaryFormat, ss.name)
 
-    onSpliceAffRows = sparseSpliceToSIT(sp, ss, sitOutPath, useScaledDepths, lazyAppend, sparseSpliceDepth)
-    
-    # load just-created SIT and find affines for off-splice cores
-    sit = si.SpliceIntervalTable.createWithFile(sitOutPath)
-
-    mancorr = loadManualCorrelation(manualCorrelationPath) if manualCorrelationPath else None
-    if mancorr:
-        print(mancorr.df.dtypes)
-    elif manualCorrelationPath: # manual correlation was provided by user but couldn't be loaded
-        errstr = "The manual correlation file {} could not be loaded.".format(manualCorrelationPath)
-        log.error(errstr)
-        raise FormatError(errstr)
-
-    offSpliceAffRows = gatherOffSpliceAffines(sit, ss, mancorr)
-    
-    allAff = onSpliceAffRows + offSpliceAffRows
-    allAff = fillAffineRows(allAff)
+    result = sparseSpliceToSIT(sp, ss, os.path.basename(sitOutPath), useScaledDepths, lazyAppend, sparseSpliceDepth, cache)
+    if result is None:
+        raise FormatError("Sparse Splice {} could not be converted, see log for details.".format(sp.name))
+    onSpliceAffRows, sit = result
+
+    sitWriter = ThreadPoolExecutor(max_workers=1) if writeInBackground else None
+    try:
+        if sitWriter is not None: # the SIT is complete and won't be modified, write it while the affine table is built
+            sitWrite = sitWriter.submit(writeSIT, sit, sitOutPath)
+
+        # find affines for off-splice cores
+
+        if cache is not None and cache.secsumm is not None:
+            mancorr = cache.mancorr
+        else:
+            mancorr = loadManualCorrelation(manualCorrelationPath) if manualCorrelationPath else None
+        if mancorr:
+            log.debug("manual correlation column types:\n{}".format(mancorr.df.dtypes))
+        elif manualCorrelationPath: # manual correlation was provided by user but couldn't be loaded
+            errstr = "The manual correlation file {} could not be loaded.".format(manualCorrelationPath)
+            log.error(errstr)
+            raise FormatError(errstr)
+
+        offSpliceAffRows = gatherOffSpliceAffines(sit, ss, mancorr, cache)
+        if cache is not None:
+            cache.inputs = inputs
+            cache.secsumm = ss
+            cache.mancorr = mancorr
     
-    arDicts = [ar.asDict() for ar in allAff]
+        allAff = onSpliceAffRows + offSpliceAffRows
+        allAff = fillAffineRows(allAff)
     
-    reportProgress(100, "Writing affine and SIT to file...")
-    affDF = pandas.DataFrame(arDicts, columns=aff.AffineFormat.getColumnNames())
-    log.info("writing affine table to {}".format(os.path.abspath(affineOutPath)))
-    log.debug("affine table column types:\n{}".format(affDF.dtypes))
-    roundValues(affDF, aff.AffineFormat)
-    prettyColumns(affDF, aff.AffineFormat)
-    writeToCSV(affDF, affineOutPath)
+        arDicts = [ar.asDict() for ar in allAff]
     
+        reportProgress(100, "Writing affine and SIT to file...")
+        affDF = pandas.DataFrame(arDicts, columns=aff.AffineFormat.getColumnNames())
+        log.info("writing affine table to {}".format(os.path.abspath(affineOutPath)))
+        log.debug("affine table column types:\n{}".format(affDF.dtypes))
+        roundValues(affDF, aff.AffineFormat)
+        prettyColumns(affDF, aff.AffineFormat)
+        writeToCSV(affDF, affineOutPath)
+
+        if sitWriter is not None:
+            sitWrite.result() # wait for SIT write, raising any exception it encountered
+        else:
+            writeSIT(sit, sitOutPath)
+    finally:
+        if sitWriter is not None: # don't leave the SIT write running if the affine table couldn't be built
+            sitWriter.shutdown(wait=True)
+
     log.info("Conversion complete.")
 
 
-# Generates an affine table and SIT from provided SectionSummary and SparseSplice.
+# State of the last convertSparseSplice() run. Each sparse splice interval's affine shift
+# depends only on earlier intervals, so after an edit the conversion can resume from the
+# first changed interval, and off-splice cores need new affine rows only if the on-splice
+# core their shift is based on was affected. Results are identical to a full conversion.
+class ConversionCache:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.inputs = None # Section Summary, manual correlation and options of the cached run
+        self.secsumm = None
+        self.mancorr = None
+        self.sparseDF = None # sparse splice of the cached run
+        self.topCSFs = self.botCSFs = self.affines = None # per-interval results
+        self.affineRows = [] # (interval index, AffineRow) for each on-splice core
+        self.offSpliceRows = {} # (site, hole, core): (shift reference, AffineRow) for each off-splice core
+        self.changedCores = set() # on-splice cores whose SIT offset may differ from the cached run
+
+    # Conversion inputs other than the sparse splice: a cached run is reusable only if these match.
+    @staticmethod
+    def inputsKey(secSummPath, manualCorrelationPath, useScaledDepths, lazyAppend, sparseSpliceDepth):
+        def fileKey(path):
+            if not path:
+                return None
+            stat = os.stat(path)
+            return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+        return fileKey(secSummPath), fileKey(manualCorrelationPath), useScaledDepths, lazyAppend, sparseSpliceDepth
+
+    # return index of first row of dataframe that differs from the cached sparse splice
+    def firstChangedRow(self, dataframe):
+        prev = self.sparseDF
+        if prev is None or list(prev.columns) != list(dataframe.columns):
+            return 0
+        count = min(len(prev), len(dataframe))
+        same = numpy.ones(count, dtype=bool)
+        for col in dataframe.columns:
+            prevValues = prev[col].to_numpy(dtype=object)[:count]
+            values = dataframe[col].to_numpy(dtype=object)[:count]
+            same &= (prevValues == values) | (pandas.isna(prevValues) & pandas.isna(values))
+        changed = numpy.flatnonzero(~same)
+        return int(changed[0]) if len(changed) > 0 else count
+
+    # record sparseSpliceToSIT() results, intervals from firstChanged onward having been recomputed
+    def updateIntervals(self, dataframe, firstChanged, topCSFs, botCSFs, affines, affineRows):
+        self.changedCores = set()
+        for df in [self.sparseDF, dataframe]:
+            if df is not None:
+                self.changedCores.update(zip(df['Site'].iloc[firstChanged:], df['Hole'].iloc[firstChanged:], df['Core'].iloc[firstChanged:]))
+        self.sparseDF = dataframe.copy()
+        self.topCSFs, self.botCSFs, self.affines = topCSFs, botCSFs, affines
+        self.affineRows = affineRows
+
+    # return cached AffineRow for off-splice core if it was shifted based on the same,
+    # unaffected reference in the cached run, otherwise None
+    def offSpliceRow(self, coreKey, reference):
+        if coreKey in self.offSpliceRows:
+            prevReference, affineRow = self.offSpliceRows[coreKey]
+            if prevReference == reference and tuple(reference[1:]) not in self.changedCores:
+                return affineRow
+        return None
+
+
+# Generates affine rows and a SpliceIntervalTable from provided SectionSummary and SparseSplice.
+# Returns a tuple of on-splice AffineRows and the SpliceIntervalTable, or None if conversion failed.
+# SIT depths are rounded as they are when written, so the SIT matches one read from file.
 # parameters:
 # - sparse: input SparseSplice
 # - secsumm: input SectionSummary
-# - sitOutPath: path to which generated SIT will be written
+# - sitName: name of generated SpliceIntervalTable
 # - useScaledDepths: convert section depths to total depth using ScaledTopDepth and ScaledBottomDepth
 #   in SectionSummary instead of (unscaled) TopDepth and BottomDepth
 # - lazyAppend: use previous core's affine shift even if it's from a different hole
 # - spliceStartDepth: If not None, depth (in meters) at which to position the first splice interval's top.
 #   Interval will be affine shifted as necessary to achieve this.
-def sparseSpliceToSIT(sparse, secsumm, sitOutPath, useScaledDepths=False, lazyAppend=False, spliceStartDepth=None):
-    seenCores = [] # list of cores that have already been added to affine
-    affineRows = [] # list of dicts, each representing a generated affine table row
-    
-    topCSFs = []
-    topCCSFs = []
-    botCSFs = []
-    botCCSFs = []
+# - cache: optional ConversionCache, results for intervals preceding the first changed interval are reused
+def sparseSpliceToSIT(sparse, secsumm, sitName, useScaledDepths=False, lazyAppend=False, spliceStartDepth=None, cache=None):
+    df = sparse.dataframe
+    rowsToProcess = len(df)
+    sites = df['Site'].to_numpy(dtype=object)
+    holes = df['Hole'].to_numpy(dtype=object)
+    cores = df['Core'].to_numpy(dtype=object)
+    tools = df['Tool'].to_numpy(dtype=object)
+    topSections = df['TopSection'].to_numpy(dtype=object)
+    botSections = df['BottomSection'].to_numpy(dtype=object)
+    topOffsets = df['TopOffset'].to_numpy(dtype=numpy.float64)
+    botOffsets = df['BottomOffset'].to_numpy(dtype=numpy.float64)
+    spliceTypes = [str.upper(t) for t in df['SpliceType']]
+    gaps = df['Gap'].to_numpy(dtype=numpy.float64)
+
+    firstRow = cache.firstChangedRow(df) if cache is not None else 0
+    if firstRow > 0:
+        log.info(f"Sparse splice intervals 1-{firstRow} unchanged since last conversion, reusing their results")
+
+    # interval depths don't depend on the affine shifts, compute them all up front
+    topCSFs = secsumm.getOffsetDepths(sites[firstRow:], holes[firstRow:], cores[firstRow:], topSections[firstRow:], topOffsets[firstRow:], useScaledDepths)
+    botCSFs = secsumm.getOffsetDepths(sites[firstRow:], holes[firstRow:], cores[firstRow:], botSections[firstRow:], botOffsets[firstRow:], useScaledDepths)
+    if firstRow > 0:
+        topCSFs = numpy.concatenate([cache.topCSFs[:firstRow], topCSFs])
+        botCSFs = numpy.concatenate([cache.botCSFs[:firstRow], botCSFs])
+
+    # the same goes for the scaled (CSF-B) gaps used to position inter-hole default APPENDs
+    scaledGaps = numpy.full(rowsToProcess, numpy.nan)
+    if not lazyAppend and rowsToProcess > 1:
+        prevAppend = (numpy.array(spliceTypes[:-1], dtype=object) == "APPEND") & numpy.isnan(gaps[:-1])
+        interHole = numpy.flatnonzero(prevAppend & (holes[1:] != holes[:-1])) + 1
+        interHole = interHole[interHole >= firstRow]
+        if len(interHole) > 0:
+            prevBotScaledDepths = secsumm.getOffsetDepths(sites[interHole - 1], holes[interHole - 1], cores[interHole - 1],
+                                                          botSections[interHole - 1], botOffsets[interHole - 1], scaledDepth=True)
+            topScaledDepths = secsumm.getOffsetDepths(sites[interHole], holes[interHole], cores[interHole],
+                                                      topSections[interHole], topOffsets[interHole], scaledDepth=True)
+            scaledGaps[interHole] = topScaledDepths - prevBotScaledDepths
+
+    # walk intervals in order to chain affine shifts
+    affines = numpy.zeros(rowsToProcess)
+    affineRows = [] # (interval index, AffineRow) for each core's first interval
+    seenCores = set() # cores that have already been added to affine
     prevAffine = 0.0 # previous affine shift (used for APPEND shift)
     prevBotCCSF = None
-    prevRow = {} # previous interval's row, data needed for inter-hole default APPEND gap method
     sptype = None
     gap = None
-    rowsToProcess = len(sparse.dataframe)
+    if firstRow > 0: # resume from state following the last unchanged interval
+        affines[:firstRow] = cache.affines[:firstRow]
+        affineRows = [(index, ar) for index, ar in cache.affineRows if index < firstRow]
+        seenCores = set(str(site) + str(hole) + "-" + str(core) for site, hole, core in zip(sites[:firstRow], holes[:firstRow], cores[:firstRow]))
+        prevAffine = affines[firstRow - 1]
+        prevBotCCSF = botCSFs[firstRow - 1] + prevAffine
+        sptype = spliceTypes[firstRow - 1]
+        gap = gaps[firstRow - 1] if not numpy.isnan(gaps[firstRow - 1]) else None
 
-    for index, row in sparse.dataframe.iterrows():
+    for index in range(firstRow, rowsToProcess):
         reportProgress(float(index) / rowsToProcess * 50, "Processing sparse splice interval {}...".format(index + 1))
 
-        site = row['Site']
-        hole = row['Hole']
-        core = row['Core']
-        top = row['TopSection']
-        topOff = row['TopOffset']
+        site, hole, core = sites[index], holes[index], cores[index]
+        shiftTop = topCSFs[index]
+        shiftBot = botCSFs[index]
         log.info(f"Converting Sparse Splice Interval {index+1}...")
-        log.info(f"  Top: {site}{hole}-{core}-{top} @ {topOff}cm")
-        log.debug("top section = {}, top offset = {}".format(top, topOff))
-        shiftTop = secsumm.getOffsetDepth(site, hole, core, top, topOff, useScaledDepths)
-        
-        bot = row['BottomSection']
-        botOff = row['BottomOffset']
-        log.info(f"  Bottom: {site}{hole}-{core}-{bot} @ {botOff}cm")
-        log.debug("bottom section = {}, bottom offset = {}".format(bot, botOff))
-        shiftBot = secsumm.getOffsetDepth(site, hole, core, bot, botOff, useScaledDepths)
+        log.info(f"  Top: {site}{hole}-{core}-{topSections[index]} @ {topOffsets[index]}cm")
+        log.info(f"  Bottom: {site}{hole}-{core}-{botSections[index]} @ {botOffsets[index]}cm")
         
         # bail on inverted or zero-length intervals
         if shiftTop >= shiftBot:
@@ -203,15 +337,11 @@ def sparseSpliceToSIT(sparse, secsumm, sitOutPath, useScaledDepths=False, lazyAp
                 affine = gapEndDepth - shiftTop
                 log.debug("User specified gap of {}m between previous bottom ({}m) and current top ({}m), affine = {}m".format(gap, prevBotCCSF, shiftTop, affine))
             else: # default gap
-                assert len(prevRow) > 0
-                if hole == prevRow['Hole'] or lazyAppend: # hole hasn't changed, use same affine shift
+                if hole == holes[index - 1] or lazyAppend: # hole hasn't changed, use same affine shift
                     affine = prevAffine
                     log.debug("APPENDing {} at depth {} based on previous affine {}".format(shiftTop, shiftTop + affine, affine))
                 else: # different hole, use scaled depths to determine gap
-                    prevBotScaledDepth = secsumm.getOffsetDepth(prevRow['Site'], prevRow['Hole'], prevRow['Core'],
-                                                        prevRow['BottomSection'], prevRow['BottomOffset'], scaledDepth=True)
-                    topScaledDepth = secsumm.getOffsetDepth(site, hole, core, top, topOff, scaledDepth=True)
-                    scaledGap = topScaledDepth - prevBotScaledDepth
+                    scaledGap = scaledGaps[index]
                     if scaledGap < 0.0:
                         log.warning("Bottom of previous interval is {}m *above* top of next interval in CSF-B space".format(scaledGap))
                     affine = (prevBotCCSF - shiftTop) + scaledGap
@@ -235,50 +365,48 @@ def sparseSpliceToSIT(sparse, secsumm, sitOutPath, useScaledDepths=False, lazyAp
         # create data for corresponding affine - growth rate and differential offset will be filled by fillAffineRows()
         coreid = str(site) + str(hole) + "-" + str(core)
         if coreid not in seenCores:
-            seenCores.append(coreid)
+            seenCores.add(coreid)
             coreTop = secsumm.getCoreTop(site, hole, core) # use core's top for depths in affine table, not depth of TIE in splice
             affineShiftType = _spliceShiftToAffine(sptype, gap)
-            fixedCore = prevRow['Hole'] + prevRow['Core'] if sptype == "TIE" else ""
-            fixedTieCsf = botCSFs[-1] if sptype == "TIE" else numpy.nan
+            fixedCore = holes[index - 1] + cores[index - 1] if sptype == "TIE" else ""
+            fixedTieCsf = botCSFs[index - 1] if sptype == "TIE" else numpy.nan
             shiftedTieCsf = shiftTop if sptype == "TIE" else numpy.nan
-            affineRow = aff.AffineRow(site, hole, core, row['Tool'], coreTop, coreTop + affine, affine, shiftType=affineShiftType,
+            affineRow = aff.AffineRow(site, hole, core, tools[index], coreTop, coreTop + affine, affine, shiftType=affineShiftType,
                                       fixedCore=fixedCore, fixedTieCsf=fixedTieCsf, shiftedTieCsf=shiftedTieCsf, comment="splice") 
-            affineRows.append(affineRow)
+            affineRows.append((index, affineRow))
         else:
             log.error("holecore {} already seen, ignoring".format(coreid))
         
-        # create new column data 
-        topCSFs.append(shiftTop)
-        topCCSFs.append(shiftTop + affine)
-        
-        botCSFs.append(shiftBot)
-        botCCSFs.append(shiftBot + affine)
+        affines[index] = affine
         log.debug("shifted top = {}m, bottom = {}m".format(shiftTop + affine, shiftBot + affine))
         
         prevBotCCSF = shiftBot + affine
         prevAffine = affine
-        prevRow = row
-        
-        # warnings
-        if shiftTop >= shiftBot:
-            log.warning("{}: interval top {} at or below interval bottom {} in MBLF".format(coreid, shiftTop, shiftBot))
         
         # track splice type and (optional) gap, used to determine the next interval's depths
-        sptype = str.upper(row['SpliceType'])
-        gap = row['Gap'] if not numpy.isnan(row['Gap']) else None
+        sptype = spliceTypes[index]
+        gap = gaps[index] if not numpy.isnan(gaps[index]) else None
     
+    topCCSFs = topCSFs + affines
+    botCCSFs = botCSFs + affines
+    if cache is not None:
+        cache.updateIntervals(df, firstRow, topCSFs, botCSFs, affines, affineRows)
+
     # done parsing, create final dataframe for export
     sitDF = sparse.dataframe.copy()
     PU.insertColumns(sitDF, 6, [(si.TopDepthCSF.name, pandas.Series(topCSFs)), (si.TopDepthCCSF.name, pandas.Series(topCCSFs))])
     PU.insertColumns(sitDF, 10, [(si.BottomDepthCSF.name, pandas.Series(botCSFs)), (si.BottomDepthCCSF.name, pandas.Series(botCCSFs))])
+    roundValues(sitDF, si.SITFormat)
     
+    return [ar for _, ar in affineRows], si.SpliceIntervalTable(sitName, sitDF)
+
+# write SpliceIntervalTable to sitOutPath with column names of the output vocabulary
+def writeSIT(sit, sitOutPath):
     log.info("writing splice interval table to {}".format(os.path.abspath(sitOutPath)))
-    log.debug("splice interval table column types:{}".format(sitDF.dtypes))
-    roundValues(sitDF, si.SITFormat)
+    log.debug("splice interval table column types:{}".format(sit.df.dtypes))
+    sitDF = sit.df.copy()
     prettyColumns(sitDF, si.SITFormat)
     writeToCSV(sitDF, sitOutPath)
-    
-    return affineRows
 
 # attempt to map the shift type from the sparse splice to a valid affine shift type
 def _spliceShiftToAffine(spliceShift, gap):
@@ -292,105 +420,592 @@ def _spliceShiftToAffine(spliceShift, gap):
 
 
 # todo: MeasDataDB class that hides multi-file (broken into holes) vs single-file data
-# - depthColumn: name of column with depths to be used for splicing data
+# - depthColumn: name of column with depths to be used for splicing data, or a list of names to splice
+#   mdPath with each of them after loading it once. If a list, exportPath must be a list with one path per
+#   depth column, and each column's unwritten off-splice rows are saved next to its export.
 # - includeOffSplice: if True, all off-splice rows in mdPath will be included in export with 'On-Splice' value = 'off-splice'
 # - wholeSpliceSection: if True, all rows in all sections included in a splice interval are exported as 'On-Splice' = 'splice'
-def exportMeasurementData(affinePath, sitPath, mdPath, exportPath, depthColumn, includeOffSplice=True, wholeSpliceSection=False):
+# - chunksize: if not None, stream mdPath in chunks of chunksize rows, for files too large to load at once.
+#   See _exportMeasurementDataInChunks() for differences from the default in-memory mode.
+# - processes: if greater than 1, splice the rows of each hole in parallel in up to this many worker
+#   processes, see _spliceMeasurementDataInPartitions(). The export is identical to the default mode's.
+#   Ignored if chunksize is not None.
+# - rawRows: if True, parse only the identity and depth columns of mdPath and copy each exported row's
+#   fields from mdPath byte for byte, see _exportMeasurementDataRaw(). Ignored if chunksize is not None,
+#   processes is ignored if True.
+def exportMeasurementData(affinePath, sitPath, mdPath, exportPath, depthColumn, includeOffSplice=True, wholeSpliceSection=False, chunksize=None, processes=None, rawRows=False):
     log.info("--- Splicing Measurement Data ---")
     log.info("{}".format(datetime.now()))
     log.info("Using Affine Table {}".format(affinePath))
     log.info("Using Splice Interval Table {}".format(sitPath))
     log.info("Splicing {}".format(mdPath))
-    log.info("Using '{}' as depth column".format(depthColumn))
+    log.info("Using {} as depth column".format(", ".join("'{}'".format(c) for c in _getDepthColumnExports(mdPath, exportPath, depthColumn)[0])))
     log.info("Options: includeOffSplice = {}, wholeSpliceSection = {}".format(includeOffSplice, wholeSpliceSection))
 
     reportProgress(0, "Splicing {}...".format(os.path.basename(mdPath)))
     
+    csvio.clearIdentityCategories() # categories of this run's tables only
     affine = aff.AffineTable.createWithFile(affinePath)
     sit = si.SpliceIntervalTable.createWithFile(sitPath)
+    validateTable(affine.dataframe, aff.AffineFormat, affine.name)
+    validateTable(sit.df, si.SITFormat, sit.name)
     log.info("Loaded SIT with following datatypes:")
     log.debug(sit.df.dtypes)
-    md = meas.MeasurementData.createWithFile(mdPath, depthColumn)
+    spliceMeasurementData(affine, sit, mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection, chunksize, processes, rawRows)
+
+# Splice several measurement data files with one affine table and SIT, which are loaded once.
+# - jobs: list of (mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection) tuples,
+#   see exportMeasurementData() for descriptions
+# - maxWorkers: maximum number of worker processes, each splicing one file at a time. Defaults to
+#   one per file, up to the number of CPUs. If 1, as it is by default for a single file or CPU,
+#   files are spliced in turn in the calling process.
+# - chunksize: see exportMeasurementData()
+# Returns list of (mdPath, error) tuples in jobs order, error being None if mdPath was spliced,
+# otherwise the exception raised. Worker processes' log messages are forwarded through a queue
+# and re-logged in the calling process while files are spliced.
+def exportMeasurementDataBatch(affinePath, sitPath, jobs, maxWorkers=None, chunksize=None):
+    log.info("--- Splicing {} Measurement Data Files ---".format(len(jobs)))
+    log.info("{}".format(datetime.now()))
+    log.info("Using Affine Table {}".format(affinePath))
+    log.info("Using Splice Interval Table {}".format(sitPath))
+    csvio.clearIdentityCategories() # categories of this run's tables only
+    affine = aff.AffineTable.createWithFile(affinePath)
+    sit = si.SpliceIntervalTable.createWithFile(sitPath)
+    validateTable(affine.dataframe, aff.AffineFormat, affine.name)
+    validateTable(sit.df, si.SITFormat, sit.name)
+
+    if maxWorkers is None:
+        maxWorkers = min(len(jobs), os.cpu_count() or 1)
+    results = []
+    if maxWorkers <= 1:
+        for mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection in jobs:
+            log.info("Splicing {} using '{}' as depth column".format(mdPath, depthColumn))
+            error = None
+            try:
+                spliceMeasurementData(affine, sit, mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection, chunksize)
+            except Exception as err:
+                log.error("Splicing {} failed:\n{}".format(mdPath, traceback.format_exc()))
+                error = err
+            results.append((mdPath, error))
+        return results
+
+    reportProgress(0, "Splicing {} files in {} processes...".format(len(jobs), maxWorkers))
+    logQueue = multiprocessing.get_context('spawn').Queue()
+    errors = {}
+    with _createWorkerPool(maxWorkers, (affine, sit), logQueue) as executor:
+        futures = {executor.submit(_batchWorkerSplice, index, job, chunksize): index for index, job in enumerate(jobs)}
+        pending = set(futures)
+        while len(pending) > 0:
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            _relogWorkerRecords(logQueue, jobs)
+            for future in done:
+                mdPath = jobs[futures[future]][0]
+                try:
+                    error, tracebackText = future.result()
+                except Exception as err: # worker process died
+                    error, tracebackText = err, "".join(traceback.format_exception(err))
+                if error is not None:
+                    log.error("Splicing {} failed:\n{}".format(mdPath, tracebackText))
+                errors[futures[future]] = error
+                reportProgress(100 * float(len(errors)) / len(jobs), "Spliced {} of {} files...".format(len(errors), len(jobs)))
+    _relogWorkerRecords(logQueue, jobs) # records workers sent just before exiting
+    return [(job[0], errors[index]) for index, job in enumerate(jobs)]
+
+# log records batch workers have put on logQueue so far, prefixed with the name of their job's file
+def _relogWorkerRecords(logQueue, jobs):
+    while True:
+        try:
+            index, level, message = logQueue.get_nowait()
+        except queue.Empty:
+            return
+        log.log(level, "{}: {}".format(os.path.basename(jobs[index][0]), message))
+
+# forwards log records of a batch worker process's current job to the calling process
+class _ForwardingHandler(log.Handler):
+    def __init__(self, logQueue, index):
+        log.Handler.__init__(self)
+        self.logQueue = logQueue
+        self.index = index
+
+    def emit(self, record):
+        self.logQueue.put((self.index, record.levelno, record.getMessage()))
+
+_WorkerState = None # state shared by all tasks of a worker process, see _createWorkerPool()
+_WorkerLogQueue = None # queue to which a batch worker forwards log records, see _batchWorkerSplice()
+
+# Return a ProcessPoolExecutor of up to maxWorkers processes, each with the calling process's logging
+# level, output vocabulary and identity column settings, and with _WorkerState set to state and
+# _WorkerLogQueue to logQueue. Workers are spawned rather than forked, which would inherit the state
+# of a threaded (GUI) parent.
+def _createWorkerPool(maxWorkers, state, logQueue=None):
+    workerArgs = (state, logQueue, log.getLogger().getEffectiveLevel(), OutputVocabulary, csvio.CompactIdentityColumns, csvio.IdentityCategories)
+    return ProcessPoolExecutor(max_workers=maxWorkers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_initWorker, initargs=workerArgs)
+
+def _initWorker(state, logQueue, logLevel, outputVocabulary, compactIdentity, identityCategories):
+    global _WorkerState, _WorkerLogQueue, OutputVocabulary, ProgressListener
+    _WorkerState = state
+    _WorkerLogQueue = logQueue
+    OutputVocabulary = outputVocabulary
+    ProgressListener = None
+    csvio.setCompactIdentity(compactIdentity)
+    csvio.IdentityCategories = identityCategories # categories of affine and SIT identity columns
+    log.getLogger().setLevel(logLevel)
+
+# splice batch job index in a worker process, forwarding its log records as they're logged,
+# returning its error and traceback, if any
+def _batchWorkerSplice(index, job, chunksize):
+    mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection = job
+    handler = _ForwardingHandler(_WorkerLogQueue, index)
+    log.getLogger().addHandler(handler)
+    error = tracebackText = None
+    try:
+        log.info("Splicing {} using '{}' as depth column".format(mdPath, depthColumn))
+        affine, sit = _WorkerState
+        spliceMeasurementData(affine, sit, mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection, chunksize)
+    except Exception as err:
+        error, tracebackText = err, traceback.format_exc()
+    finally:
+        log.getLogger().removeHandler(handler)
+    return error, tracebackText
+
+# exportMeasurementData() with loaded AffineTable and SpliceIntervalTable. Identity categories
+# added by mdPath are dropped once it's spliced, so splicing many files doesn't accumulate them.
+def spliceMeasurementData(affine, sit, mdPath, exportPath, depthColumn, includeOffSplice=True, wholeSpliceSection=False, chunksize=None, processes=None, rawRows=False):
+    identityCategories = csvio.IdentityCategories
+    try:
+        _spliceMeasurementData(affine, sit, mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection, chunksize, processes, rawRows)
+    finally:
+        csvio.IdentityCategories = identityCategories
+
+def _spliceMeasurementData(affine, sit, mdPath, exportPath, depthColumn, includeOffSplice, wholeSpliceSection, chunksize, processes, rawRows):
+    depthColumns, exportPaths, unwrittenPaths = _getDepthColumnExports(mdPath, exportPath, depthColumn)
+    if chunksize is not None:
+        _exportMeasurementDataInChunks(affine, sit, mdPath, depthColumns, exportPaths, unwrittenPaths, includeOffSplice, wholeSpliceSection, chunksize)
+        return
+    if rawRows and _exportMeasurementDataRaw(affine, sit, mdPath, depthColumns, exportPaths, unwrittenPaths, includeOffSplice, wholeSpliceSection):
+        return
+    md = meas.MeasurementData.createWithFile(mdPath, depthColumns[0])
     log.info("Loaded {} rows of data from {}".format(len(md.df.index), mdPath))
     log.debug(md.df.dtypes)
+    for depthColumn, exportPath, unwrittenPath in zip(depthColumns, exportPaths, unwrittenPaths):
+        if len(depthColumns) > 1:
+            log.info("Splicing with depth column '{}'".format(depthColumn))
+        md = meas.MeasurementData(md.name, depthColumn, md.df)
+        if processes is not None and processes > 1:
+            _spliceMeasurementDataInPartitions(affine, sit, md, exportPath, unwrittenPath, includeOffSplice, wholeSpliceSection, processes)
+        else:
+            _spliceLoadedMeasurementData(affine, sit, md, exportPath, unwrittenPath, includeOffSplice, wholeSpliceSection)
+
+# Return lists of depth columns, export paths and unwritten off-splice row paths for exportMeasurementData()
+# depthColumn and exportPath, each a single value or a list
+def _getDepthColumnExports(mdPath, exportPath, depthColumn):
+    if isinstance(depthColumn, str):
+        return [depthColumn], [exportPath], [os.path.splitext(mdPath)[0] + "-unwritten.csv"]
+    if isinstance(exportPath, str) or len(exportPath) != len(depthColumn):
+        raise ValueError("One export path is required for each of depth columns {}".format(depthColumn))
+    return list(depthColumn), list(exportPath), [os.path.splitext(path)[0] + "-unwritten.csv" for path in exportPath]
+
+# splice md with its depth column, writing the export to exportPath and off-splice rows not included in the export to unwrittenPath
+def _spliceLoadedMeasurementData(affine, sit, md, exportPath, unwrittenPath, includeOffSplice, wholeSpliceSection):
+    exportPositions, exportOffsets, onSpliceValues, unwrittenPositions = _findSplicedRows(affine, sit, md, unwrittenPath, includeOffSplice, wholeSpliceSection)
+    if len(unwrittenPositions) > 0:
+        unwritten = md.df.take(unwrittenPositions)
+        prettyColumns(unwritten, meas.MeasurementFormat)
+        writeToCSV(unwritten, unwrittenPath)
+
+    exportdf = _createSplicedExport(md.df, exportPositions, md.depthColumn, exportOffsets, onSpliceValues)
+    prettyColumns(exportdf, meas.MeasurementFormat)
+    writeToCSV(exportdf, exportPath)
+    log.info("Wrote spliced data to {}".format(exportPath))
 
-    onSpliceRows = []
-    for index, sirow in enumerate(sit.getIntervals()):
+# Find the rows of md to export when splicing with its depth column. Returns a tuple of numpy arrays
+# (row positions, offsets, On-Splice values) of exported rows in export order, on-splice rows first in
+# SIT interval order, then off-splice rows in affine table order, and the row positions of off-splice
+# rows not included in the export, which are to be saved to unwrittenPath.
+def _findSplicedRows(affine, sit, md, unwrittenPath, includeOffSplice, wholeSpliceSection):
+    # find rows in each interval's sections, and unless wholeSpliceSection, its depth range
+    intervals = sit.getIntervals()
+    intervalSections = _getIntervalSections(intervals)
+    intervalPositions = md.getIntervalRowPositions(*_getIntervalBounds(intervals), intervalSections, wholeSpliceSection)
+
+    # Gather row positions of exported rows and their offsets, the export is built from them at the end.
+    # On-splice rows come first, in SIT interval order.
+    exportPositions = []
+    exportOffsets = []
+    unwrittenPositions = numpy.array([], dtype=numpy.int64)
+    for index, (sirow, sections, rowPositions) in enumerate(zip(intervals, intervalSections, intervalPositions)):
         progressAmount = 50 if includeOffSplice else 100
         reportProgress(progressAmount * float(index)/len(sit.df), "Gathering data for interval {}...".format(index + 1))
         log.debug("Interval {}: {}".format(index, sirow))
-        
-        sections = [sirow.topSection]
-        if sirow.topSection != sirow.botSection:
-            intTop = int(sirow.topSection)
-            intBot = int(sirow.botSection)
-            sections = [str(x + intTop) for x in range(1 + intBot - intTop)]
         log.debug("   Searching section(s) {}...".format(sections))
         
-        if wholeSpliceSection:
-            mdrows = md.getByFullID(sirow.site, sirow.hole, sirow.core, sections)
-        else:
-            mdrows = md.getByRangeFullID(sirow.topCSF, sirow.botCSF, sirow.site, sirow.hole, sirow.core, sections)
-        #print mdrows
-        #print "   found {} rows, top depth = {}, bottom depth = {}".format(len(mdrows), mdrows.iloc[0][depthColumn], mdrows.iloc[-1][depthColumn])
-        
-        if len(mdrows) > 0:
+        if len(rowPositions) > 0:
             affineOffset = sirow.topCCSF - sirow.topCSF
-            _prepSplicedRowsForExport(md.df, mdrows, depthColumn, affineOffset, onSplice=True) 
-            onSpliceRows.append(mdrows)
+            exportPositions.append(rowPositions)
+            exportOffsets.append(numpy.full(len(rowPositions), affineOffset))
         
-    onSpliceDF = pandas.concat(onSpliceRows)
-    log.info("Total spliced rows: {}".format(len(onSpliceDF)))
+    totalOnSplice = sum(len(positions) for positions in exportPositions)
+    log.info("Total spliced rows: {}".format(totalOnSplice))
 
     if includeOffSplice:
-        offSpliceDF = md.df[~(md.df.index.isin(onSpliceDF.index))] # off-splice rows
-        totalOffSplice = len(offSpliceDF)
+        onSplice = numpy.zeros(len(md.df), dtype=bool)
+        for positions in exportPositions:
+            onSplice[positions] = True
+        offSplicePositions = numpy.flatnonzero(~onSplice) # off-splice rows
+        totalOffSplice = len(offSplicePositions)
         log.info("Total off-splice rows: {}".format(totalOffSplice))
-        #print affine.dataframe.dtypes
-        #print offSpliceDF.dtypes
         
-        # I think iterating over all rows in the affine table, finding
-        # matching rows, and setting their offsets should be faster than iterating
-        # over all rows in offSpliceRows and finding/setting the affine of each?
-        offSpliceRows = []
-        totalOffSpliceWritten = 0
-        for index, ar in enumerate(affine.allRows()):
-            reportProgress(50 + 50 * float(index) / len(affine.dataframe), "Gathering data for off-splice rows...")
-            shiftedRows = offSpliceDF[(offSpliceDF.Site == ar.site) & (offSpliceDF.Hole == ar.hole) & (offSpliceDF.Core == ar.core)]
-            log.debug("   found {} off-splice rows for affine row {}".format(len(shiftedRows.index), ar))
-            
-            _prepSplicedRowsForExport(md.df, shiftedRows, depthColumn, ar.cumOffset, onSplice=False)
-            onSpliceRows.append(shiftedRows)
-            offSpliceRows.append(shiftedRows)
-            
-            totalOffSpliceWritten += len(shiftedRows)
-            
+        # join off-splice rows to the affine rows of their cores, rows are exported in affine table order
+        reportProgress(50, "Gathering data for off-splice rows...")
+        affinePositions, rowPositions = affine.joinCores(md.df[['Site', 'Hole', 'Core']].iloc[offSplicePositions])
+        if log.getLogger().isEnabledFor(log.DEBUG):
+            rowCounts = numpy.bincount(affinePositions, minlength=len(affine.dataframe))
+            for ar, count in zip(affine.dataframe[['Site', 'Hole', 'Core', 'Tool']].itertuples(index=False), rowCounts):
+                log.debug("   found {} off-splice rows for affine row {}{}-{}{}".format(count, *ar))
+
+        exportPositions.append(offSplicePositions[rowPositions])
+        exportOffsets.append(affine.dataframe['Offset'].to_numpy(dtype=numpy.float64)[affinePositions])
+        totalOffSpliceWritten = len(rowPositions)
         log.info("Total off-splice rows included in export: {}".format(totalOffSpliceWritten))
         
-        unwritten = offSpliceDF[~(offSpliceDF.index.isin(pandas.concat(offSpliceRows).index))].copy() # rows that still haven't been written!
-        if len(unwritten.index) > 0:
-            log.warning("Of {} off-splice rows, {} were not included in the export.".format(totalOffSplice, len(unwritten)))
-            unwrittenPath = os.path.splitext(mdPath)[0] + "-unwritten.csv"
+        written = numpy.zeros(totalOffSplice, dtype=bool)
+        written[rowPositions] = True
+        if not written.all(): # rows that still haven't been written!
+            unwrittenPositions = offSplicePositions[~written]
+            log.warning("Of {} off-splice rows, {} were not included in the export.".format(totalOffSplice, len(unwrittenPositions)))
             log.warning("Those rows will be saved to {}".format(unwrittenPath))
-            prettyColumns(unwritten, meas.MeasurementFormat)
-            writeToCSV(unwritten, unwrittenPath)
     
-    exportdf = pandas.concat(onSpliceRows)
+    exportPositions = numpy.concatenate(exportPositions) if len(exportPositions) > 0 else numpy.array([], dtype=numpy.int64)
+    exportOffsets = numpy.concatenate(exportOffsets) if len(exportOffsets) > 0 else numpy.array([])
+    onSpliceValues = numpy.where(numpy.arange(len(exportPositions)) < totalOnSplice, 'splice', 'off-splice').astype(object)
+    return exportPositions, exportOffsets, onSpliceValues, unwrittenPositions
 
-    prettyColumns(exportdf, meas.MeasurementFormat)
-    writeToCSV(exportdf, exportPath)
+# Raw form of the default in-memory mode: only the identity and depth columns of mdPath are parsed, and
+# each exported row is copied from mdPath as raw bytes, with the Splice Depth, Offset and On-Splice fields
+# inserted as in the default mode. Values of other columns are written exactly as they appear in mdPath
+# rather than as pandas formats the values it parses, e.g. 1.50 stays 1.50, and no columns are added
+# (e.g. components of a split SectionID), so files without every identity column are spliced in the default
+# mode. The same rows are exported in the same order, with the same header. Only files csvio.RawCSV supports
+# can be spliced this way: returns False for other files, which are to be spliced in the default mode.
+def _exportMeasurementDataRaw(affine, sit, mdPath, depthColumns, exportPaths, unwrittenPaths, includeOffSplice, wholeSpliceSection):
+    header = PU.sniffHeader(mdPath)
+    if header.delimiter != ',' or codecs.lookup(header.encoding).name not in ['utf-8', 'utf-8-sig']:
+        log.info("Can't copy raw rows of {} with delimiter {} and encoding {}, splicing parsed rows".format(mdPath, repr(header.delimiter), header.encoding))
+        return False
+    colmap = meas.MeasurementFormat.mapColumns(header.columns)
+    missingCols = [c.name for c in meas.MeasurementFormat.cols if c.name not in colmap]
+    if len(missingCols) > 0 or any(col not in header.columns for col in depthColumns):
+        log.info("Can't copy raw rows of {} without column(s) {}, splicing parsed rows".format(mdPath, ', '.join(missingCols + [col for col in depthColumns if col not in header.columns])))
+        return False
+    try:
+        rawCSV = csvio.RawCSV(mdPath, len(header.columns))
+    except FormatError as err:
+        log.info("Can't copy raw rows: {}, splicing parsed rows".format(err))
+        return False
+    try:
+        keyColumns = depthColumns + [col for col in [find_match("SectionID", header.columns)] if col is not None]
+        md = meas.MeasurementData.createWithFile(mdPath, depthColumns[0], passThrough=keyColumns)
+        if len(md.df) != len(rawCSV):
+            log.info("Read {} rows but found {} raw rows in {}, splicing parsed rows".format(len(md.df), len(rawCSV), mdPath))
+            return False
+        misaligned = _findMisalignedRow(md.df, rawCSV, header.columns, depthColumns)
+        if misaligned is not None:
+            log.info("Parsed and raw depths of row {} of {} differ, splicing parsed rows".format(misaligned, mdPath))
+            return False
+        log.info("Loaded {} rows of identity and depth data from {}".format(len(md.df.index), mdPath))
+
+        # header columns as mapToFormat() and prettyColumns() name them
+        reverseColmap = {v: k for k, v in colmap.items()}
+        prettyNames = {c.name: c.prettyName(OutputVocabulary) for c in meas.MeasurementFormat.cols}
+        columns = [prettyNames[reverseColmap[col]] if col in reverseColmap else col for col in header.columns]
+        insertAt = _getSpliceColumnIndex(pandas.DataFrame(columns=columns))
+
+        for depthColumn, exportPath, unwrittenPath in zip(depthColumns, exportPaths, unwrittenPaths):
+            if len(depthColumns) > 1:
+                log.info("Splicing with depth column '{}'".format(depthColumn))
+            md = meas.MeasurementData(md.name, depthColumn, md.df)
+            exportPositions, exportOffsets, onSpliceValues, unwrittenPositions = _findSplicedRows(affine, sit, md, unwrittenPath, includeOffSplice, wholeSpliceSection)
+            if len(unwrittenPositions) > 0:
+                with open(unwrittenPath, 'wb') as unwrittenFile:
+                    unwrittenFile.write(PU.writeToString(pandas.DataFrame(columns=columns)).encode())
+                    rawCSV.writeRows(unwrittenFile, unwrittenPositions)
+
+            spliceDepths = md.df[depthColumn].to_numpy()[exportPositions] + exportOffsets
+            spliceFields = pandas.DataFrame({'Splice Depth': spliceDepths, 'Offset': exportOffsets, 'On-Splice': onSpliceValues})
+            with open(exportPath, 'wb') as exportFile:
+                exportColumns = columns[:insertAt] + list(spliceFields.columns) + columns[insertAt:]
+                exportFile.write(PU.writeToString(pandas.DataFrame(columns=exportColumns)).encode())
+                rawCSV.writeRows(exportFile, exportPositions, insertAt, [fields.encode() for fields in PU.writeToString(spliceFields, header=False).splitlines()])
+            log.info("Wrote spliced data to {}".format(exportPath))
+    finally:
+        rawCSV.close()
+    return True
+
+# Return the position of the first row of parsed dataframe whose depths differ from those of the same
+# row of rawCSV, e.g. if a row was parsed that RawCSV doesn't find, or None if every row's depths match
+def _findMisalignedRow(dataframe, rawCSV, columns, depthColumns):
+    for depthColumn in depthColumns:
+        rawFields = pandas.Series([field.decode() for field in rawCSV.getFields(columns.index(depthColumn))])
+        rawDepths = pandas.to_numeric(rawFields, errors='coerce').to_numpy(dtype=numpy.float64)
+        matches = numpy.isclose(dataframe[depthColumn].to_numpy(dtype=numpy.float64), rawDepths, rtol=1e-12, atol=0, equal_nan=True)
+        if not matches.all():
+            return int(numpy.argmin(matches))
+    return None
+
+# Streaming form of exportMeasurementData(): mdPath is read once, chunksize rows at a time, and the
+# spliced rows of each chunk are written as they're found, so memory use is bounded by the chunk size
+# rather than the size of mdPath. Off-splice rows are collected in a temporary file next to exportPath
+# and appended to the export at the end. The same rows are exported as in the in-memory mode, on-splice
+# rows preceding off-splice rows, but each of those blocks is in measurement file order rather than
+# SIT interval or affine table order. Depth columns are read as float64 and all other columns as
+# strings, so values are written as they appear in mdPath, e.g. 155 rather than the in-memory mode's
+# 155.0 for a column of integers with empty values. Each chunk is spliced with each of depthColumns in turn.
+def _exportMeasurementDataInChunks(affine, sit, mdPath, depthColumns, exportPaths, unwrittenPaths, includeOffSplice, wholeSpliceSection, chunksize):
+    exportArgs = (affine, sit, mdPath, depthColumns, exportPaths, unwrittenPaths, includeOffSplice, wholeSpliceSection, chunksize)
+    try:
+        _exportChunks(*exportArgs)
+    except UnicodeDecodeError as err: # past chunks already exported: export them all again
+        log.warning("Couldn't decode {} past its first rows: {}".format(mdPath, err))
+        log.warning("Exporting again in {} encoding...".format(PU.FallbackEncoding))
+        _exportChunks(*exportArgs, encoding=PU.FallbackEncoding)
+
+def _exportChunks(affine, sit, mdPath, depthColumns, exportPaths, unwrittenPaths, includeOffSplice, wholeSpliceSection, chunksize, encoding='utf-8-sig'):
+    intervals = sit.getIntervals()
+    intervalSections = _getIntervalSections(intervals)
+    intervalBounds = _getIntervalBounds(intervals)
+    intervalOffsets = numpy.array([sirow.topCCSF - sirow.topCSF for sirow in intervals], dtype=numpy.float64)
+
+    totalRows = 0
+    columns = None # columns of the first chunk, given to every chunk so all rows have the export header's fields
+    exports = []
+    try:
+        for depthColumn, exportPath, unwrittenPath in zip(depthColumns, exportPaths, unwrittenPaths):
+            exports.append(_ChunkedExport(affine, depthColumn, exportPath, unwrittenPath, includeOffSplice))
+        for chunk in meas.MeasurementData.createChunksWithFile(mdPath, depthColumns[0], chunksize, depthColumns, encoding):
+            if columns is None:
+                columns = chunk.df.columns
+            elif not chunk.df.columns.equals(columns): # e.g. SectionID components found in some chunks only
+                chunk.df = chunk.df.reindex(columns=columns)
+            reportProgress(50, "Splicing rows {}-{}...".format(totalRows + 1, totalRows + len(chunk.df)))
+            totalRows += len(chunk.df)
+            for export in exports:
+                md = meas.MeasurementData(chunk.name, export.depthColumn, chunk.df)
+                intervalPositions = md.getIntervalRowPositions(*intervalBounds, intervalSections, wholeSpliceSection)
+                export.addChunk(md, intervalPositions, intervalOffsets)
+        for export in exports:
+            export.finish()
+    finally:
+        for export in exports:
+            export.close()
+
+# Export of one depth column in _exportMeasurementDataInChunks(), written as chunks are spliced
+class _ChunkedExport:
+    def __init__(self, affine, depthColumn, exportPath, unwrittenPath, includeOffSplice):
+        self.affine = affine
+        self.affineOffsets = affine.dataframe['Offset'].to_numpy(dtype=numpy.float64)
+        self.depthColumn = depthColumn
+        self.exportPath = exportPath
+        self.unwrittenPath = unwrittenPath
+        self.includeOffSplice = includeOffSplice
+        self.totalOnSplice = self.totalOffSplice = self.totalOffSpliceWritten = 0
+        self.emptyExport = None # header-only export, written if no rows are spliced
+        offSpliceFile, self.offSplicePath = tempfile.mkstemp(suffix=".csv", dir=os.path.dirname(os.path.abspath(exportPath)))
+        os.close(offSpliceFile)
+
+    # write spliced rows of chunk md given the row positions of each interval, intervalPositions
+    def addChunk(self, md, intervalPositions, intervalOffsets):
+        # on-splice rows, ordered by row then interval for rows in overlapping intervals
+        positions = numpy.concatenate(intervalPositions) if len(intervalPositions) > 0 else numpy.array([], dtype=numpy.int64)
+        intervalIndices = numpy.repeat(numpy.arange(len(intervalPositions)), [len(p) for p in intervalPositions])
+        order = numpy.lexsort((intervalIndices, positions))
+        if len(order) > 0:
+            onSpliceDF = _createSplicedExport(md.df, positions[order], self.depthColumn, intervalOffsets[intervalIndices[order]], numpy.full(len(order), 'splice', dtype=object))
+            prettyColumns(onSpliceDF, meas.MeasurementFormat)
+            writeToCSV(onSpliceDF, self.exportPath, append=self.totalOnSplice > 0)
+            self.totalOnSplice += len(order)
+        elif self.emptyExport is None:
+            self.emptyExport = _createSplicedExport(md.df, positions, self.depthColumn, intervalOffsets[:0], numpy.array([], dtype=object))
+            prettyColumns(self.emptyExport, meas.MeasurementFormat)
+
+        if not self.includeOffSplice:
+            return
+        onSplice = numpy.zeros(len(md.df), dtype=bool)
+        onSplice[positions] = True
+        offSplicePositions = numpy.flatnonzero(~onSplice)
+        affinePositions, rowPositions = self.affine.joinCores(md.df[['Site', 'Hole', 'Core']].iloc[offSplicePositions])
+        order = numpy.lexsort((affinePositions, rowPositions))
+        if len(order) > 0:
+            offSpliceDF = _createSplicedExport(md.df, offSplicePositions[rowPositions[order]], self.depthColumn, self.affineOffsets[affinePositions[order]], numpy.full(len(order), 'off-splice', dtype=object))
+            prettyColumns(offSpliceDF, meas.MeasurementFormat)
+            writeToCSV(offSpliceDF, self.offSplicePath, append=self.totalOffSpliceWritten > 0)
+
+        written = numpy.zeros(len(offSplicePositions), dtype=bool)
+        written[rowPositions] = True
+        if not written.all(): # rows that won't be written
+            unwritten = md.df.take(offSplicePositions[~written])
+            prettyColumns(unwritten, meas.MeasurementFormat)
+            writeToCSV(unwritten, self.unwrittenPath, append=self.totalOffSplice - self.totalOffSpliceWritten > 0)
+        self.totalOffSplice += len(offSplicePositions)
+        self.totalOffSpliceWritten += len(order)
+
+    # log totals and append off-splice rows to export
+    def finish(self):
+        log.info("Total spliced rows: {}".format(self.totalOnSplice))
+        if self.includeOffSplice:
+            log.info("Total off-splice rows: {}".format(self.totalOffSplice))
+            log.info("Total off-splice rows included in export: {}".format(self.totalOffSpliceWritten))
+            if self.totalOffSplice > self.totalOffSpliceWritten:
+                log.warning("Of {} off-splice rows, {} were not included in the export.".format(self.totalOffSplice, self.totalOffSplice - self.totalOffSpliceWritten))
+                log.warning("Those rows were saved to {}".format(self.unwrittenPath))
+
+        if self.totalOffSpliceWritten > 0 and self.totalOnSplice == 0:
+            shutil.copyfile(self.offSplicePath, self.exportPath)
+        elif self.totalOffSpliceWritten > 0:
+            with open(self.offSplicePath, 'rb') as offSpliceFile, open(self.exportPath, 'ab') as exportFile:
+                offSpliceFile.readline() # skip header
+                shutil.copyfileobj(offSpliceFile, exportFile)
+        elif self.totalOnSplice == 0 and self.emptyExport is not None:
+            writeToCSV(self.emptyExport, self.exportPath)
+        log.info("Wrote spliced data to {}".format(self.exportPath))
+
+    # remove temporary off-splice rows file
+    def close(self):
+        os.remove(self.offSplicePath)
+
+# Parallel form of _spliceLoadedMeasurementData(): the rows of md are partitioned by site and hole, and each
+# partition is spliced and formatted as CSV text in one of up to processes worker processes. Workers
+# take their rows from a PU.SharedDataFrame of md rather than a pickled copy. Splice intervals and
+# affine rows each apply to the rows of a single hole, so the text of each interval's and affine row's
+# exported rows comes from one partition, and is merged in the order the serial mode writes it.
+def _spliceMeasurementDataInPartitions(affine, sit, md, exportPath, unwrittenPath, includeOffSplice, wholeSpliceSection, processes):
+    depthColumn = md.depthColumn
+    intervals = sit.getIntervals()
+    intervalOffsets = numpy.array([sirow.topCCSF - sirow.topCSF for sirow in intervals], dtype=numpy.float64)
+    holeCodes = md.df.groupby(['Site', 'Hole'], dropna=False, sort=False, observed=True).ngroup().to_numpy()
+    order = numpy.argsort(holeCodes, kind='stable')
+    partitions = numpy.split(order, numpy.flatnonzero(numpy.diff(holeCodes[order])) + 1) if len(order) > 0 else []
+    processes = min(processes, max(len(partitions), 1))
+    log.info("Splicing {} holes in {} processes".format(len(partitions), processes))
+
+    groups = [] # ((0, interval index) or (1, affine row position), CSV text of exported rows)
+    unwritten = []
+    totalOnSplice = totalOffSplice = totalOffSpliceWritten = 0
+    shared = PU.SharedDataFrame(md.df)
+    try:
+        state = (shared, affine, _getIntervalBounds(intervals), _getIntervalSections(intervals), intervalOffsets,
+                 md.name, depthColumn, includeOffSplice, wholeSpliceSection)
+        with _createWorkerPool(processes, state) as executor:
+            futures = [executor.submit(_splicePartition, rows) for rows in partitions]
+            for count, future in enumerate(as_completed(futures)):
+                partitionGroups, partitionUnwritten, onSpliceCount, offSpliceCount, writtenCount = future.result()
+                groups.extend(partitionGroups)
+                unwritten.append(partitionUnwritten)
+                totalOnSplice += onSpliceCount
+                totalOffSplice += offSpliceCount
+                totalOffSpliceWritten += writtenCount
+                reportProgress(100 * float(count + 1) / len(partitions), "Spliced {} of {} holes...".format(count + 1, len(partitions)))
+    finally:
+        shared.unlink()
+
+    log.info("Total spliced rows: {}".format(totalOnSplice))
+    if includeOffSplice:
+        log.info("Total off-splice rows: {}".format(totalOffSplice))
+        log.info("Total off-splice rows included in export: {}".format(totalOffSpliceWritten))
+        if totalOffSplice > totalOffSpliceWritten:
+            unwrittenDF = md.df.take(numpy.sort(numpy.concatenate(unwritten)))
+            log.warning("Of {} off-splice rows, {} were not included in the export.".format(totalOffSplice, len(unwrittenDF)))
+            log.warning("Those rows will be saved to {}".format(unwrittenPath))
+            prettyColumns(unwrittenDF, meas.MeasurementFormat)
+            writeToCSV(unwrittenDF, unwrittenPath)
+
+    header = _createSplicedExport(md.df, numpy.array([], dtype=numpy.int64), depthColumn, numpy.array([]), numpy.array([], dtype=object))
+    prettyColumns(header, meas.MeasurementFormat)
+    groups.sort(key=lambda group: group[0])
+    with open(exportPath, 'w', newline='', encoding='utf-8') as exportFile:
+        exportFile.write(csvio.writeToString(header))
+        for _, text in groups:
+            exportFile.write(text)
     log.info("Wrote spliced data to {}".format(exportPath))
 
-# rename and add columns in spliced measurement data per LacCore requirements
-def _prepSplicedRowsForExport(dataframe, rows, depthColumn, offset, onSplice):
+# Splice the measurement data rows at positions rows in a worker process. Returns the CSV text of the
+# exported rows grouped by interval and affine row as ((0, interval index) or (1, affine row position), text)
+# tuples, positions of unwritten off-splice rows, and counts of on-splice, off-splice and written off-splice rows.
+def _splicePartition(rows):
+    shared, affine, intervalBounds, intervalSections, intervalOffsets, name, depthColumn, includeOffSplice, wholeSpliceSection = _WorkerState
+    md = meas.MeasurementData(name, depthColumn, shared.take(rows))
+    intervalPositions = md.getIntervalRowPositions(*intervalBounds, intervalSections, wholeSpliceSection)
+    keys = [(0, index) for index, positions in enumerate(intervalPositions) if len(positions) > 0]
+    exportPositions = [intervalPositions[index] for _, index in keys]
+    exportOffsets = [numpy.full(len(intervalPositions[index]), intervalOffsets[index]) for _, index in keys]
+    onSpliceCount = sum(len(positions) for positions in exportPositions)
+    offSpliceCount = writtenCount = 0
+    unwritten = numpy.array([], dtype=numpy.int64)
+
+    if includeOffSplice:
+        onSplice = numpy.zeros(len(md.df), dtype=bool)
+        for positions in exportPositions:
+            onSplice[positions] = True
+        offSplicePositions = numpy.flatnonzero(~onSplice)
+        affinePositions, rowPositions = affine.joinCores(md.df[['Site', 'Hole', 'Core']].iloc[offSplicePositions])
+        affineOffsets = affine.dataframe['Offset'].to_numpy(dtype=numpy.float64)
+        starts = numpy.flatnonzero(numpy.diff(affinePositions, prepend=-1)) # affinePositions are sorted
+        for start, end in zip(starts, numpy.append(starts[1:], len(affinePositions))):
+            keys.append((1, affinePositions[start]))
+            exportPositions.append(offSplicePositions[rowPositions[start:end]])
+            exportOffsets.append(affineOffsets[affinePositions[start:end]])
+        written = numpy.zeros(len(offSplicePositions), dtype=bool)
+        written[rowPositions] = True
+        unwritten = rows[offSplicePositions[~written]]
+        offSpliceCount, writtenCount = len(offSplicePositions), len(rowPositions)
+
+    if len(keys) == 0:
+        return [], unwritten, onSpliceCount, offSpliceCount, writtenCount
+    onSpliceValues = numpy.repeat(numpy.array(['splice', 'off-splice'], dtype=object), [onSpliceCount, writtenCount])
+    exportdf = _createSplicedExport(md.df, numpy.concatenate(exportPositions), depthColumn, numpy.concatenate(exportOffsets), onSpliceValues)
+    prettyColumns(exportdf, meas.MeasurementFormat)
+    bounds = numpy.cumsum([0] + [len(positions) for positions in exportPositions])
+    lines = csvio.writeToString(exportdf, header=False).split(os.linesep)
+    if len(lines) == len(exportdf) + 1: # one line per row, unless values include line breaks
+        texts = ["".join(line + os.linesep for line in lines[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+    else:
+        texts = [csvio.writeToString(exportdf.iloc[start:end], header=False) for start, end in zip(bounds[:-1], bounds[1:])]
+    return list(zip(keys, texts)), unwritten, onSpliceCount, offSpliceCount, writtenCount
+
+# return list of section IDs (str) spanned by each splice interval
+def _getIntervalSections(intervals):
+    intervalSections = []
+    for sirow in intervals:
+        sections = [sirow.topSection]
+        if sirow.topSection != sirow.botSection:
+            intTop = int(sirow.topSection)
+            intBot = int(sirow.botSection)
+            sections = [str(x + intTop) for x in range(1 + intBot - intTop)]
+        intervalSections.append(sections)
+    return intervalSections
+
+# return sites, holes, cores, top and bottom CSF depths of splice intervals
+def _getIntervalBounds(intervals):
+    return [i.site for i in intervals], [i.hole for i in intervals], [i.core for i in intervals], [i.topCSF for i in intervals], [i.botCSF for i in intervals]
+
+# index of dataframe's columns at which Splice Depth, Offset and On-Splice columns are inserted
+def _getSpliceColumnIndex(dataframe):
     idIndex = PU.getLastColumnStartingWith(dataframe, "Sediment Depth")
     if not idIndex: # if no columns starting with Sediment Depth were found, insert at the beginning
         idIndex = 0
     else:
         idIndex += 1 # insert after Sediment Depth column
-    onSpliceStr = 'splice' if onSplice else 'off-splice'
-    nameValuesList = [('Splice Depth', pandas.Series(rows[depthColumn] + offset)), ('Offset', offset), ('On-Splice', onSpliceStr)]
+    return idIndex
+
+# Create spliced measurement data from the rows of dataframe at positions, adding columns per LacCore requirements.
+# offsets and onSpliceValues are aligned with positions, giving each row's affine offset and On-Splice value.
+def _createSplicedExport(dataframe, positions, depthColumn, offsets, onSpliceValues):
+    idIndex = _getSpliceColumnIndex(dataframe)
+    rows = dataframe.take(positions)
+    spliceDepths = dataframe[depthColumn].to_numpy()[positions] + offsets
+    nameValuesList = [('Splice Depth', spliceDepths), ('Offset', offsets), ('On-Splice', onSpliceValues)]
     PU.insertColumns(rows, idIndex, nameValuesList)
+    return rows
     
 
 class OffSpliceCore:
@@ -401,17 +1016,18 @@ class OffSpliceCore:
         return "{}{}-{}".format(self.osc.Site, self.osc.Hole, self.osc.Core)
 
 
-def gatherOffSpliceAffines(sit, secsumm, mancorr):
+def gatherOffSpliceAffines(sit, secsumm, mancorr, cache=None):
     # find all off-splice cores: those in section summary that are *not* in SIT
     skippedCoreCount = 0
     offSpliceCores = []
     onSpliceCores = []
     ssCores = secsumm.getCores()
+    ssSites = set(secsumm.getSites())
     for _, row in ssCores.iterrows():
         # brg 7/10/2018: Unsure why I did this any why I thought it would do anything.
         # Shouldn't all rows from secsumm have their site in secsumm.getSites()???
         # May be a vestige of the days when one site was allowed at a time.
-        if row.Site not in secsumm.getSites(): # skip section summary rows from non-site cores
+        if row.Site not in ssSites: # skip section summary rows from non-site cores
             skippedCoreCount += 1
             continue
         if not sit.containsCore(row.Site, row.Hole, row.Core):
@@ -419,10 +1035,26 @@ def gatherOffSpliceAffines(sit, secsumm, mancorr):
         else:
             onSpliceCores.append(row)
             
-    log.info("Found {} off-splice cores in {} section summary cores for sites {} - skipped {} non-site cores".format(len(offSpliceCores), len(ssCores), sorted(secsumm.getSites()), skippedCoreCount))
+    log.info("Found {} off-splice cores in {} section summary cores for sites {} - skipped {} non-site cores".format(len(offSpliceCores), len(ssCores), sorted(ssSites), skippedCoreCount))
+
+    # section depths of manual correlation tie points, computed in one batch for all off-splice cores
+    tieDepths = {}
+    if mancorr is not None and mancorr.includesOnSpliceCore():
+        ties = [mancorr.findByOffSpliceCore(osc.Site, osc.Hole, osc.Core) for osc in offSpliceCores]
+        ties = [mcc for mcc in ties if mcc is not None and sit.containsCore(mcc.Site2, mcc.Hole2, mcc.Core2)]
+        if len(ties) > 0:
+            tieDF = pandas.DataFrame(ties)
+            offSpliceMbsfs = secsumm.getOffsetDepths(tieDF.Site1, tieDF.Hole1, tieDF.Core1, tieDF.Section1, tieDF.SectionDepth1)
+            onSpliceMbsfs = secsumm.getOffsetDepths(tieDF.Site2, tieDF.Hole2, tieDF.Core2, tieDF.Section2, tieDF.SectionDepth2)
+            for mcc, offSpliceMbsf, onSpliceMbsf in zip(ties, offSpliceMbsfs, onSpliceMbsfs):
+                tieDepths[(mcc.Site1, mcc.Hole1, mcc.Core1)] = (offSpliceMbsf, onSpliceMbsf)
+
+    # on-splice cores with top closest to each off-splice core, the default shift method below
+    closestCores = secsumm.getCoresWithClosestTop(offSpliceCores, onSpliceCores)
 
     osAffineShifts = {}
     affineRows = []
+    offSpliceRows = {}
     
     # for each of the off-splice cores:
     for index, osc in enumerate(offSpliceCores):
@@ -442,49 +1074,67 @@ def gatherOffSpliceAffines(sit, secsumm, mancorr):
                     log.warning(warnstr.format(oscid, mancorr.getOffset(osc.Site, osc.Hole, osc.Core), osAffineShifts[oscid]))
             else:
                 log.debug("no manual correlation for {}".format(OffSpliceCore(osc)))
-            
-        offSpliceMbsf = 0.0
-        offset = 0.0
-        shiftType = "REL"
-        fixedCore = fixedTieCsf = shiftedTieCsf = None # used only case of TIE
 
-        # If so, apply the manual correlation
+        # determine what the core's shift is based on: a manual TIE to an on-splice core, a manual
+        # offset, or by default the on-splice core with top MBSF closest to that of the current core
+        reference = None
+        mcc = None
         if hasManual:
             if mancorr.includesOnSpliceCore(): # ManualCorrelationTable
                 mcc = mancorr.findByOffSpliceCore(osc.Site, osc.Hole, osc.Core)
                 if sit.containsCore(mcc.Site2, mcc.Hole2, mcc.Core2): # is correlation core actually on-splice?
                     log.debug("SIT contains on-splice core")
-
-                    # use sparse splice to SIT logic to determine affine for off-splice core based on alignment of section depths
-                    offSpliceMbsf = secsumm.getOffsetDepth(mcc.Site1, mcc.Hole1, mcc.Core1, mcc.Section1, mcc.SectionDepth1) # TODO: UPDATE
-                    log.debug("off-splice: {}@{} = {} MBSF".format(oscid, mcc.SectionDepth1, offSpliceMbsf))
-                    onSpliceMbsf = secsumm.getOffsetDepth(mcc.Site2, mcc.Hole2, mcc.Core2, mcc.Section2, mcc.SectionDepth2)
-                    log.debug("on-splice: {}{}-{}@{} = {} MBSF".format(mcc.Site2, mcc.Hole2, mcc.Core2, mcc.SectionDepth2, onSpliceMbsf))
-                    sitOffset = sit.getCoreOffset(mcc.Site2, mcc.Hole2, mcc.Core2)
-                    onSpliceMcd = onSpliceMbsf + sitOffset
-                    offset = onSpliceMcd - offSpliceMbsf
-                    log.debug("   + SIT offset of {} = {} MCD".format(sitOffset, onSpliceMcd))
-                    log.debug("   off-splice MBSF {} + {} offset = {} on-splice MCD".format(offSpliceMbsf, offset, onSpliceMcd))
-                    
-                    # track affine for off-splice core - additional correlations for that core will be ignored if present
-                    osAffineShifts[oscid] = offset
-                    shiftType = "TIE"
-                    fixedCore = "{}{}".format(mcc.Hole2, mcc.Core2)
-                    fixedTieCsf = onSpliceMbsf
-                    shiftedTieCsf = offSpliceMbsf
+                    reference = ("TIE", mcc.Site2, mcc.Hole2, mcc.Core2)
                 else:
                     # warn that "correlation core" is NOT on-splice and fall back on default top MBSF approach
                     log.warning("Alleged correlation core {}{}-{} is NOT on-splice, using default method to determine offset".format(mcc.Site2, mcc.Hole2, mcc.Core2))
             else: # ManualOffsetTable
-                offset = mancorr.getOffset(osc.Site, osc.Hole, osc.Core)
-                osAffineShifts[oscid] = offset
-                shiftType = "SET"
+                reference = ("SET",)
+        if reference is None:
+            closestCore = closestCores[index]
+            reference = ("REL", closestCore.Site, closestCore.Hole, closestCore.Core)
+
+        oscKey = (osc.Site, osc.Hole, osc.Core)
+        affineRow = cache.offSpliceRow(oscKey, reference) if cache is not None else None
+        if affineRow is not None:
+            log.debug("Shift reference of {} unchanged since last conversion, reusing offset {}".format(oscid, affineRow.cumOffset))
+            osAffineShifts[oscid] = affineRow.cumOffset
+            offSpliceRows[oscKey] = (reference, affineRow)
+            affineRows.append(affineRow)
+            continue
+
+        offSpliceMbsf = 0.0
+        offset = 0.0
+        shiftType = "REL"
+        fixedCore = fixedTieCsf = shiftedTieCsf = None # used only case of TIE
+
+        # If so, apply the manual correlation
+        if reference[0] == "TIE":
+            # use sparse splice to SIT logic to determine affine for off-splice core based on alignment of section depths
+            offSpliceMbsf, onSpliceMbsf = tieDepths[(mcc.Site1, mcc.Hole1, mcc.Core1)]
+            log.debug("off-splice: {}@{} = {} MBSF".format(oscid, mcc.SectionDepth1, offSpliceMbsf))
+            log.debug("on-splice: {}{}-{}@{} = {} MBSF".format(mcc.Site2, mcc.Hole2, mcc.Core2, mcc.SectionDepth2, onSpliceMbsf))
+            sitOffset = sit.getCoreOffset(mcc.Site2, mcc.Hole2, mcc.Core2)
+            onSpliceMcd = onSpliceMbsf + sitOffset
+            offset = onSpliceMcd - offSpliceMbsf
+            log.debug("   + SIT offset of {} = {} MCD".format(sitOffset, onSpliceMcd))
+            log.debug("   off-splice MBSF {} + {} offset = {} on-splice MCD".format(offSpliceMbsf, offset, onSpliceMcd))
+            
+            # track affine for off-splice core - additional correlations for that core will be ignored if present
+            osAffineShifts[oscid] = offset
+            shiftType = "TIE"
+            fixedCore = "{}{}".format(mcc.Hole2, mcc.Core2)
+            fixedTieCsf = onSpliceMbsf
+            shiftedTieCsf = offSpliceMbsf
+        elif reference[0] == "SET":
+            offset = mancorr.getOffset(osc.Site, osc.Hole, osc.Core)
+            osAffineShifts[oscid] = offset
+            shiftType = "SET"
         
-        # Otherwise, use default shift method: find the on-splice core with top MBSF
-        # closest to that of the current core, and use its affine shift.
+        # Otherwise, use default shift method: use the affine shift of the closest on-splice core.
         if oscid not in osAffineShifts:
             log.debug("No manual shift for {}, seeking closest top...".format(oscid))
-            closestCore = secsumm.getCoreWithClosestTop(osc.Site, osc.Hole, osc.Core, onSpliceCores)
+            log.debug("Closest core top to off-splice {}: on-splice {}{}-{} with top MBLF = {}".format(oscid, closestCore.Site, closestCore.Hole, closestCore.Core, closestCore.TopDepth))
             offset = sit.getCoreOffset(closestCore.Site, closestCore.Hole, closestCore.Core)
             osAffineShifts[oscid] = offset
 
@@ -492,7 +1142,11 @@ def gatherOffSpliceAffines(sit, secsumm, mancorr):
         affineRow = aff.AffineRow(osc.Site, osc.Hole, osc.Core, osc.Tool, coreTop, coreTop + offset, offset, shiftType=shiftType, comment="off-splice")
         if shiftType == "TIE":
             affineRow.setTieData(fixedCore, fixedTieCsf, shiftedTieCsf)
+        offSpliceRows[oscKey] = (reference, affineRow)
         affineRows.append(affineRow)
+
+    if cache is not None:
+        cache.offSpliceRows = offSpliceRows
         
     return affineRows
 
@@ -557,6 +1211,61 @@ class Test(unittest.TestCase):
         sit = si.SpliceIntervalTable.createWithFile(splicePath)
         self.assertTrue(len(affine.getSites()) == 7)
         self.assertTrue(len(sit.df) == 58)
+
+    def test_sparse_to_sit_in_background(self):
+        sparsePath = "testdata/GLAD9_Site1_SparseSplice.csv"
+        secsummPath = "testdata/GLAD9_SectionSummary.csv"
+        outPaths = []
+        for run, writeInBackground in [('', False), ('Background', True)]:
+            affinePath, sitPath = "testdata/GLAD9_Site1_Test{}Affine.csv".format(run), "testdata/GLAD9_Site1_Test{}SIT.csv".format(run)
+            convertSparseSplice(secsummPath, sparsePath, affinePath, sitPath, writeInBackground=writeInBackground)
+            outPaths.append((affinePath, sitPath))
+        for path, backgroundPath in zip(*outPaths):
+            with open(path) as file, open(backgroundPath) as backgroundFile:
+                self.assertTrue(file.read() == backgroundFile.read())
+
+        os.remove(outPaths[1][1]) # SIT is written even if the affine table can't be built, e.g. given a manual correlation in the wrong format
+        with self.assertRaises(FormatError):
+            convertSparseSplice(secsummPath, sparsePath, *outPaths[1], manualCorrelationPath=secsummPath, writeInBackground=True)
+        with open(outPaths[0][1]) as sitFile, open(outPaths[1][1]) as backgroundFile:
+            self.assertTrue(sitFile.read() == backgroundFile.read())
+
+    def test_validate_table(self):
+        sparse = SparseSplice.createWithFile("testdata/GLAD9_Site1_SparseSplice.csv").dataframe
+        validateTable(sparse, SparseSpliceFormat, "sparse")
+        sparse.loc[3, 'TopSection'] = '2.5'
+        with self.assertRaises(FormatError) as context:
+            validateTable(sparse, SparseSpliceFormat, "sparse")
+        self.assertTrue("TopSection column contains values other than integers and CC: 1 row(s) [3]" in str(context.exception))
+
+        sparsePath = "testdata/GLAD9_Site1_TestSparseSplice.csv" # core missing from section summary
+        sparse.loc[3, 'TopSection'] = '1'
+        sparse.loc[57, 'Core'] = '99'
+        writeToCSV(sparse, sparsePath)
+        with self.assertRaises(FormatError) as context:
+            convertSparseSplice("testdata/GLAD9_SectionSummary.csv", sparsePath, "testdata/GLAD9_Site1_TestAffine.csv", "testdata/GLAD9_Site1_TestSIT.csv")
+        self.assertTrue("Site/Hole/Core not found in Section Summary GLAD9_SectionSummary.csv: 1 row(s) [57]" in str(context.exception))
+
+    def test_incremental_conversion(self):
+        secsummPath = "testdata/GLAD9_SectionSummary.csv"
+        sparsePath = "testdata/GLAD9_Site1_TestSparseSplice.csv"
+        sparse = SparseSplice.createWithFile("testdata/GLAD9_Site1_SparseSplice.csv").dataframe
+        cache = ConversionCache()
+        writeToCSV(sparse, sparsePath)
+        convertSparseSplice(secsummPath, sparsePath, "testdata/GLAD9_Site1_TestAffine1.csv", "testdata/GLAD9_Site1_TestSIT1.csv", cache=cache)
+
+        # edit an interval near the bottom of the splice, drop the last one
+        sparse.loc[54, 'BottomOffset'] -= 5.0
+        writeToCSV(sparse.iloc[:-1], sparsePath)
+        self.assertTrue(cache.firstChangedRow(SparseSplice.createWithFile(sparsePath).dataframe) == 54)
+        outPaths = []
+        for run, runCache in [('Incremental', cache), ('Full', None)]:
+            affinePath, sitPath = "testdata/GLAD9_Site1_Test{}Affine.csv".format(run), "testdata/GLAD9_Site1_Test{}SIT.csv".format(run)
+            convertSparseSplice(secsummPath, sparsePath, affinePath, sitPath, cache=runCache)
+            outPaths.append((affinePath, sitPath))
+        for incPath, fullPath in zip(*outPaths):
+            with open(incPath) as incFile, open(fullPath) as fullFile:
+                self.assertTrue(incFile.read() == fullFile.read())
     
     def test_splice_measurement(self):
         affinePath = "testdata/GLAD9_Site1_TestAffine.csv"
@@ -565,6 +1274,136 @@ class Test(unittest.TestCase):
         splicedMeasPath = "testdata/GLAD9_Site1_XRF_test-spliced.csv"
         exportMeasurementData(affinePath, splicePath, measPath, splicedMeasPath, depthColumn='Sediment Depth, unscaled (MBS / CSF-A)') # include off-splice
 
+    def test_splice_measurement_chunks(self):
+        affinePath = "testdata/GLAD9_Site1_Affine.csv"
+        splicePath = "testdata/GLAD9_Site1_SITfromSparse.csv"
+        measPath = "testdata/GLAD9_Site1_XRF.csv"
+        exportPaths = ["testdata/GLAD9_Site1_XRF_test-spliced.csv", "testdata/GLAD9_Site1_XRF_test-chunks-spliced.csv"]
+        for exportPath, chunksize in zip(exportPaths, [None, 1000]):
+            exportMeasurementData(affinePath, splicePath, measPath, exportPath, depthColumn='Sediment Depth, unscaled (MBS / CSF-A)', chunksize=chunksize)
+        memDF, chunksDF = [self._sortedValues(path) for path in exportPaths] # chunks are in file order, e.g. 155 not 155.0
+        self.assertTrue(list(memDF.columns) == list(chunksDF.columns))
+        self.assertTrue(memDF.equals(chunksDF))
+
+    def test_splice_measurement_chunks_decode_error(self): # byte past the first chunk can't be decoded
+        measPath = "testdata/GLAD9_Site1_TestXRF.csv"
+        exportPath = "testdata/GLAD9_Site1_XRF_test-chunks-spliced.csv"
+        with open("testdata/GLAD9_Site1_XRF.csv", 'rb') as measFile:
+            rows = measFile.read().split(b'\r')
+        rows[3000] = rows[3000].replace(b',PET,', b',PET\xe9,', 1) # LocationID
+        with open(measPath, 'wb') as measFile:
+            measFile.write(b'\r'.join(rows))
+        with self.assertLogs(level='WARNING') as logs:
+            exportMeasurementData("testdata/GLAD9_Site1_Affine.csv", "testdata/GLAD9_Site1_SITfromSparse.csv", measPath, exportPath,
+                                  depthColumn='Sediment Depth, unscaled (MBS / CSF-A)', chunksize=1000)
+        self.assertTrue(any("Exporting again in" in output for output in logs.output))
+        exportDF = PU.readFile(exportPath)
+        self.assertTrue(len(exportDF) == len(rows) - 1)
+        self.assertTrue((exportDF.LocationID == 'PET\u00e9').sum() == 1)
+
+    # values of the CSV at path as floats where numeric, sorted by row
+    def _sortedValues(self, path):
+        df = PU.readFile(path)
+        for col in df.columns:
+            if PU.isNumeric(df[col].dtype):
+                df[col] = df[col].astype(numpy.float64)
+        return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+    def test_splice_measurement_chunks_section_id(self): # halves in SectionIDs of later chunks only
+        measPath = "testdata/GLAD9_Site1_TestXRF.csv"
+        exportPath = "testdata/GLAD9_Site1_XRF_test-chunks-spliced.csv"
+        md = PU.readFile("testdata/GLAD9_Site1_XRF.csv").drop(['Site', 'Hole', 'Core', 'CoreType', 'Section'], axis=1)
+        md.loc[3000:, 'SectionID'] += "-A"
+        writeToCSV(md, measPath)
+        exportMeasurementData("testdata/GLAD9_Site1_Affine.csv", "testdata/GLAD9_Site1_SITfromSparse.csv", measPath, exportPath,
+                              depthColumn='Sediment Depth, unscaled (MBS / CSF-A)', chunksize=1000)
+        exportDF = PU.readFile(exportPath) # parser error if rows' field counts differ
+        self.assertTrue(len(exportDF) == len(md))
+        self.assertTrue(list(exportDF.columns[:3]) == ['SectionID', 'Name', 'Site'])
+        self.assertTrue((exportDF.Half == 'A').sum() == len(md) - 3000)
+
+    def test_splice_measurement_partitions(self):
+        affinePath = "testdata/GLAD9_Site1_Affine.csv"
+        splicePath = "testdata/GLAD9_Site1_SITfromSparse.csv"
+        measPath = "testdata/GLAD9_Site1_XRF.csv"
+        exportPaths = ["testdata/GLAD9_Site1_XRF_test-spliced.csv", "testdata/GLAD9_Site1_XRF_test-partitions-spliced.csv"]
+        for exportPath, processes in zip(exportPaths, [None, 2]):
+            exportMeasurementData(affinePath, splicePath, measPath, exportPath, depthColumn='Sediment Depth, unscaled (MBS / CSF-A)', processes=processes)
+        with open(exportPaths[0]) as serialFile, open(exportPaths[1]) as partitionsFile:
+            self.assertTrue(serialFile.read() == partitionsFile.read())
+
+    def test_splice_measurement_raw_rows(self):
+        affinePath = "testdata/GLAD9_Site1_Affine.csv"
+        splicePath = "testdata/GLAD9_Site1_SITfromSparse.csv"
+        measPath = "testdata/GLAD9_Site1_XRF.csv"
+        exportPaths = ["testdata/GLAD9_Site1_XRF_test-spliced.csv", "testdata/GLAD9_Site1_XRF_test-raw-spliced.csv"]
+        for exportPath, rawRows in zip(exportPaths, [False, True]):
+            exportMeasurementData(affinePath, splicePath, measPath, exportPath, depthColumn='Sediment Depth, unscaled (MBS / CSF-A)', rawRows=rawRows)
+        parsed, raw = [pandas.read_csv(path) for path in exportPaths]
+        self.assertTrue(list(parsed.columns) == list(raw.columns))
+        for col in parsed.columns:
+            self.assertTrue(parsed[col].equals(raw[col]) or numpy.allclose(parsed[col], raw[col], equal_nan=True))
+        with open(measPath, 'rb') as measFile, open(exportPaths[1], 'rb') as rawFile:
+            measRows = set(measFile.read().splitlines()[1:])
+            rawExportRows = rawFile.read().splitlines()[1:]
+        for row in rawExportRows: # fields other than Splice Depth, Offset and On-Splice are copied unchanged, e.g. 0 not 0.0
+            fields = row.split(b',')
+            self.assertTrue(b','.join(fields[:12] + fields[15:]) in measRows)
+
+    def test_splice_measurement_raw_rows_section_id(self): # SectionID only: spliced in the default mode
+        measPath = "testdata/GLAD9_Site1_TestXRF.csv"
+        exportPaths = ["testdata/GLAD9_Site1_XRF_test-spliced.csv", "testdata/GLAD9_Site1_XRF_test-raw-spliced.csv"]
+        md = PU.readFile("testdata/GLAD9_Site1_XRF.csv").drop(['Site', 'Hole', 'Core', 'CoreType', 'Section'], axis=1)
+        writeToCSV(md, measPath)
+        for exportPath, rawRows in zip(exportPaths, [False, True]):
+            exportMeasurementData("testdata/GLAD9_Site1_Affine.csv", "testdata/GLAD9_Site1_SITfromSparse.csv", measPath, exportPath,
+                                  depthColumn='Sediment Depth, unscaled (MBS / CSF-A)', rawRows=rawRows)
+        with open(exportPaths[0]) as parsedFile, open(exportPaths[1]) as rawFile:
+            self.assertTrue(parsedFile.read() == rawFile.read())
+
+    def test_find_misaligned_row(self):
+        measPath = "testdata/GLAD9_Site1_XRF.csv"
+        depthColumns = ['Sediment Depth, unscaled (MBS / CSF-A)', 'Sediment Depth, scaled (MBS / CSF-B)']
+        header = PU.sniffHeader(measPath)
+        df = PU.readFile(measPath, na_values=['?', '??', '???'])
+        rawCSV = csvio.RawCSV(measPath, len(header.columns))
+        try:
+            self.assertTrue(_findMisalignedRow(df, rawCSV, header.columns, depthColumns) is None)
+            shifted = pandas.concat([df.iloc[:100], df.iloc[101:], df.iloc[100:101]], ignore_index=True) # row 100 parsed last
+            self.assertTrue(_findMisalignedRow(shifted, rawCSV, header.columns, depthColumns) == 100)
+        finally:
+            rawCSV.close()
+
+    def test_splice_measurement_depth_columns(self):
+        affinePath = "testdata/GLAD9_Site1_Affine.csv"
+        splicePath = "testdata/GLAD9_Site1_SITfromSparse.csv"
+        measPath = "testdata/GLAD9_Site1_XRF.csv"
+        depthColumns = ['Sediment Depth, unscaled (MBS / CSF-A)', 'Sediment Depth, scaled (MBS / CSF-B)']
+        exportPaths = ["testdata/GLAD9_Site1_XRF_test-unscaled-spliced.csv", "testdata/GLAD9_Site1_XRF_test-scaled-spliced.csv"]
+        exportMeasurementData(affinePath, splicePath, measPath, exportPaths, depthColumns)
+        for depthColumn, exportPath in zip(depthColumns, exportPaths):
+            exportMeasurementData(affinePath, splicePath, measPath, "testdata/GLAD9_Site1_XRF_test-spliced.csv", depthColumn)
+            with open("testdata/GLAD9_Site1_XRF_test-spliced.csv") as singleFile, open(exportPath) as multiFile:
+                self.assertTrue(singleFile.read() == multiFile.read())
+        self.assertRaises(ValueError, exportMeasurementData, affinePath, splicePath, measPath, exportPaths[0], depthColumns)
+
+    def test_splice_measurement_batch(self):
+        affinePath = "testdata/GLAD9_Site1_Affine.csv"
+        splicePath = "testdata/GLAD9_Site1_SITfromSparse.csv"
+        measPath = "testdata/GLAD9_Site1_XRF.csv"
+        depthColumn = 'Sediment Depth, unscaled (MBS / CSF-A)'
+        exportMeasurementData(affinePath, splicePath, measPath, "testdata/GLAD9_Site1_XRF_test-spliced.csv", depthColumn)
+        jobs = [(measPath, "testdata/GLAD9_Site1_XRF_test-batch-spliced.csv", depthColumn, True, False),
+                (affinePath, "testdata/GLAD9_Site1_Affine_test-batch-spliced.csv", depthColumn, True, False)] # not measurement data
+        with self.assertLogs(level='INFO') as logs:
+            results = exportMeasurementDataBatch(affinePath, splicePath, jobs, maxWorkers=2)
+        self.assertTrue(any(output.startswith("INFO:root:GLAD9_Site1_XRF.csv: Loaded 6411 rows") for output in logs.output)) # worker's record
+        self.assertTrue([mdPath for mdPath, _ in results] == [measPath, affinePath])
+        self.assertTrue(results[0][1] is None)
+        self.assertTrue(isinstance(results[1][1], FormatError))
+        with open("testdata/GLAD9_Site1_XRF_test-spliced.csv") as serialFile, open(jobs[0][1]) as batchFile:
+            self.assertTrue(serialFile.read() == batchFile.read())
+
 if __name__ == "__main__":
     log.basicConfig(level=log.INFO)
     unittest.main()
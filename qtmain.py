@@ -4,7 +4,7 @@ Created on Jul 30, 2017
 @author: bgrivna
 '''
 
-import os, sys, logging, traceback, webbrowser
+import os, sys, logging, multiprocessing, traceback, webbrowser
 from pathlib import Path
 
 from PyQt5 import QtWidgets, QtCore, QtGui
@@ -25,15 +25,14 @@ def validatePath(path, filetype):
         raise InvalidPathError("{} file '{}' does not exist".format(filetype, path))
     
 def getNumericCols(filepath):
-    df = PU.readFileMinimal(filepath)
-    cols = [c for c in df.columns if df[c].dtype == 'float64' or df[c].dtype == 'int64']
-    return cols
+    return PU.sniffHeader(filepath).getNumericColumns()
 
 class MainWindow(QtWidgets.QWidget):
     def __init__(self, app):
         QtWidgets.QWidget.__init__(self)
         self.app = app
         self.outputVocabDict = {"IODP": "IODP (Core Type)", "LacCore": "LacCore (Tool)"}
+        self.conversionCache = feldman.ConversionCache() # reused by successive sparse splice conversions
 
         self.initGUI()
         self.initPrefs()
@@ -242,7 +241,7 @@ class ConvertSparseToSITDialog(QtWidgets.QDialog):
             self.logText.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
             self.logText.logText.clear()
             feldman.setProgressListener(self.progressPanel)
-            feldman.convertSparseSplice(secSummPath, sparsePath, affineOutPath, sitOutPath, useScaledDepths, lazyAppend, sparseSpliceDepth, manCorrPath)
+            feldman.convertSparseSplice(secSummPath, sparsePath, affineOutPath, sitOutPath, useScaledDepths, lazyAppend, sparseSpliceDepth, manCorrPath, self.parent.conversionCache, writeInBackground=True)
             success = True
         except KeyError as err:
             gui.errbox(self, "Process failed", "{}".format("Expected column {} not found".format(err)))
@@ -349,10 +348,19 @@ class SpliceMeasurementDataDialog(QtWidgets.QDialog):
             self.logText.setLevel(logging.DEBUG if self.logText.isVerbose() else logging.INFO)
             self.logText.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
             self.logText.logText.clear()
-            for mdPath, depthColumn, includeOffSplice, wholeSpliceSection in spliceParams:
-                outPath = os.path.splitext(mdPath)[0] + "-spliced.csv"
-                feldman.exportMeasurementData(affinePath, sitPath, mdPath, outPath, depthColumn, includeOffSplice, wholeSpliceSection)
-            success = True
+            jobs = [(mdPath, os.path.splitext(mdPath)[0] + "-spliced.csv", depthColumn, includeOffSplice, wholeSpliceSection)
+                    for mdPath, depthColumn, includeOffSplice, wholeSpliceSection in spliceParams]
+            if len(jobs) == 1: # no worker processes to start, errors are handled below
+                feldman.exportMeasurementData(affinePath, sitPath, *jobs[0])
+                results = [(jobs[0][0], None)]
+            else: # files are spliced in this process if there's a single CPU
+                results = feldman.exportMeasurementDataBatch(affinePath, sitPath, jobs)
+            failures = [(mdPath, err) for mdPath, err in results if err is not None]
+            if len(failures) > 0:
+                msgs = ["{}: {}".format(os.path.basename(mdPath), "Expected column {} not found".format(err) if isinstance(err, KeyError) else err)
+                        for mdPath, err in failures]
+                gui.warnbox(self, "Process failed", "{} of {} files could not be spliced:\n\n{}".format(len(failures), len(jobs), "\n".join(msgs)))
+            success = len(failures) == 0
         except KeyError as err:
             gui.warnbox(self, "Process failed", "{}".format("Expected column {} not found".format(err)))
             logging.error(traceback.format_exc())
@@ -419,6 +427,7 @@ class ResultDialog(QtWidgets.QDialog):
 
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support() # batch splicing spawns worker processes, including in frozen builds
     logging.basicConfig(level=logging.DEBUG)
     app = QtWidgets.QApplication(sys.argv)
     window = MainWindow(app)
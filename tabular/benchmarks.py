@@ -0,0 +1,38 @@
+'''
+Created on Oct 17, 2026
+
+Timings of tabular routines on large synthetic tables, for tracking their speed.
+Run with python -m tabular.benchmarks from the root directory.
+'''
+
+import timeit
+
+import numpy
+import pandas
+
+from . import pandasutils as PU
+
+
+# Return a measurement data-like dataframe of rows rows, with identity columns as read from a CSV:
+# integer Site and Core (Core float, with some values missing), string Hole, Tool and Section.
+def createIdentityFrame(rows, seed=0):
+    rng = numpy.random.default_rng(seed)
+    core = rng.integers(1, 60, rows).astype(float)
+    core[rng.random(rows) < 0.01] = numpy.nan
+    return pandas.DataFrame({'Site': rng.integers(1, 4, rows),
+                             'Hole': rng.choice(numpy.array(['A', 'B', 'C', 'D'], dtype=object), rows),
+                             'Core': core,
+                             'Tool': rng.choice(numpy.array(['H', 'X', numpy.nan], dtype=object), rows),
+                             'Section': rng.choice(numpy.array(['1', '2', '3', '4', 'CC'], dtype=object), rows)})
+
+# Return best time in seconds of repeat runs of PU.forceStringDatatype() on all columns of a
+# createIdentityFrame() of rows rows
+def benchmarkForceStringDatatype(rows=5000000, repeat=3):
+    dataframe = createIdentityFrame(rows)
+    times = timeit.repeat(lambda: PU.forceStringDatatype(dataframe.copy(), list(dataframe.columns)), number=1, repeat=repeat)
+    return min(times)
+
+
+if __name__ == "__main__":
+    rows = 5000000
+    print("forceStringDatatype, {} rows: {:.3f}s".format(rows, benchmarkForceStringDatatype(rows)))
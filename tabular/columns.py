@@ -7,6 +7,7 @@ Classes to describe tabular data formats, logic to map/coerce input
 tabular data to those formats based on column names
 '''
 
+import functools
 import re
 import unittest
 
@@ -15,16 +16,56 @@ class TabularDatatype:
     NUMERIC = 1
     
 class TabularFormat:
-    def __init__(self, name, cols):
+    def __init__(self, name, cols, rules=None):
         self.name = name
         self.cols = cols # list of ColumnIdentitys
+        self.rules = rules if rules else [] # list of validation.ValidationRules of data in this format
+        self._index = None # ColumnIndex of cols, built on first use
         
     def getColumnNames(self):
         return [c.name for c in self.cols]
 
+    # map input column names to this format's columns, see map_columns()
+    def mapColumns(self, inputcols):
+        if self._index is None:
+            self._index = ColumnIndex(self.cols)
+        return self._index.map(inputcols)
+
+    # Read schema of an input file with columns inputcols: returns a tuple (usecols, dtypes).
+    # usecols lists the input columns mapped to this format, or is None to read all columns if
+    # passThrough is True. dtypes maps each input column mapped to a numeric format column to
+    # numericDatatype (e.g. 'float64' or 'float32'), and is empty if numericDatatype is None.
+    def getSchema(self, inputcols, passThrough=False, numericDatatype='float64'):
+        colmap = self.mapColumns(inputcols)
+        usecols = None if passThrough else [ic for ic in inputcols if ic in set(colmap.values())]
+        dtypes = {}
+        if numericDatatype is not None:
+            dtypes = {colmap[c.name]: numericDatatype for c in self.cols if c.isNumeric() and c.name in colmap}
+        return usecols, dtypes
+
+
+# las'd names and synonyms of a list of ColumnIdentitys, computed once, so a list
+# of input column names can be mapped with one dict lookup per input column
+class ColumnIndex:
+    def __init__(self, fmtcols):
+        self.order = [fc.name for fc in fmtcols]
+        self.names = {} # las'd name : names of format columns it matches, in format order
+        for fc in fmtcols:
+            for lasName in dict.fromkeys(las(name) for name in fc.names()):
+                self.names.setdefault(lasName, []).append(fc.name)
+
+    # same result as map_columns(): each format column maps to the last matching
+    # input column, and the map is ordered by format column
+    def map(self, inputcols):
+        matches = {}
+        for ic in inputcols:
+            for name in self.names.get(las(ic), []):
+                matches[name] = ic
+        return {name: matches[name] for name in self.order if name in matches}
+
 
 class ColumnIdentity:
-    def __init__(self, name, synonyms=None, orgNames=None, desc="[column description]", datatype=TabularDatatype.STRING, unit="", optional=False):
+    def __init__(self, name, synonyms=None, orgNames=None, desc="[column description]", datatype=TabularDatatype.STRING, unit="", optional=False, categorical=False):
         self.name = name # internal column name
         self.synonyms = synonyms if synonyms else [] # list of equivalent names
         self.orgNames = orgNames if orgNames else {} # dict of organization : canonical column name pairs        
@@ -32,6 +73,7 @@ class ColumnIdentity:
         self.datatype = datatype # expected datatype
         self.unit = unit # expected unit e.g. 'm'
         self.optional = optional
+        self.categorical = categorical # string column of identifiers, can be stored compactly as categorical
         
     def names(self):
         return [self.name] + self.synonyms
@@ -44,6 +86,9 @@ class ColumnIdentity:
     
     def isNumeric(self):
         return self.datatype == TabularDatatype.NUMERIC
+
+    def isCategorical(self):
+        return self.isString() and self.categorical
     
     # return org-specific name
     def orgName(self, org='IODP'):
@@ -86,20 +131,24 @@ def find_unit(colname):
 def lowerstrip(colname):
     return colname.replace(' ', '').lower()
 
-# lowerstrip and strip_unit
+# lowerstrip and strip_unit. The same few column names are normalized over
+# and over, so results are cached.
+@functools.lru_cache(maxsize=4096)
 def las(colname):
     return lowerstrip(strip_unit(colname))
 
 # does las'd colname match any las'd column name in names?
 def match_column(colname, names):
-    return las(colname) in [las(name) for name in names]
+    lasColname = las(colname)
+    return any(las(name) == lasColname for name in names)
 
 # return raw (non-las'd) string of first name in names matching colname
 # or None if no match is found
 def find_match(colname, names):
     match = None
+    lasColname = las(colname)
     for name in names:
-        if las(colname) == las(name):
+        if las(name) == lasColname:
             match = name
             break
     return match
@@ -108,19 +157,17 @@ def find_match(colname, names):
 # startstr or None if no match is found
 def find_starts_with(startstr, names):
     match = None
+    lasStart = las(startstr)
     for name in names:
-        if las(name).startswith(las(startstr)):
+        if las(name).startswith(lasStart):
             match = name
             break
     return match
 
 # return raw (non-las'd) strings of all elts in names that start with startstr
 def find_all_starts_with(startstr, names):
-    matches = []
-    for name in names:
-        if las(name).startswith(las(startstr)):
-            matches.append(name)
-    return matches
+    lasStart = las(startstr)
+    return [name for name in names if las(name).startswith(lasStart)]
 
 # return raw (non-las'd) strings of all elts in names that satisfy matchfn
 # (e.g. [str/unicode].startswith/endswith/__eq__)
@@ -135,13 +182,9 @@ def find_all_generic(searchstr, names, matchfn):
 
 # fmtcolids - list of ColumnIdentitys required by format
 # inputcols - list of column names to be mapped to format
+# Prefer TabularFormat.mapColumns(), which reuses the format's ColumnIndex.
 def map_columns(fmtcols, inputcols):
-    colmap = {}
-    for fc in fmtcols:
-        for ic in inputcols:
-            if fc.match(ic):
-                colmap[fc.name] = ic
-    return colmap
+    return ColumnIndex(fmtcols).map(inputcols)
 
 
 class Tests(unittest.TestCase):
@@ -181,7 +224,31 @@ class Tests(unittest.TestCase):
         icols = [" phooey ", "TAVERN (m)", "biz arre"] # handle synonyms, funky case, spacing, unit
         m = map_columns(TestFormat, icols)
         self.assertTrue(len(m) == 3)
+
+    def test_format_map_columns(self):
+        FooCol = ColumnIdentity("Foo", ["Fu", "Phooey"])
+        BarCol = ColumnIdentity("Bar", ["Bear", "Tavern", "Phooey"])
+        BazCol = ColumnIdentity("Baz", ["Bizarre", "Boz"], optional=True)
+        TestFormat = TabularFormat("Test", [FooCol, BarCol, BazCol])
+
+        icols = ["TAVERN (m)", " phooey ", "fu", "Other"]
+        m = TestFormat.mapColumns(icols)
+        self.assertTrue(m == {'Foo': 'fu', 'Bar': ' phooey '}) # last matching input column wins
+        self.assertTrue(list(m.keys()) == ['Foo', 'Bar']) # in format column order
+        self.assertTrue(m == map_columns(TestFormat.cols, icols))
+        self.assertTrue(TestFormat.mapColumns([]) == {})
         
+    def test_get_schema(self):
+        FooCol = ColumnIdentity("Foo", ["Fu"])
+        BarCol = ColumnIdentity("Bar", ["Bear"], datatype=TabularDatatype.NUMERIC)
+        BazCol = ColumnIdentity("Baz", datatype=TabularDatatype.NUMERIC, optional=True)
+        TestFormat = TabularFormat("Test", [FooCol, BarCol, BazCol])
+
+        icols = ["Other", "Bear (m)", "fu"]
+        self.assertTrue(TestFormat.getSchema(icols) == (["Bear (m)", "fu"], {"Bear (m)": 'float64'}))
+        self.assertTrue(TestFormat.getSchema(icols, passThrough=True, numericDatatype='float32') == (None, {"Bear (m)": 'float32'}))
+        self.assertTrue(TestFormat.getSchema(icols, numericDatatype=None) == (["Bear (m)", "fu"], {}))
+
     def test_pretty_name(self):
         Col = ColumnIdentity("ShortA", [], {'A':"Pretty A Name", 'IODP':"Purty B Name"})
         self.assertTrue(Col.prettyName("A") == "Pretty A Name")
@@ -4,27 +4,95 @@ Created on Jan 24, 2018
 @author: bgrivna
 '''
 
+import codecs
+import io
 import logging as log
+import mmap
+import os
 import unittest
 
+import numpy
 import pandas
 
 from . import pandasutils as PU
 from . import columns as TC
+from . import validation as TV
 
 class FormatError(Exception):
     pass
 
-# read CSV from filepath, map columns to given format, and split SiteHole column if needed
-def createWithCSV(filepath, fmt):
+# If True, createWithCSV() stores identity columns (ColumnIdentity.categorical) as pandas
+# Categoricals drawing on one category dictionary shared by all tables, for integer-code
+# comparisons and a smaller memory footprint. Written output is unaffected.
+CompactIdentityColumns = False
+IdentityCategories = pandas.Index([], dtype=object)
+
+def setCompactIdentity(compact):
+    global CompactIdentityColumns
+    CompactIdentityColumns = compact
+
+# Start a new category dictionary for tables loaded from now on, so that IdentityCategories
+# holds only the values of one run's tables rather than of every table loaded by the process.
+# Tables loaded earlier keep their categories, and are joined with later ones on their values.
+def clearIdentityCategories():
+    global IdentityCategories
+    IdentityCategories = pandas.Index([], dtype=object)
+
+# read CSV from filepath, map columns to given format, and split SiteHole column if needed.
+# splitter is an optional function that returns the dataframe read from filepath with
+# columns split from a compound column (e.g. coring.utils.splitSectionID), applied
+# before columns are mapped.
+# If passThrough is False, only columns mapped to fmt (and SiteHole) are read, plus
+# any columns in passThrough if it's a list of column names. If
+# numericDatatype is given, fmt's numeric columns are read as that datatype (e.g.
+# numpy.float64) rather than inferred. If the file can't be read that way, e.g. a
+# numeric column holds text, it's read with every column and inferred datatypes.
+def createWithCSV(filepath, fmt, splitter=None, passThrough=True, numericDatatype=None):
     log.info("Creating {} with {}...".format(fmt.name, filepath))
-    dataframe = PU.readFile(filepath, na_values=['?', '??', '???'])
-    
+    dataframe = None
+    if passThrough is not True or numericDatatype is not None:
+        dataframe = _readWithSchema(filepath, fmt, passThrough, numericDatatype)
+    if dataframe is None:
+        dataframe = PU.readFile(filepath, na_values=['?', '??', '???'])
+    return mapToFormat(dataframe, fmt, splitter)
+
+# read CSV from filepath with fmt.getSchema(), returning None if it can't be read that way
+def _readWithSchema(filepath, fmt, passThrough, numericDatatype):
+    columns = PU.sniffHeader(filepath).columns
+    usecols, dtypes = fmt.getSchema(columns, passThrough is True, numericDatatype)
+    if usecols is not None:
+        extraCols = [TC.find_match("SiteHole", columns)] + (passThrough if isinstance(passThrough, list) else [])
+        usecols += [col for col in extraCols if col is not None and col not in usecols]
+    try:
+        return PU.readFile(filepath, na_values=['?', '??', '???'], usecols=usecols, dtype=dtypes)
+    except ValueError as err:
+        log.info("Couldn't read {} with {} schema, reading all columns: {}".format(filepath, fmt.name, err))
+        return None
+
+# createWithCSV() for files too large to load at once: yields one dataframe for each chunksize
+# rows of filepath, read in a single pass. So that every chunk has the same datatypes, they're
+# decided from the header: numeric columns of fmt are float64, columns in dtypes (e.g. depth
+# columns) have the given datatype, and all others, including identity columns, are strings.
+# encoding: see PU.readFileChunks(), which may raise UnicodeDecodeError after the first chunk
+def createChunksWithCSV(filepath, fmt, chunksize, splitter=None, dtypes=None, encoding='utf-8-sig'):
+    log.info("Creating {} with {} in chunks of {} rows...".format(fmt.name, filepath, chunksize))
+    columns = PU.sniffHeader(filepath, encoding).columns
+    datatypes = {col: str for col in columns}
+    datatypes.update(fmt.getSchema(columns, True, 'float64')[1])
+    datatypes.update({col: dtype for col, dtype in (dtypes or {}).items() if col in datatypes})
+    for dataframe in PU.readFileChunks(filepath, chunksize, na_values=['?', '??', '???'], encoding=encoding, dtype=datatypes):
+        yield mapToFormat(dataframe, fmt, splitter)
+
+# split SiteHole column if needed, map columns of dataframe read from CSV to given format
+def mapToFormat(dataframe, fmt, splitter=None):
+    global IdentityCategories
     # split compounds
     dataframe = splitSiteHole(dataframe)
+    if splitter is not None:
+        dataframe = splitter(dataframe)
     
     # map format columns to input columns
-    colmap = TC.map_columns(fmt.cols, list(dataframe.columns))
+    colmap = fmt.mapColumns(list(dataframe.columns))
     
     if len(colmap) != len(fmt.cols):
         # if required columns are missing, bail out
@@ -42,14 +110,22 @@ def createWithCSV(filepath, fmt):
     PU.renameColumns(dataframe, reverseColmap) # use format column names
     log.info("Column map: {}".format(["{} -> {}".format(k,v) for k,v in reverseColmap.items()]))
     PU.forceStringDatatype(dataframe, [col.name for col in fmt.cols if col.isString()])
+    if CompactIdentityColumns:
+        IdentityCategories = PU.forceCategoricalDatatype(dataframe, [col.name for col in fmt.cols if col.isCategorical()], IdentityCategories)
 
     return dataframe
 
 # write a DataFrame to a CSV at the given path, removing Site and Hole
-# columns if a SiteHole column is present
-def writeToCSV(dataframe, filepath):
+# columns if a SiteHole column is present. If append is True, rows are
+# added to the end of an existing CSV, without a header.
+def writeToCSV(dataframe, filepath, append=False):
     dataframe = dropSiteHole(dataframe)
-    PU.writeToFile(dataframe, filepath)
+    PU.writeToFile(dataframe, filepath, append)
+
+# return a DataFrame as the CSV text writeToCSV() would write, removing Site and
+# Hole columns if a SiteHole column is present
+def writeToString(dataframe, header=True):
+    return PU.writeToString(dropSiteHole(dataframe), header)
 
 # split data of form [numeric][alphabetic] into separate columns
 def splitCompoundColumn(df, colname):
@@ -77,24 +153,89 @@ def dropSiteHole(df):
 # TODO: account for splitting of SiteHole
 def canCreateWithFile(filepath, fmt):
     headers = PU.readHeaders(filepath)
-    colmap = TC.map_columns(fmt.cols, headers)
+    colmap = fmt.mapColumns(headers)
     missingRequiredColumns = [c.name for c in fmt.cols if not c.optional and c.name not in colmap]
     canCreate = len(missingRequiredColumns) == 0
     return canCreate
 
-def validData(filepath, fmt, colmap):
-    valid = False
-    # read full file
-    df = PU.readFile(filepath)
-    colmap = TC.map_columns(fmt.cols, list(df.columns))
-    # apply colmap
-    PU.renameColumns(df, {v: k for k,v in colmap.items()})
-    # validate contents of columns
-    for fmtcol in fmt.cols:
-        if fmtcol.name in df:
-            pass
-    # TODO: perform format-specific validation (e.g. TopDepth >= BottomDepth for each row of a SectionSummary)
-    return valid
+# Data rows of a CSV file as spans of raw bytes, so rows can be copied to output
+# unchanged without parsing and reformatting their values. The file is memory-mapped.
+# Only simple files are supported: UTF-8, comma-delimited, no quoted data fields, and
+# a field for each of columnCount columns in every row. FormatError is raised for
+# other files. Rows are non-blank lines after the header, ending in LF, CRLF or CR.
+class RawCSV:
+    def __init__(self, filepath, columnCount):
+        self.columnCount = columnCount
+        with open(filepath, 'rb') as rawfile:
+            if os.fstat(rawfile.fileno()).st_size == 0:
+                raise FormatError("{} is empty".format(filepath))
+            self.data = mmap.mmap(rawfile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._findRows(filepath)
+        except:
+            self.close()
+            raise
+
+    def _findRows(self, filepath):
+        data = numpy.frombuffer(self.data, dtype=numpy.uint8)
+        newline = b'\n' if self.data.find(b'\n') != -1 else b'\r' # old Mac line endings
+        newlines = numpy.flatnonzero(data == ord(newline))
+        starts = numpy.concatenate(([0], newlines + 1))
+        ends = numpy.append(newlines, len(data))
+        ends -= (ends > starts) & (data[numpy.maximum(ends - 1, 0)] == ord('\r')) # CRLF line endings
+        commas = numpy.flatnonzero(data == ord(','))
+        del data # self.data can't be closed while a view of it exists
+        if self.data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+            starts[0] = min(len(codecs.BOM_UTF8), ends[0])
+        nonblank = ends > starts
+        starts, ends = starts[nonblank][1:], ends[nonblank][1:] # skip header
+        if len(starts) > 0 and self.data.find(b'"', starts[0]) != -1:
+            raise FormatError("{} has quoted data fields".format(filepath))
+        self.commas = commas
+        self.firstCommas = numpy.searchsorted(self.commas, starts)
+        if (numpy.searchsorted(self.commas, ends) - self.firstCommas != self.columnCount - 1).any():
+            raise FormatError("{} has rows without exactly {} fields".format(filepath, self.columnCount))
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    # Write rows at positions to outfile, a binary file, each ending in os.linesep. If insertFields
+    # is given, insertFields[i] (bytes of one or more comma-delimited fields) is inserted in the
+    # ith written row before the field of column index insertAt.
+    def writeRows(self, outfile, positions, insertAt=0, insertFields=None):
+        linesep = os.linesep.encode()
+        data = self.data
+        starts, ends = self.starts[positions].tolist(), self.ends[positions].tolist()
+        if insertFields is None:
+            outfile.writelines(data[start:end] + linesep for start, end in zip(starts, ends))
+        elif insertAt == 0:
+            outfile.writelines(fields + b',' + data[start:end] + linesep for start, end, fields in zip(starts, ends, insertFields))
+        else:
+            if insertAt < self.columnCount: # insert before comma ending field insertAt - 1
+                splits = self.commas[self.firstCommas[positions] + insertAt - 1].tolist()
+            else:
+                splits = ends
+            outfile.writelines(data[start:split] + b',' + fields + data[split:end] + linesep
+                               for start, split, end, fields in zip(starts, splits, ends, insertFields))
+
+    # bytes of the field of column index col in each row, in row order
+    def getFields(self, col):
+        starts = self.starts if col == 0 else self.commas[self.firstCommas + col - 1] + 1
+        ends = self.commas[self.firstCommas + col] if col < self.columnCount - 1 else self.ends
+        data = self.data
+        return [data[start:end] for start, end in zip(starts.tolist(), ends.tolist())]
+
+    def close(self):
+        self.data.close()
+
+
+# Validate a dataframe created with fmt (e.g. by createWithCSV()) against fmt's rules and any
+# additional rules, e.g. those relating it to another table. Returns a validation.ValidationReport
+# of the index values of offending rows.
+def validData(dataframe, fmt, rules=None):
+    return TV.validate(dataframe, fmt.rules + (rules if rules else []))
 
 
 class Tests(unittest.TestCase):
@@ -106,6 +247,43 @@ class Tests(unittest.TestCase):
         self.assertTrue(splitdf['Hole'][0] == 'A')
         self.assertTrue(splitdf['Hole'][1] == 'B')
     
+    def test_create_with_schema(self):
+        fmt = TC.TabularFormat("Test", [TC.ColumnIdentity("Core"), TC.ColumnIdentity("TopDepth", datatype=TC.TabularDatatype.NUMERIC),
+                                        TC.ColumnIdentity("Gaps", optional=True)])
+        df = createWithCSV("../testdata/GLAD9_SectionSummary.csv", fmt)
+        schemaDF = createWithCSV("../testdata/GLAD9_SectionSummary.csv", fmt, passThrough=False, numericDatatype='float32')
+        self.assertTrue(list(schemaDF.columns) == ['Core', 'TopDepth', 'Gaps'])
+        self.assertTrue(schemaDF.TopDepth.dtype == 'float32')
+        self.assertTrue(schemaDF.Core.equals(df.Core))
+
+        # a numeric column holding text is read with its inferred datatype
+        textFmt = TC.TabularFormat("Text", [TC.ColumnIdentity("CoreType", datatype=TC.TabularDatatype.NUMERIC)])
+        textDF = createWithCSV("../testdata/GLAD9_SectionSummary.csv", textFmt, passThrough=False, numericDatatype='float64')
+        self.assertTrue(len(textDF.columns) == 10) # every column of the file
+        self.assertTrue(textDF.CoreType[0] == 'H')
+
+    def test_raw_csv(self):
+        path = "../testdata/GLAD9_SectionSummary.csv"
+        rawCSV = RawCSV(path, 10)
+        try:
+            with open(path, 'rb') as rawfile:
+                lines = rawfile.read().splitlines()[1:]
+            self.assertTrue(len(rawCSV) == len(lines))
+            for insertAt in [0, 3, 10]:
+                out = io.BytesIO()
+                rawCSV.writeRows(out, numpy.array([2, 0]), insertAt, [b'x,y', b'z,w'])
+                fields = [lines[pos].split(b',') for pos in [2, 0]]
+                expected = [b','.join(f[:insertAt] + ins + f[insertAt:]) for f, ins in zip(fields, [[b'x', b'y'], [b'z', b'w']])]
+                self.assertTrue(out.getvalue().splitlines() == expected)
+            out = io.BytesIO()
+            rawCSV.writeRows(out, numpy.array([1]))
+            self.assertTrue(out.getvalue() == lines[1] + os.linesep.encode())
+            for col in [0, 4, 9]:
+                self.assertTrue(rawCSV.getFields(col) == [line.split(b',')[col] for line in lines])
+        finally:
+            rawCSV.close()
+        self.assertRaises(FormatError, RawCSV, path, 11) # wrong number of fields
+
     def test_sitehole(self):
         df = pandas.DataFrame({'Site': ['1','2'], 'Hole': ['A', 'B']})
         self.assertTrue(len(splitSiteHole(df).columns) == 2) # no split needed
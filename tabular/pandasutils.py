@@ -6,7 +6,13 @@ Utility logic for Pandas, to which the software remains tightly coupled.
 @author: bgrivna
 '''
 
+import codecs
+import csv
+import importlib.util
+import io
+import locale
 import logging as log
+from multiprocessing import shared_memory
 import unittest
 
 import numpy
@@ -15,25 +21,143 @@ import pandas
 from .columns import find_match, find_all_starts_with
 
 
+# Bytes at the start of a file from which its delimiter and encoding are sniffed
+HeadSampleSize = 64 * 1024
+
+# Encoding of files that can't be decoded in the requested encoding: the system default, or if
+# that's UTF-8, Windows-1252, the usual encoding of files exported by Windows software
+FallbackEncoding = locale.getpreferredencoding(False)
+if codecs.lookup(FallbackEncoding).name == 'utf-8':
+    FallbackEncoding = 'cp1252'
+
+# Return encoding if the first HeadSampleSize bytes of the file at filepath can be decoded in it,
+# otherwise FallbackEncoding. If bytes past the sample can't be decoded, readers read the whole
+# file again in FallbackEncoding, see readFile().
+def sniffEncoding(filepath, encoding='utf-8-sig'):
+    sample, complete = _readHeadSample(filepath)
+    return _sniffSampleEncoding(sample, complete, encoding)
+
+def _sniffSampleEncoding(sample, complete, encoding):
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+        return encoding
+    except UnicodeDecodeError as msg:
+        _logFallback(encoding, msg)
+        return FallbackEncoding
+
+def _logFallback(encoding, err):
+    log.warning("Couldn't decode file in {} encoding: {}".format(encoding, err))
+    log.warning("Attempting to open with default encoding...")
+
+# codec error handling for reads in encoding: FallbackEncoding is the last resort, in which
+# bytes it can't decode (e.g. 0x81 in Windows-1252) are replaced rather than failing the read
+def _decodingErrors(encoding):
+    return 'replace' if encoding == FallbackEncoding else 'strict'
+
+# CSV parsing engines readFile() tries in turn, fastest first. pyarrow is optional, and
+# doesn't support the skipinitialspace and nrows options.
+def _getEngines(skipinitialspace, nrows):
+    engines = ['c', 'python']
+    if not skipinitialspace and nrows is None and importlib.util.find_spec('pyarrow') is not None:
+        engines.insert(0, 'pyarrow')
+    return engines
+
+# Return the first HeadSampleSize bytes of the file at filepath, and True if they're the whole file
+def _readHeadSample(filepath):
+    with open(filepath, 'rb') as srcfile:
+        sample = srcfile.read(HeadSampleSize)
+    return sample, len(sample) < HeadSampleSize
+
+# Return the delimiter of the CSV at filepath, sniffed from its first non-blank line as the python
+# engine sniffs it with sep=None, or None if it can't be determined from the first HeadSampleSize bytes.
+def sniffDelimiter(filepath, encoding='utf-8-sig'):
+    sample, complete = _readHeadSample(filepath)
+    return _sniffSampleDelimiter(sample.decode(encoding, errors='replace'), complete)
+
+def _sniffSampleDelimiter(text, complete):
+    for line in io.StringIO(text, newline=None):
+        if not line.endswith('\n') and not complete: # line may continue past sample
+            return None
+        if line.strip():
+            try:
+                return csv.Sniffer().sniff(line.rstrip('\n') + '\n').delimiter
+            except csv.Error:
+                return None
+    return None
+
+# Read CSV at filepath with the fastest engine that can parse it, sniffing its delimiter if sep is
+# None. The C engine's datatypes and values are those of the python engine, which is used when the
+# delimiter can't be sniffed, or if engine is 'python'. The file is read once, in the encoding
+# sniffEncoding() chooses, from the same head sample its delimiter is sniffed from.
+# usecols and dtype are passed to pandas.read_csv() to read only some columns, or
+# to read columns with given datatypes.
 # default utf-8-sig encoding ignores Byte Order Mark (BOM)
 def readFile(filepath, nrows=None, na_values=None, sep=None, skipinitialspace=True,
-             engine='python', mode='r', encoding='utf-8-sig'):
-    success = False
-    with open(filepath, mode) as srcfile:
+             engine=None, encoding='utf-8-sig', usecols=None, dtype=None):
+    readArgs = dict(nrows=nrows, na_values=na_values, skipinitialspace=skipinitialspace, skip_blank_lines=True,
+                    usecols=usecols, dtype=dtype)
+    sample, complete = _readHeadSample(filepath)
+    encoding = _sniffSampleEncoding(sample, complete, encoding)
+    try:
+        return _readFile(filepath, sep, engine, encoding, readArgs, sample, complete)
+    except UnicodeDecodeError as err: # past the sniffed sample, rare: read the whole file again
+        _logFallback(encoding, err)
+        return _readFile(filepath, sep, engine, FallbackEncoding, readArgs, sample, complete)
+
+# Read filepath with each engine in turn until one succeeds. If sep is None, the delimiter is sniffed
+# from sample, the file's head sample, for the faster engines, and the python engine sniffs it itself;
+# a given sep is used by every engine.
+def _readFile(filepath, sep, engine, encoding, readArgs, sample, complete):
+    engines = [engine] if engine is not None else _getEngines(readArgs['skipinitialspace'], readArgs['nrows'])
+    sniffedSep = sep
+    if sep is None and engines != ['python']:
+        sniffedSep = _sniffSampleDelimiter(sample.decode(encoding, errors='replace'), complete)
+        if sniffedSep is None:
+            engines = ['python']
+    for engine in engines:
         try:
-            dataframe = pandas.read_csv(srcfile, nrows=nrows, sep=sep, skipinitialspace=skipinitialspace,
-                                        na_values=na_values, engine=engine, encoding=encoding, skip_blank_lines=True)
-            success = True
-        except UnicodeDecodeError as msg:
-            log.warning("Couldn't decode file in {} encoding: {}".format(encoding, msg))
-    
-    if not success:
-        log.warning("Attempting to open with default encoding...")
-        with open(filepath, mode) as srcfile:
-            dataframe = pandas.read_csv(srcfile, nrows=nrows, sep=sep, skipinitialspace=skipinitialspace,
-                                        na_values=na_values, engine=engine) # try default encoding
-        
-    return dataframe
+            return pandas.read_csv(filepath, sep=sniffedSep if engine != 'python' else sep, engine=engine, encoding=encoding,
+                                   encoding_errors=_decodingErrors(encoding), **readArgs)
+        except UnicodeDecodeError: # no engine can decode the file
+            raise
+        except Exception as err:
+            if engine == engines[-1]:
+                raise
+            log.debug("Couldn't read {} with {} engine, trying next engine: {}".format(filepath, engine, err))
+
+# readFile() in chunks: yields a dataframe for each chunksize rows of filepath, read in a single pass.
+# pandas infers column datatypes separately for each chunk, e.g. a column of integers is float
+# in a chunk with an empty value, so dtype should give the datatype of each column that must be
+# the same in every chunk. If bytes past the head sample can't be decoded before the first chunk
+# is yielded, the file is read in FallbackEncoding. Later, UnicodeDecodeError is raised, and the
+# caller must start over from the first chunk with encoding=FallbackEncoding.
+def readFileChunks(filepath, chunksize, na_values=None, sep=None, skipinitialspace=True,
+                   engine=None, encoding='utf-8-sig', dtype=None):
+    sample, complete = _readHeadSample(filepath)
+    encoding = _sniffSampleEncoding(sample, complete, encoding)
+    if engine is None:
+        engine = 'python'
+        if sep is None:
+            sep = _sniffSampleDelimiter(sample.decode(encoding, errors='replace'), complete)
+        if sep is not None:
+            engine = 'c'
+    readArgs = dict(na_values=na_values, sep=sep, skipinitialspace=skipinitialspace, engine=engine, dtype=dtype)
+    yielded = False
+    try:
+        for chunk in _readChunks(filepath, chunksize, encoding=encoding, **readArgs):
+            yielded = True
+            yield chunk
+    except UnicodeDecodeError as err:
+        if yielded:
+            raise
+        _logFallback(encoding, err)
+        yield from _readChunks(filepath, chunksize, encoding=FallbackEncoding, **readArgs)
+
+def _readChunks(filepath, chunksize, na_values=None, sep=None, skipinitialspace=True,
+                engine='python', encoding='utf-8-sig', dtype=None):
+    with pandas.read_csv(filepath, chunksize=chunksize, sep=sep, skipinitialspace=skipinitialspace, dtype=dtype, na_values=na_values,
+                         engine=engine, skip_blank_lines=True, encoding=encoding, encoding_errors=_decodingErrors(encoding)) as reader:
+        yield from reader
 
 # Return minimal dataframe with headers and first row of data.
 # Useful for validation etc without loading every row of data,
@@ -43,10 +167,47 @@ def readFileMinimal(filepath):
     return dataframe
 
 def readHeaders(filepath):
-    return list(readFileMinimal(filepath).columns)
+    return sniffHeader(filepath).columns
+
+# Column names, delimiter and encoding of a CSV file, and for each column, whether its value in
+# the first row of data is numeric, i.e. read by readFileMinimal() as an int64 or float64
+class HeaderInfo:
+    def __init__(self, columns, delimiter, encoding, numeric):
+        self.columns = columns
+        self.delimiter = delimiter
+        self.encoding = encoding
+        self.numeric = numeric
+
+    def getNumericColumns(self):
+        return [col for col, numeric in zip(self.columns, self.numeric) if numeric]
+
+# Return HeaderInfo of the CSV file at filepath. Its encoding and delimiter are sniffed from the first
+# HeadSampleSize bytes, and its header and first row of data are read from the whole lines of those bytes
+# as readFileMinimal() reads them, without reading the file again. If the sample doesn't hold them (e.g.
+# the delimiter can't be sniffed, or the header is longer than the sample), readFileMinimal() is used.
+def sniffHeader(filepath, encoding='utf-8-sig'):
+    sample, complete = _readHeadSample(filepath)
+    encoding = _sniffSampleEncoding(sample, complete, encoding)
+    if not complete:
+        sample = sample[:max(sample.rfind(b'\n'), sample.rfind(b'\r')) + 1]
+    text = sample.decode(encoding, errors=_decodingErrors(encoding))
+    delimiter = _sniffSampleDelimiter(text, True)
+    dataframe = None
+    if delimiter is not None:
+        try:
+            dataframe = pandas.read_csv(io.StringIO(text), nrows=1, sep=delimiter, engine='c', skipinitialspace=True, skip_blank_lines=True)
+        except Exception as err: # e.g. a quoted value continuing past the sample
+            log.debug("Couldn't read header of {} from its first {} bytes: {}".format(filepath, len(sample), err))
+    if dataframe is None or (len(dataframe) == 0 and not complete):
+        dataframe = readFileMinimal(filepath)
+    return HeaderInfo(list(dataframe.columns), delimiter, encoding, [isNumeric(dtype) for dtype in dataframe.dtypes])
+
+def writeToFile(dataframe, filepath, append=False):
+    dataframe.to_csv(filepath, index=False, mode='a' if append else 'w', header=not append)
 
-def writeToFile(dataframe, filepath):
-    dataframe.to_csv(filepath, index=False)
+# Return dataframe as CSV text as writeToFile() would write it, with lines ending in os.linesep
+def writeToString(dataframe, header=True):
+    return dataframe.to_csv(index=False, header=header)
 
 def renameColumns(dataframe, colmap):
     dataframe.rename(columns=colmap, inplace=True)
@@ -99,14 +260,130 @@ def isInteger(dtype):
     return dtype == numpy.int64
 
 # For each column in list cols, force pandas column dtype and convert values to object (string)
+# as str() converts them, NaN values to empty strings. Columns of numbers, or of strings and NaN,
+# are converted one unique value at a time, identity columns having few unique values. Floats are
+# told apart by their bits, so that e.g. 0.0 and -0.0 keep their own strings.
 def forceStringDatatype(dataframe, cols):
     for col in cols:
-        dataframe[col] = dataframe[col].astype(object)
-        dataframe[col] = dataframe[col].apply(lambda x: str(x)) # todo: if x != NaN? to avoid line below?
-        
-        # forced string conversion forces all NaN values to the string "nan" - remove these
-        dataframe[col] = dataframe[col].apply(lambda x: "" if x == "nan" else x)
-        
+        values = dataframe[col].to_numpy()
+        if values.dtype.kind == 'f':
+            keys = values.view('i{}'.format(values.itemsize))
+        elif values.dtype.kind in 'biu' or (values.dtype == object and _isStringsAndNaN(values)):
+            keys = values
+        else:
+            dataframe[col] = _toStrings(values.astype(object))
+            continue
+        codes, uniques = pandas.factorize(keys)
+        uniques = numpy.asarray(uniques)
+        if values.dtype.kind == 'f':
+            uniques = uniques.view(values.dtype)
+        strings = numpy.append(_toStrings(uniques.astype(object)), "") # NaN strings have code -1
+        dataframe[col] = strings[codes]
+
+# are all values strings or NaN, which pandas.factorize() codes as -1? (None and other NA values aren't)
+def _isStringsAndNaN(values):
+    if pandas.api.types.infer_dtype(values, skipna=True) != 'string':
+        return False
+    na = pandas.isna(values)
+    return not na.any() or pandas.api.types.infer_dtype(values[na], skipna=False) == 'floating'
+
+# return array of str() of each of object array values, with "nan" replaced by an empty string
+def _toStrings(values):
+    strings = pandas.Series(values, dtype=object).astype(str).to_numpy(dtype=object)
+    strings[strings == "nan"] = "" # string conversion converts NaN values to "nan"
+    return strings
+
+# For each column in list cols, convert string values to a pandas Categorical whose
+# categories are the shared categories Index, extended with any new values. Columns
+# converted with the same categories compare and join on integer codes.
+# Returns the extended categories.
+def forceCategoricalDatatype(dataframe, cols, categories):
+    for col in cols:
+        categories = categories.append(pandas.Index(dataframe[col].unique()).difference(categories))
+        dataframe[col] = pandas.Categorical(dataframe[col], categories=categories)
+    return categories
+
+# Integer key of each row of each of dataframes, equal for rows with equal values in all of cols,
+# for joining dataframes on several columns without building tuples of values. cols must be
+# categoricals converted by forceCategoricalDatatype() with one shared categories Index: as it only
+# grows, each column's categories start the latest categories, and a value has the same code in each.
+# Returns a list of int64 arrays, one per dataframe, or None if cols aren't such categoricals.
+def categoryKeys(dataframes, cols):
+    dtypes = [df[col].dtype for df in dataframes for col in cols]
+    if not all(isinstance(dtype, pandas.CategoricalDtype) for dtype in dtypes):
+        return None
+    categories = max((dtype.categories for dtype in dtypes), key=len)
+    if not all(categories[:len(dtype.categories)].equals(dtype.categories) for dtype in dtypes):
+        return None
+    base = len(categories) + 1 # codes + 1, so missing values (code -1) have a key too
+    if base ** len(cols) > numpy.iinfo(numpy.int64).max:
+        return None
+    keys = []
+    for df in dataframes:
+        key = numpy.zeros(len(df), dtype=numpy.int64)
+        for col in cols:
+            key = key * base + df[col].cat.codes.to_numpy(dtype=numpy.int64) + 1
+        keys.append(key)
+    return keys
+
+# Columns of a dataframe copied into one block of shared memory, so that worker processes
+# can take rows of the dataframe without it being pickled. Numeric and boolean columns are
+# stored as-is, categorical columns as their codes and other (object) columns as integer
+# codes into their unique values, which are pickled with the SharedDataFrame. Pickling a
+# SharedDataFrame doesn't copy the shared memory: it's attached by name when rows are taken.
+# The creating process is responsible for calling unlink() once workers are done with it.
+class SharedDataFrame:
+    def __init__(self, dataframe):
+        self.length = len(dataframe)
+        self.columns = [] # (column name, kind, buffer dtype, buffer offset, values or dtype of values)
+        buffers = []
+        size = 0
+        for name in dataframe.columns:
+            series = dataframe[name]
+            if isinstance(series.dtype, pandas.CategoricalDtype):
+                kind, buffer, values = 'categorical', series.cat.codes.to_numpy(), series.dtype
+            elif isinstance(series.dtype, numpy.dtype) and series.dtype.kind in 'biufcmM':
+                kind, buffer, values = 'numpy', series.to_numpy(), None
+            else:
+                codes, uniques = pandas.factorize(series, use_na_sentinel=True)
+                kind, buffer, values = 'object', codes, numpy.append(numpy.asarray(uniques, dtype=object), numpy.nan)
+            self.columns.append((name, kind, buffer.dtype, size, values))
+            buffers.append(buffer)
+            size += -(-buffer.nbytes // 8) * 8 # keep buffers 8-byte aligned
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.name = self.shm.name
+        for (_, _, dtype, offset, _), buffer in zip(self.columns, buffers):
+            numpy.ndarray(self.length, dtype=dtype, buffer=self.shm.buf, offset=offset)[:] = buffer
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shm'] = None
+        return state
+
+    # return a dataframe of the rows at positions, an array of row positions
+    def take(self, positions):
+        shm = self.shm if self.shm is not None else shared_memory.SharedMemory(name=self.name)
+        try:
+            columns = {}
+            for name, kind, dtype, offset, values in self.columns:
+                buffer = numpy.ndarray(self.length, dtype=dtype, buffer=shm.buf, offset=offset)
+                taken = buffer.take(positions)
+                del buffer # release shared memory for close()
+                if kind == 'categorical':
+                    columns[name] = pandas.Categorical.from_codes(taken, dtype=values)
+                elif kind == 'object':
+                    columns[name] = values[taken] # NaN code -1 takes appended NaN
+                else:
+                    columns[name] = taken
+            return pandas.DataFrame(columns)
+        finally:
+            if shm is not self.shm:
+                shm.close()
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+
 
 # legacy tabularImport methods - just in case
 # """ strip whitespace from dataframe cells """ 
@@ -163,25 +440,131 @@ class Tests(unittest.TestCase):
         df = readFile("../testdata/GLAD9_SectionSummary.csv")
         self.assertFalse(df.empty)
         
+    def test_readFile_engines(self):
+        df = readFile("../testdata/GLAD9_Site1_XRF.csv", na_values=['?', '??', '???'])
+        pythonDF = readFile("../testdata/GLAD9_Site1_XRF.csv", na_values=['?', '??', '???'], engine='python')
+        self.assertTrue(df.equals(pythonDF))
+        self.assertTrue(df.dtypes.equals(pythonDF.dtypes))
+
+    def test_readFile_schema(self):
+        df = readFile("../testdata/GLAD9_SectionSummary.csv")
+        for engine in ['c', 'python']:
+            schemaDF = readFile("../testdata/GLAD9_SectionSummary.csv", engine=engine, usecols=['Core', 'TopDepth'], dtype={'TopDepth': numpy.float32})
+            self.assertTrue(list(schemaDF.columns) == ['Core', 'TopDepth'])
+            self.assertTrue(schemaDF.TopDepth.dtype == numpy.float32)
+            self.assertTrue(schemaDF.Core.equals(df.Core))
+            self.assertTrue(numpy.allclose(schemaDF.TopDepth, df.TopDepth))
+
+    def test_readFile_sep(self): # semicolon-delimited, with decimal commas
+        for engine, sep in [(None, ';'), ('python', ';'), (None, r'\s*;\s*')]: # regex sep: c engine fails, python reads
+            df = readFile("../testdata/semicolon_decimal_comma.csv", sep=sep, engine=engine)
+            self.assertTrue(list(df.columns) == ['Depth, m', 'Label, text'])
+            self.assertTrue(list(df['Label, text']) == ['a,b', 'c,d'])
+
+    def test_sniffDelimiter(self):
+        self.assertTrue(sniffDelimiter("../testdata/GLAD9_SectionSummary.csv") == ',')
+        self.assertTrue(sniffDelimiter("../testdata/utf8_bom_blanklines.csv") == ',')
+
+    def test_sniffHeader(self):
+        global HeadSampleSize
+        sampleSize = HeadSampleSize
+        try:
+            for HeadSampleSize in [sampleSize, 600, 30]: # header and first row in sample, header only, neither
+                for path in ["../testdata/GLAD9_Site1_XRF.csv", "../testdata/utf8_bom_blanklines.csv", "../testdata/utf8err.csv"]:
+                    header = sniffHeader(path)
+                    df = readFileMinimal(path)
+                    self.assertTrue(header.columns == list(df.columns))
+                    self.assertTrue(header.getNumericColumns() == [col for col in df.columns if isNumeric(df[col].dtype)])
+        finally:
+            HeadSampleSize = sampleSize
+        self.assertTrue(sniffHeader("../testdata/GLAD9_Site1_XRF.csv").delimiter == ',')
+
     def test_readHeaders(self):
         hs = readHeaders("../testdata/GLAD9_SectionSummary.csv")
         self.assertTrue(len(hs) == 10)
         self.assertTrue('Site' in hs)
         self.assertTrue('CuratedLength' in hs)
         
+    def test_readFileChunks(self):
+        df = readFile("../testdata/GLAD9_SectionSummary.csv")
+        chunks = list(readFileChunks("../testdata/GLAD9_SectionSummary.csv", 100))
+        self.assertTrue(len(chunks) == (len(df) + 99) // 100)
+        self.assertTrue(pandas.concat(chunks).equals(df))
+        dtypes = {col: 'float64' for col in ['Sec Depth (cm)', 'Ce', 'P', 'Pm', 'Sn']} # columns of integers with empty values
+        dtypes['Section'] = str
+        df = readFile("../testdata/GLAD9_Site1_XRF.csv", dtype=dtypes)
+        chunks = list(readFileChunks("../testdata/GLAD9_Site1_XRF.csv", 1000, dtype=dtypes))
+        self.assertTrue(all(chunk.dtypes.equals(df.dtypes) for chunk in chunks))
+        self.assertTrue(pandas.concat(chunks).equals(df))
+
     def test_utf8err(self):
         df = readFile("../testdata/utf8err.csv")
         self.assertTrue(len(df) == 2)
+
+    def test_utf8err_past_sample(self): # the whole file is read again in FallbackEncoding
+        global HeadSampleSize
+        sampleSize, HeadSampleSize = HeadSampleSize, 16
+        try:
+            with self.assertLogs(level='WARNING') as logs:
+                df = readFile("../testdata/utf8err.csv")
+            self.assertTrue(df.equals(readFile("../testdata/utf8err.csv", encoding=FallbackEncoding)))
+            self.assertTrue("Couldn't decode file in utf-8-sig encoding" in logs.output[0])
+            self.assertTrue(pandas.concat(readFileChunks("../testdata/utf8err.csv", 1)).equals(df))
+        finally:
+            HeadSampleSize = sampleSize
         
     def test_utf8bom_blanklines(self):
         df = readFile("../testdata/utf8_bom_blanklines.csv")
         self.assertTrue(len(df) == 4)
+        self.assertTrue(df.columns[0] == 'Site')
 
     def test_getColumnStartingWith(self):
         df = readFile("../testdata/GLAD9_Site1_XRF.csv")
         lastidx = getFirstColumnStartingWith(df, "Sediment Depth")
         self.assertTrue(lastidx == 10)
 
+    def test_forceStringDatatype(self):
+        df = pandas.DataFrame({'Float': [1.0, numpy.nan, -0.0, 0.0, 0.5], 'Int': [1, 2, 3, 4, 5],
+                               'Str': ['A', numpy.nan, 'nan', 'B', 'A'], 'Mixed': [1, 'A', None, numpy.nan, 2.5]})
+        forceStringDatatype(df, list(df.columns))
+        self.assertTrue(df.Float.tolist() == ['1.0', '', '-0.0', '0.0', '0.5'])
+        self.assertTrue(df.Int.tolist() == ['1', '2', '3', '4', '5'])
+        self.assertTrue(df.Str.tolist() == ['A', '', '', 'B', 'A'])
+        self.assertTrue(df.Mixed.tolist() == ['1', 'A', 'None', '', '2.5'])
+        self.assertTrue(all(df[col].dtype == object for col in df))
+
+    def test_forceCategoricalDatatype(self):
+        df1 = pandas.DataFrame({'Site': ['1', '1', '2'], 'Hole': ['A', 'B', 'A']})
+        df2 = pandas.DataFrame({'Site': ['3', '1']})
+        cats = forceCategoricalDatatype(df1, ['Site', 'Hole'], pandas.Index([]))
+        cats = forceCategoricalDatatype(df2, ['Site'], cats)
+        self.assertTrue(list(cats) == ['1', '2', 'A', 'B', '3'])
+        self.assertTrue(list(df1.Site == '1') == [True, True, False])
+        self.assertTrue(df1.Hole.cat.codes.tolist() == [2, 3, 2])
+        self.assertTrue(df1.to_csv(index=False) == "Site,Hole\n1,A\n1,B\n2,A\n")
+
+    def test_categoryKeys(self):
+        df1 = pandas.DataFrame({'Site': ['1', '1', '2'], 'Hole': ['A', 'B', '']})
+        df2 = pandas.DataFrame({'Site': ['3', '1', '2'], 'Hole': ['A', 'B', '']})
+        cats = forceCategoricalDatatype(df1, ['Site', 'Hole'], pandas.Index([], dtype=object))
+        self.assertTrue(categoryKeys([df1, df2], ['Site', 'Hole']) is None) # df2 isn't categorical
+        forceCategoricalDatatype(df2, ['Site', 'Hole'], cats) # extends categories with '3'
+        keys1, keys2 = categoryKeys([df1, df2], ['Site', 'Hole'])
+        self.assertTrue(len(set(keys1)) == 3 and keys1[0] != keys2[0] and keys1[1] == keys2[1] and keys1[2] == keys2[2])
+        forceCategoricalDatatype(df2, ['Site'], pandas.Index(['3', '1', '2'], dtype=object)) # other categories
+        self.assertTrue(categoryKeys([df1, df2], ['Site', 'Hole']) is None)
+
+    def test_SharedDataFrame(self):
+        df = readFile("../testdata/GLAD9_Site1_XRF.csv")
+        forceCategoricalDatatype(df, ['Hole'], pandas.Index([], dtype=object))
+        shared = SharedDataFrame(df)
+        try:
+            positions = numpy.array([5, 0, len(df) - 1])
+            self.assertTrue(shared.take(positions).equals(df.take(positions).reset_index(drop=True)))
+            self.assertTrue(shared.take(numpy.arange(len(df))).to_csv(index=False) == df.to_csv(index=False))
+        finally:
+            shared.unlink()
+
     def test_getLastColumnStartingWith(self):
         df = readFile("../testdata/GLAD9_Site1_XRF.csv")
         lastidx = getLastColumnStartingWith(df, "Sediment Depth")
@@ -0,0 +1,159 @@
+'''
+Created on Oct 17, 2026
+
+Declarative validation of tabular data: a format's rules are vectorized
+checks over whole columns of a dataframe with the format's column names,
+each finding the rows that break it.
+'''
+
+import unittest
+
+import numpy
+import pandas
+
+# ValidationRule severities: data with ERROR failures can't be used, WARNING failures are reported
+ERROR = 'error'
+WARNING = 'warning'
+
+# A named check of a dataframe. findRows is a function of a dataframe returning a boolean
+# array or Series marking the rows that break the rule. The rule applies only to dataframes
+# with all of its columns, so rules for optional columns are skipped if they're missing.
+class ValidationRule:
+    def __init__(self, name, columns, findRows, severity=ERROR):
+        self.name = name
+        self.columns = columns
+        self.findRows = findRows
+        self.severity = severity
+
+    def appliesTo(self, dataframe):
+        return all(col in dataframe for col in self.columns)
+
+    def isError(self):
+        return self.severity == ERROR
+
+    def __repr__(self):
+        return "rule:" + self.name
+
+# Offending rows of each rule of a validation run that found any
+class ValidationReport:
+    MaxListedRows = 10 # row indices listed per rule by __str__()
+
+    def __init__(self):
+        self.failures = [] # list of (ValidationRule, numpy array of offending row index values) tuples
+
+    def addFailure(self, rule, rows):
+        self.failures.append((rule, rows))
+
+    def getErrors(self):
+        return [(rule, rows) for rule, rows in self.failures if rule.isError()]
+
+    def getWarnings(self):
+        return [(rule, rows) for rule, rows in self.failures if not rule.isError()]
+
+    def isValid(self):
+        return len(self.getErrors()) == 0
+
+    @classmethod
+    def describe(cls, failures):
+        lines = []
+        for rule, rows in failures:
+            listed = ", ".join(str(row) for row in rows[:cls.MaxListedRows])
+            more = ", ..." if len(rows) > cls.MaxListedRows else ""
+            lines.append("{}: {} row(s) [{}{}]".format(rule.name, len(rows), listed, more))
+        return "\n".join(lines)
+
+    def __str__(self):
+        return self.describe(self.failures)
+
+# Run rules over dataframe, returning a ValidationReport of the index values of offending rows
+def validate(dataframe, rules):
+    report = ValidationReport()
+    for rule in rules:
+        if not rule.appliesTo(dataframe):
+            continue
+        offending = numpy.asarray(rule.findRows(dataframe), dtype=bool)
+        if offending.any():
+            report.addFailure(rule, dataframe.index.to_numpy()[offending])
+    return report
+
+
+# Rule builders. Values compared by rules are read with pandas' NaN semantics, e.g. a row with
+# an empty depth passes lessThan() and nonNegative(), and requiredValues() catches it.
+
+IntegerPattern = r'\s*[+-]?\d+\s*' # strings int() accepts, bar underscores
+
+# each value of col is an integer, or a string int() converts, or one of values e.g. 'CC' (core catcher)
+def integerOrValues(col, values, severity=ERROR):
+    def findRows(df):
+        codes, uniques = pandas.factorize(df[col]) # few distinct sections, check each once
+        strings = pandas.Series(numpy.asarray(uniques, dtype=object)).astype(str)
+        valid = strings.str.fullmatch(IntegerPattern) | strings.isin(values)
+        return ~numpy.append(valid.to_numpy(dtype=bool), False)[codes] # NaN values have code -1
+    return ValidationRule("{} column contains values other than integers and {}".format(col, ", ".join(values)), [col], findRows, severity)
+
+# no value of col is missing
+def requiredValues(col, severity=ERROR):
+    def findRows(df):
+        values = df[col]
+        return values.isna() | (values.astype(str) == "")
+    return ValidationRule("{} column is missing values".format(col), [col], findRows, severity)
+
+# topCol < bottomCol in each row
+def lessThan(topCol, bottomCol, severity=WARNING):
+    return ValidationRule("{} isn't less than {}".format(topCol, bottomCol), [topCol, bottomCol],
+                          lambda df: df[topCol] >= df[bottomCol], severity)
+
+# col >= 0 in each row
+def nonNegative(col, severity=WARNING):
+    return ValidationRule("{} is negative".format(col), [col], lambda df: df[col] < 0, severity)
+
+# each combination of values in keyCols is in one row only
+def uniqueKeys(keyCols, severity=WARNING):
+    return ValidationRule("Duplicate {} rows".format("/".join(keyCols)), keyCols,
+                          lambda df: df.duplicated(keyCols, keep=False), severity)
+
+# Within each group of rows with the same groupCols values, in row order, each row's
+# topCol is at or below the preceding row's bottomCol, i.e. the rows' intervals don't overlap
+def noOverlaps(topCol, bottomCol, groupCols, severity=WARNING):
+    def findRows(df):
+        prevBottoms = df.groupby(groupCols, sort=False, observed=True)[bottomCol].shift()
+        return df[topCol] < prevBottoms
+    return ValidationRule("{}-{} interval overlaps the preceding interval".format(topCol, bottomCol), [topCol, bottomCol] + groupCols, findRows, severity)
+
+# each combination of keyCols values is in otherdf's otherKeyCols (default keyCols)
+def keysIn(keyCols, otherdf, otherName, otherKeyCols=None, severity=WARNING):
+    otherKeyCols = keyCols if otherKeyCols is None else otherKeyCols
+    def findRows(df):
+        keys = pandas.MultiIndex.from_frame(df[keyCols].astype(str))
+        return ~keys.isin(pandas.MultiIndex.from_frame(otherdf[otherKeyCols].astype(str)))
+    return ValidationRule("{} not found in {}".format("/".join(keyCols), otherName), keyCols, findRows, severity)
+
+
+class Tests(unittest.TestCase):
+    def test_integer_or_values(self):
+        df = pandas.DataFrame({'Section': ['1', ' 2', 'CC', '1.0', 'A', '', float('nan'), '12']}, index=range(10, 18))
+        report = validate(df, [integerOrValues('Section', ['CC'])])
+        self.assertTrue(list(report.failures[0][1]) == [13, 14, 15, 16]) # index values of offending rows
+        self.assertFalse(report.isValid())
+        df['Section'] = df.Section.astype('category')
+        self.assertTrue(list(validate(df, [integerOrValues('Section', ['CC'])]).failures[0][1]) == [13, 14, 15, 16])
+        self.assertTrue(validate(pandas.DataFrame({'Section': [1, 2]}), [integerOrValues('Section', ['CC'])]).isValid())
+
+    def test_rules(self):
+        df = pandas.DataFrame({'Site': ['1', '1', '1', '2', '2'], 'Core': ['1', '2', '2', '1', '2'],
+                               'Top': [0.0, 1.0, 1.5, 0.0, 2.0], 'Bottom': [1.0, 2.0, 1.5, 3.0, float('nan')]})
+        self.assertTrue(list(lessThan('Top', 'Bottom').findRows(df)) == [False, False, True, False, False])
+        self.assertTrue(list(nonNegative('Top').findRows(df.assign(Top=df.Top - 0.5))) == [True, False, False, True, False])
+        self.assertTrue(list(uniqueKeys(['Site', 'Core']).findRows(df)) == [False, True, True, False, False])
+        self.assertTrue(list(noOverlaps('Top', 'Bottom', ['Site']).findRows(df)) == [False, False, True, False, True])
+        other = pandas.DataFrame({'Site': [1, 2], 'Core': [2, 1]})
+        self.assertTrue(list(keysIn(['Site', 'Core'], other, "Other").findRows(df)) == [True, False, False, False, True])
+        self.assertTrue(list(requiredValues('Bottom').findRows(df)) == [False, False, False, False, True])
+
+        report = validate(df, [lessThan('Top', 'Bottom'), uniqueKeys(['Site', 'Core']), nonNegative('Missing')])
+        self.assertTrue(report.isValid()) # warnings only, rule for missing column skipped
+        self.assertTrue([rule.name for rule, _ in report.getWarnings()] == ["Top isn't less than Bottom", "Duplicate Site/Core rows"])
+        self.assertTrue(str(report).splitlines()[1] == "Duplicate Site/Core rows: 2 row(s) [1, 2]")
+
+if __name__ == "__main__":
+    unittest.main()